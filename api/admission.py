@@ -0,0 +1,142 @@
+import asyncio
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import asyncpg
+
+from .statement import registry
+
+registry.register('enroll_course', '''
+select enroll_course($1, $2, $3, $4)
+''', hot=True)
+registry.register('enroll_courses', '''
+select * from enroll_courses($1, $2, $3, $4)
+''', hot=True)
+
+BATCH_SIZE = 64
+
+# student id, passed hint, prerequisite hint, waiter
+_request = Tuple[int, Optional[bool], Optional[bool], asyncio.Future]
+
+
+class section_admission:
+    # Enrollments into one section are queued and committed in batches by a
+    # single drainer, so a rush on a hot section costs one round trip and
+    # one lock on its row per batch instead of one per request. The seat
+    # counts kept here are only a view: enroll_course stays the authority
+    # and every batch reports section.left_capacity back. Once the view
+    # shows a section exhausted, a request whose earlier checks the caller
+    # can settle in process is answered without the database.
+    def __init__(self, pool: asyncpg.Pool, batch_size: int = BATCH_SIZE):
+        self.__pool = pool
+        self.__batch_size = batch_size
+        self.__left: Dict[int, int] = {}
+        # section id -> semester id, of the sections in the view
+        self.__semester: Dict[int, int] = {}
+        self.__queue: Dict[int, List[_request]] = {}
+        self.__draining: Set[int] = set()
+        # the loop keeps only weak references to tasks, these are ours
+        self.__tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.requests = 0
+        self.exhausted = 0
+        self.settled = 0
+
+    async def enroll(self, student_id: int, section_id: int,
+                     passed: Optional[bool], pre_ok: Optional[bool],
+                     settle: Optional[Callable[[int], Optional[str]]] = None) \
+            -> str:
+        # settle(semester id) answers a request to an exhausted section in
+        # process, or returns None to leave it to enroll_course
+        self.requests += 1
+        if self.__left.get(section_id, 1) <= 0:
+            # exhausted, the answer is COURSE_IS_FULL unless an earlier
+            # check fails; enroll_course decides that read-only, so there
+            # is no need to wait behind the queue
+            self.exhausted += 1
+            res = settle(self.__semester[section_id]) if settle else None
+            if res is not None:
+                self.settled += 1
+                return res
+            async with self.__pool.acquire() as con:
+                res = await registry.fetchval(con, 'enroll_course',
+                                              student_id, section_id,
+                                              passed, pre_ok)
+            if res == 'SUCCESS':
+                # a seat was released elsewhere
+                self.discard(section_id)
+            return res
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self.__queue.setdefault(section_id, []).append(
+            (student_id, passed, pre_ok, waiter))
+        if section_id not in self.__draining:
+            self.__draining.add(section_id)
+            task = loop.create_task(self.__drain(section_id))
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+        return await waiter
+
+    def release(self, section_id: int):
+        # a seat of the section was given back by drop_course
+        if section_id in self.__left:
+            self.__left[section_id] += 1
+
+    def discard(self, section_id: int):
+        # seats moved elsewhere, the next batch reports them again
+        self.__left.pop(section_id, None)
+        self.__semester.pop(section_id, None)
+
+    def clear(self):
+        # sections were deleted
+        self.__left.clear()
+        self.__semester.clear()
+
+    async def __drain(self, section_id: int):
+        queue = self.__queue[section_id]
+        batch: List[_request] = []
+        try:
+            while queue:
+                batch = queue[:self.__batch_size]
+                del queue[:self.__batch_size]
+                await self.__commit(section_id, batch)
+        finally:
+            self.__draining.discard(section_id)
+            self.__queue.pop(section_id, None)
+            # cancelled, e.g. at shutdown: nobody would answer the waiters
+            for r in batch + queue:
+                if not r[3].done():
+                    r[3].cancel()
+
+    async def __commit(self, section_id: int, batch: List[_request]):
+        self.batches += 1
+        try:
+            async with self.__pool.acquire() as con:
+                res = await registry.fetchrow(
+                    con, 'enroll_courses', [r[0] for r in batch],
+                    section_id, [r[1] for r in batch],
+                    [r[2] for r in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][3].done():
+                    batch[0][3].set_exception(e)
+                return
+            # one failing request rolled back the whole batch, retry each
+            # on its own so only that one sees the error
+            for r in batch:
+                await self.__commit(section_id, [r])
+            return
+        if res['left_capacity'] is None:
+            self.discard(section_id)
+        else:
+            self.__left[section_id] = res['left_capacity']
+            self.__semester[section_id] = res['semester']
+        for r, result in zip(batch, res['results']):
+            if not r[3].done():
+                r[3].set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        return {'requests': self.requests,
+                'batches': self.batches,
+                'exhausted': self.exhausted,
+                'settled': self.settled,
+                'sections': len(self.__left)}
@@ -0,0 +1,48 @@
+from typing import (AsyncIterable, AsyncIterator, Callable, Iterable, List,
+                    Sequence, Union)
+
+import asyncpg
+
+from .metrics import timed
+
+CHUNK_SIZE = 10000
+
+Records = Union[Iterable, AsyncIterable]
+
+
+async def chunks(records: Records, size: int = CHUNK_SIZE) \
+        -> AsyncIterator[List]:
+    # accept both plain and async iterables so callers can stream rows
+    # from a generator without materializing the whole batch
+    chunk = []
+    if hasattr(records, '__aiter__'):
+        async for r in records:
+            chunk.append(r)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    else:
+        for r in records:
+            chunk.append(r)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+async def copy_staged(con: asyncpg.Connection,
+                      table: str,
+                      columns: Sequence[str],
+                      records: Records,
+                      convert: Callable[..., tuple]) -> int:
+    # stream records into a staging table created by the caller, tagging
+    # each row with its input position in an extra `idx` column
+    n = 0
+    async for chunk in chunks(records):
+        await timed(con.copy_records_to_table(
+            table,
+            records=[(n + i,) + convert(*r) for i, r in enumerate(chunk)],
+            columns=('idx',) + tuple(columns)))
+        n += len(chunk)
+    return n
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Dict, Hashable, Optional
+
+
+class lru:
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.__data: OrderedDict = OrderedDict()
+        self.__maxsize = maxsize
+        # seconds an entry is served after its put, forever if None
+        self.__ttl = ttl
+        self.__expiry: Dict[Hashable, float] = {}
+        # a value read before its key was discarded may be stale and is not
+        # stored: every discard stamps its key with the next tick of the
+        # clock, the oldest stamps beyond maxsize are folded into the floor
+        # and reject every load begun before them
+        self.__clock = 0
+        self.__discarded: OrderedDict = OrderedDict()
+        self.__floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __expired(self, key: Hashable) -> bool:
+        return self.__ttl is not None and self.__expiry[key] <= monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self.__data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if self.__expired(key):
+            self.discard(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.__data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        # look without touching the counters or the eviction order
+        if key not in self.__data or self.__expired(key):
+            return default
+        return self.__data[key]
+
+    def token(self) -> int:
+        # taken before loading a value, handed to put with it
+        return self.__clock
+
+    def current(self, key: Hashable, token: int) -> bool:
+        # whether key was neither discarded nor cleared since token
+        return token >= self.__floor and self.__discarded.get(key, 0) <= token
+
+    def put(self, key: Hashable, value: Any, token: Optional[int] = None):
+        if token is not None and not self.current(key, token):
+            return
+        self.__data[key] = value
+        self.__data.move_to_end(key)
+        if self.__ttl is not None:
+            self.__expiry[key] = monotonic() + self.__ttl
+        while len(self.__data) > self.__maxsize:
+            old, _ = self.__data.popitem(last=False)
+            self.__expiry.pop(old, None)
+            self.evictions += 1
+
+    def discard(self, key: Hashable):
+        self.__data.pop(key, None)
+        self.__expiry.pop(key, None)
+        self.__clock += 1
+        self.__discarded[key] = self.__clock
+        self.__discarded.move_to_end(key)
+        if len(self.__discarded) > self.__maxsize:
+            _, self.__floor = self.__discarded.popitem(last=False)
+
+    def clear(self):
+        self.__data.clear()
+        self.__expiry.clear()
+        self.__clock += 1
+        self.__floor = self.__clock
+        self.__discarded.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__data
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self.__data),
+                'maxsize': self.__maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
@@ -1,52 +1,165 @@
-from typing import List, Optional
+from typing import Iterable, List, Optional, Tuple
 
 import asyncpg
-from dto import (AndPrerequisite, Course, CourseGrading, CoursePrerequisite,
-                 CourseSection, CourseSectionClass, DayOfWeek, Department,
-                 Instructor, Major, OrPrerequisite, Prerequisite, Student)
+from dto import (Course, CourseGrading, CourseSection, CourseSectionClass,
+                 DayOfWeek, Department, Instructor, Major, Prerequisite,
+                 Student)
 from exception import EntityNotFoundError, IntegrityViolationError
 from service.course_service import CourseService
 
+from .admission import section_admission
+from .bulk import chunks
+from .cache import lru
+from .course_table import course_table_cache
+from .occupancy import occupancy_cache
+from .metrics import timed
+from .prerequisite import nodes, prerequisite_cache
+from .reference import SECTIONS, reference_cache
+from .statement import registry
+from .takes import Grades, forget_takes
+
+registry.register('add_course', '''
+insert into course (id, name, credit, class_hour, grading)
+values ($1, $2, $3, $4, $5)
+''', hot=True)
+registry.register('add_prerequisite', '''
+insert into prerequisite (id, idx, val, ptr)
+values ($1, $2, $3, $4)
+''', hot=True)
+registry.register('add_course_section', '''
+insert into section (course, semester, name, total_capacity, left_capacity)
+values ($1, $2, $3, $4, $4)
+    returning id
+''', hot=True)
+registry.register('add_course_section_class', '''
+insert into class (section, instructor, day_of_week, week_list, class_begin,
+    class_end, location)
+values ($1, $2, $3, $4, $5, $6, $7)
+    returning id, (select semester from section where id = $1)
+''', hot=True)
+registry.register('allocate_section_ids', '''
+select nextval(pg_get_serial_sequence('section', 'id'))
+from generate_series(1, $1)
+''')
+registry.register('allocate_class_ids', '''
+select nextval(pg_get_serial_sequence('class', 'id'))
+from generate_series(1, $1)
+''')
+registry.register('get_section_semesters', '''
+select distinct semester from section where id = any($1::integer[])
+''')
+# the takes rows a delete cascades to are read from the snapshot before it,
+# one row with null takes columns if there were none, no row if not found
+registry.register('remove_course', '''
+with gone as (
+    delete from course where id = $1
+    returning id
+)
+select gone.id, section.semester, takes.student_id, takes.section_id
+from gone
+    left join section on section.course = gone.id
+    left join takes on takes.section_id = section.id
+''')
+registry.register('remove_course_section', '''
+with gone as (
+    delete from section where id = $1
+    returning id, semester
+)
+select gone.id, gone.semester, takes.student_id, takes.section_id
+from gone
+    left join takes on takes.section_id = gone.id
+''')
+registry.register('remove_course_section_class', '''
+delete from class where id = $1
+    returning section, (select semester from section
+                        where section.id = class.section)
+''')
+registry.register('get_all_courses', 'select * from course')
+registry.register('get_course_sections_in_semester', '''
+select *
+from section
+where course = $1 and semester = $2
+''')
+registry.register('get_course_by_section', '''
+select *
+from course
+where id = (select course from section where section.id = $1)
+''', hot=True)
+registry.register('get_course_section_by_class', '''
+select *
+from section
+where id = (select section from class where class.id = $1)
+''', hot=True)
+registry.register('get_course_section_classes', '''
+select class.id, instructor, full_name, day_of_week,
+    week_list, class_begin, class_end, location
+from class
+    join instructor on class.instructor = instructor.id
+where section = $1
+''', hot=True)
+registry.register('get_enrolled_students_in_semester', '''
+select student.id, full_name, enrolled_date, major, major.name as
+    major_name, department, department.name as department_name
+from student
+    join takes on student.id = student_id
+    join section on section_id = section.id
+    join major on major = major.id
+    join department on department = department.id
+where course = $1 and semester = $2
+''')
+
+
+# the week and period masks of class (cs307.sql) hold weeks 0..63 and
+# periods 0..29, a class outside them is refused before it is written
+CLASS_WEEKS = 64
+CLASS_PERIODS = 30
+
+
+def check_class(week_list: List[int], class_begin: int, class_end: int):
+    weeks = [w for w in week_list if not 0 <= w < CLASS_WEEKS]
+    if weeks:
+        raise IntegrityViolationError(
+            f'weeks {weeks} are outside 0..{CLASS_WEEKS - 1}')
+    if class_begin < 0 or class_end >= CLASS_PERIODS:
+        raise IntegrityViolationError(
+            f'periods {class_begin}..{class_end} are outside '
+            f'0..{CLASS_PERIODS - 1}')
+
 
 class course_service(CourseService):
 
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool,
+                 prerequisites: Optional[prerequisite_cache] = None,
+                 occupancy: Optional[occupancy_cache] = None,
+                 course_tables: Optional[course_table_cache] = None,
+                 references: Optional[reference_cache] = None,
+                 passed: Optional[lru] = None,
+                 grades: Optional[Grades] = None,
+                 admission: Optional[section_admission] = None):
         self.__pool = pool
+        self.__prerequisites = prerequisites or prerequisite_cache()
+        self.__occupancy = occupancy or occupancy_cache()
+        self.__course_tables = course_tables or course_table_cache()
+        self.__references = references or reference_cache()
+        # of the student service, enrollments go with sections
+        self.__passed = passed if passed is not None else lru(1 << 16)
+        self.__grades = grades if grades is not None else {}
+        self.__admission = admission or section_admission(pool)
 
     async def add_course(self, course_id: str, course_name: str, credit: int,
                          class_hour: int, grading: CourseGrading,
                          prerequisite: Optional[Prerequisite]):
         async with self.__pool.acquire() as con:
             try:
-                await con.execute('''
-                insert into course (id, name, credit, class_hour, grading)
-                values ('%s', '%s', %d, %d, '%s')
-                ''' % (course_id, course_name, credit, class_hour, grading.name
-                       ))
-                if prerequisite:
-                    stack = [(0, prerequisite)]
-                    cnt = 0
-                    while stack:
-                        i, p = stack.pop()
-                        if isinstance(p, CoursePrerequisite):
-                            await con.execute('''
-                            insert into prerequisite (id, idx, val)
-                            values ('%s', %d, '%s')
-                            ''' % (course_id, i, p.course_id))
-                        else:
-                            if isinstance(p, AndPrerequisite):
-                                v = 'AND'
-                            if isinstance(p, OrPrerequisite):
-                                v = 'OR'
-                            ptr = []
-                            for c in p.terms:
-                                cnt += 1
-                                ptr.append(cnt)
-                                stack.append((cnt, c))
-                            await con.execute('''
-                            insert into prerequisite (id, idx, val, ptr)
-                            values ('%s', %d, '%s', array%s)
-                            ''' % (course_id, i, v, ptr))
+                async with con.transaction():
+                    await registry.execute(con, 'add_course', course_id,
+                                           course_name, credit, class_hour,
+                                           grading.name)
+                    if prerequisite:
+                        await registry.executemany(
+                            con, 'add_prerequisite',
+                            [(course_id,) + n for n in nodes(prerequisite)])
+                self.__prerequisites.put(course_id, prerequisite)
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
@@ -55,13 +168,11 @@ class course_service(CourseService):
                                  ) -> int:
         async with self.__pool.acquire() as con:
             try:
-                return await con.fetchval('''
-                insert into section (course, semester, name, total_capacity, \
-                    left_capacity)
-                values ('%s', %d, '%s', %d, %d)
-                    returning id
-                ''' % (course_id, semester_id, section_name, total_capacity,
-                       total_capacity))
+                section_id = await registry.fetchval(
+                    con, 'add_course_section', course_id, semester_id,
+                    section_name, total_capacity)
+                self.__prerequisites.put_section(section_id, course_id)
+                return section_id
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
@@ -72,39 +183,163 @@ class course_service(CourseService):
                                        class_begin: int,
                                        class_end: int,
                                        location: str) -> int:
+        check_class(week_list, class_begin, class_end)
+        async with self.__pool.acquire() as con:
+            try:
+                class_id, semester_id = await registry.fetchrow(
+                    con, 'add_course_section_class', section_id,
+                    instructor_id, day_of_week.name, week_list, class_begin,
+                    class_end, location)
+                self.__occupancy.discard(semester_id)
+                self.__course_tables.clear()
+                self.__references.discard('classes', section_id)
+                return class_id
+            except asyncpg.exceptions.IntegrityConstraintViolationError as e:
+                raise IntegrityViolationError from e
+
+    async def add_courses(
+            self,
+            courses: Iterable[Tuple[str, str, int, int, CourseGrading,
+                                    Optional[Prerequisite]]]):
+        # copied chunk by chunk in one transaction; the prerequisites are
+        # cached as they go and forgotten again if it rolls back
+        added = []
+        async with self.__pool.acquire() as con:
+            try:
+                async with con.transaction():
+                    async for chunk in chunks(courses):
+                        await timed(con.copy_records_to_table(
+                            'course',
+                            records=[(c[0], c[1], c[2], c[3], c[4].name)
+                                     for c in chunk],
+                            columns=('id', 'name', 'credit', 'class_hour',
+                                     'grading')))
+                        await timed(con.copy_records_to_table(
+                            'prerequisite',
+                            records=[(c[0],) + n for c in chunk if c[5]
+                                     for n in nodes(c[5])],
+                            columns=('id', 'idx', 'val', 'ptr')))
+                        for c in chunk:
+                            added.append(c[0])
+                            self.__prerequisites.put(c[0], c[5])
+            except asyncpg.exceptions.IntegrityConstraintViolationError as e:
+                for course_id in added:
+                    self.__prerequisites.discard(course_id)
+                raise IntegrityViolationError from e
+
+    async def add_course_sections(
+            self,
+            sections: Iterable[Tuple[str, int, str, int]]) -> List[int]:
+        ids = []
         async with self.__pool.acquire() as con:
             try:
-                return await con.fetchval('''
-                insert into class (section, instructor, day_of_week, \
-                    week_list, class_begin, class_end, location)
-                values (%d, %d, '%s', array%s, %d, %d, '%s')
-                    returning id
-                ''' % (section_id, instructor_id, day_of_week.name,
-                       week_list, class_begin, class_end, location))
+                async with con.transaction():
+                    async for chunk in chunks(sections):
+                        # ids are drawn up front so the rows can be copied
+                        drawn = [r[0] for r in await registry.fetch(
+                            con, 'allocate_section_ids', len(chunk))]
+                        await timed(con.copy_records_to_table(
+                            'section',
+                            records=[(i, s[0], s[1], s[2], s[3], s[3])
+                                     for i, s in zip(drawn, chunk)],
+                            columns=('id', 'course', 'semester', 'name',
+                                     'total_capacity', 'left_capacity')))
+                        for i, s in zip(drawn, chunk):
+                            self.__prerequisites.put_section(i, s[0])
+                        ids += drawn
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
+                for i in ids:
+                    self.__prerequisites.discard_section(i)
                 raise IntegrityViolationError from e
+        return ids
+
+    async def add_course_section_classes(
+            self,
+            classes: Iterable[Tuple[int, int, DayOfWeek, List[int], int, int,
+                                    str]]) -> List[int]:
+        ids = []
+        sections = set()
+        async with self.__pool.acquire() as con:
+            try:
+                async with con.transaction():
+                    async for chunk in chunks(classes):
+                        for c in chunk:
+                            check_class(c[3], c[4], c[5])
+                        drawn = [r[0] for r in await registry.fetch(
+                            con, 'allocate_class_ids', len(chunk))]
+                        await timed(con.copy_records_to_table(
+                            'class',
+                            records=[(i, c[0], c[1], c[2].name) + tuple(c[3:])
+                                     for i, c in zip(drawn, chunk)],
+                            columns=('id', 'section', 'instructor',
+                                     'day_of_week', 'week_list',
+                                     'class_begin', 'class_end',
+                                     'location')))
+                        sections.update(c[0] for c in chunk)
+                        ids += drawn
+                    semesters = await registry.fetch(
+                        con, 'get_section_semesters', list(sections))
+            except asyncpg.exceptions.IntegrityConstraintViolationError as e:
+                raise IntegrityViolationError from e
+        for r in semesters:
+            self.__occupancy.discard(r['semester'])
+        self.__course_tables.clear()
+        for section_id in sections:
+            self.__references.discard('classes', section_id)
+        return ids
 
     async def remove_course(self, course_id: str):
         async with self.__pool.acquire() as con:
-            res = await con.execute('delete from course where id='+course_id)
-            if res == 'DELETE 0':
+            res = await registry.fetch(con, 'remove_course', course_id)
+            forget_takes(self.__passed, self.__grades, self.__course_tables,
+                         [(r['student_id'], r['section_id']) for r in res])
+            self.__prerequisites.discard(course_id)
+            self.__admission.clear()
+            self.__discard_semesters(res)
+            self.__course_tables.clear()
+            # its sections and classes went with it
+            self.__references.clear(*SECTIONS)
+            if not res:
                 raise EntityNotFoundError
 
     async def remove_course_section(self, section_id: int):
         async with self.__pool.acquire() as con:
-            res = await con.execute('delete from section where id='+section_id)
-            if res == 'DELETE 0':
+            res = await registry.fetch(con, 'remove_course_section',
+                                       section_id)
+            forget_takes(self.__passed, self.__grades, self.__course_tables,
+                         [(r['student_id'], r['section_id']) for r in res])
+            self.__prerequisites.discard_section(section_id)
+            self.__admission.discard(section_id)
+            self.__discard_semesters(res)
+            self.__course_tables.clear()
+            # class ids left mapped to it find no section and are reloaded
+            self.__references.discard('course', section_id)
+            self.__references.discard('section', section_id)
+            self.__references.discard('classes', section_id)
+            if not res:
                 raise EntityNotFoundError
 
     async def remove_course_section_class(self, class_id: int):
         async with self.__pool.acquire() as con:
-            res = await con.execute('delete from class where id='+class_id)
-            if res == 'DELETE 0':
+            res = await registry.fetchrow(
+                con, 'remove_course_section_class', class_id)
+            if res is None:
                 raise EntityNotFoundError
+            section_id = res['section']
+            self.__occupancy.discard(res['semester'])
+            self.__course_tables.clear()
+            self.__references.discard('class_section', class_id)
+            self.__references.discard('classes', section_id)
+
+    def __discard_semesters(self, rows: Iterable[asyncpg.Record]):
+        # the occupancy of the semesters the deleted sections were in
+        for semester_id in {r['semester'] for r in rows}:
+            if semester_id is not None:
+                self.__occupancy.discard(semester_id)
 
     async def get_all_courses(self) -> List[Course]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('select * from course')
+            res = await registry.fetch(con, 'get_all_courses')
             if res:
                 return [Course(r['id'],
                                r['name'],
@@ -119,11 +354,8 @@ class course_service(CourseService):
                                               semester_id: int
                                               ) -> List[CourseSection]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('''
-            select *
-            from section
-            where course = '%s' and semester = %d
-            ''' % (course_id, semester_id))
+            res = await registry.fetch(con, 'get_course_sections_in_semester',
+                                       course_id, semester_id)
             if res:
                 return [CourseSection(r['id'],
                                       r['name'],
@@ -134,12 +366,16 @@ class course_service(CourseService):
                 raise EntityNotFoundError
 
     async def get_course_by_section(self, section_id: int) -> Course:
+        res = await self.__references.get(
+            'course', section_id, lambda: self.__course_by_section(section_id))
+        if res is None:
+            raise EntityNotFoundError
+        return res
+
+    async def __course_by_section(self, section_id: int) -> Optional[Course]:
         async with self.__pool.acquire() as con:
-            res = await con.fetchrow('''
-            select *
-            from course
-            where id = (select course from section where section.id = %d)
-            ''' % section_id)
+            res = await registry.fetchrow(con, 'get_course_by_section',
+                                          section_id)
             if res:
                 return Course(res['id'],
                               res['name'],
@@ -148,35 +384,50 @@ class course_service(CourseService):
                               CourseGrading[res['grading']]
                               )
             else:
-                raise EntityNotFoundError
+                return None
 
     async def get_course_section_by_class(self, class_id: int) \
             -> CourseSection:
+        # a class never moves, its section is cached apart because enroll
+        # and drop move the seat count and discard it
+        section_id = self.__references.lookup('class_section', class_id)
+        if section_id is not None:
+            res = self.__references.lookup('section', section_id)
+            if res is not None:
+                return res
+        tokens = (self.__references.token('class_section'),
+                  self.__references.token('section'))
         async with self.__pool.acquire() as con:
-            res = await con.fetchrow('''
-            select *
-            from section
-            where id = (select section from class where class.id = %d)
-            ''' % class_id)
+            res = await registry.fetchrow(con, 'get_course_section_by_class',
+                                          class_id)
             if res:
-                return CourseSection(res['id'],
-                                     res['name'],
-                                     res['total_capacity'],
-                                     res['left_capacity']
-                                     )
+                section = CourseSection(res['id'],
+                                        res['name'],
+                                        res['total_capacity'],
+                                        res['left_capacity']
+                                        )
             else:
                 raise EntityNotFoundError
+        self.__references.put('class_section', class_id, section.id,
+                              tokens[0])
+        self.__references.put('section', section.id, section, tokens[1])
+        return section
 
     async def get_course_section_classes(self, section_id: int) \
             -> List[CourseSectionClass]:
+        res = await self.__references.get(
+            'classes', section_id,
+            lambda: self.__section_classes(section_id))
+        if res is None:
+            raise EntityNotFoundError
+        # callers may sort or extend the list
+        return list(res)
+
+    async def __section_classes(self, section_id: int) \
+            -> Optional[List[CourseSectionClass]]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('''
-            select class.id, instructor, full_name, day_of_week,
-                week_list, class_begin, class_end, location
-            from class
-                join instructor on class.instructor = instructor.id
-            where section = %d
-            ''' % section_id)
+            res = await registry.fetch(con, 'get_course_section_classes',
+                                       section_id)
             if res:
                 return [CourseSectionClass(r['id'],
                                            Instructor(r['instructor'],
@@ -188,22 +439,15 @@ class course_service(CourseService):
                                            r['location']
                                            ) for r in res]
             else:
-                raise EntityNotFoundError
+                return None
 
     async def get_enrolled_students_in_semester(self, course_id: str,
                                                 semester_id: int
                                                 ) -> List[Student]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('''
-            select student.id, full_name, enrolled_date, major, major.name as
-                major_name, department, department.name as department_name
-            from student
-                join takes on student.id = student_id
-                join section on section_id = section.id
-                join major on major = major.id
-                join department on department = department.id
-            where course = %d and semester = %d
-            ''' % (course_id, semester_id))
+            res = await registry.fetch(con,
+                                       'get_enrolled_students_in_semester',
+                                       course_id, semester_id)
             if res:
                 return [Student(r['id'],
                                 r['full_name'],
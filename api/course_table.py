@@ -0,0 +1,82 @@
+from typing import Dict, FrozenSet, Iterable, Optional, Union
+
+from dto import CourseTable
+
+from .cache import lru
+
+# students whose tables are kept, each with every week asked for
+STUDENTS = 1 << 14
+
+
+class course_table_cache:
+    # assembled tables keyed by (student, semester, week), and the sections
+    # the tables are built from keyed by (student, semester), grouped per
+    # student so that an enrollment change forgets all of their weeks at
+    # once; class changes may touch anyone's table and clear everything.
+    # A table read before its student was discarded is not stored
+    def __init__(self, maxsize: int = STUDENTS):
+        self.__students = lru(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def token(self) -> int:
+        return self.__students.token()
+
+    def get(self, student_id: int, semester_id: int, week: int) \
+            -> Optional[CourseTable]:
+        weeks = self.__students.get(student_id)
+        table = weeks.get((semester_id, week)) if weeks else None
+        if table is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # callers may sort or extend the lists
+        return {day: list(entries) for day, entries in table.items()}
+
+    def put(self, token: int, student_id: int, semester_id: int, week: int,
+            table: CourseTable):
+        weeks = self.__weeks(token, student_id)
+        if weeks is not None:
+            weeks[(semester_id, week)] = {day: list(entries)
+                                          for day, entries in table.items()}
+
+    def sections(self, student_id: int, semester_id: int) \
+            -> Optional[FrozenSet[int]]:
+        # the student's sections in the semester, None if not known
+        weeks = self.__students.peek(student_id)
+        return weeks.get(semester_id) if weeks else None
+
+    def put_sections(self, token: int, student_id: int, semester_id: int,
+                     sections: Iterable[int]):
+        weeks = self.__weeks(token, student_id)
+        if weeks is not None:
+            weeks[semester_id] = frozenset(sections)
+
+    def __weeks(self, token: int, student_id: int) -> Optional[Dict]:
+        if not self.__students.current(student_id, token):
+            return None
+        weeks = self.__students.peek(student_id)
+        if weeks is None:
+            weeks = {}
+            self.__students.put(student_id, weeks)
+        return weeks
+
+    def discard(self, student_id: int):
+        self.invalidations += 1
+        self.__students.discard(student_id)
+
+    def clear(self):
+        self.invalidations += 1
+        self.__students.clear()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.misses
+        stats = self.__students.stats()
+        return {'students': stats['size'],
+                'maxsize': stats['maxsize'],
+                'evictions': stats['evictions'],
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations}
@@ -1,45 +1,92 @@
 import asyncpg
 from exception import EntityNotFoundError, IntegrityViolationError
 from service.department_service import DepartmentService
-from typing import List
+from typing import List, Optional
 from dto import Department
 
+from .cache import lru
+from .course_table import course_table_cache
+from .reference import reference_cache
+from .statement import registry
+from .takes import Grades, forget_takes
+
+registry.register('add_department', '''
+insert into department (name) values ($1)
+    returning id
+''')
+# the takes rows the delete cascades to through its majors' students, one
+# row with null takes columns if there were none, no row if not found
+registry.register('remove_department', '''
+with gone as (
+    delete from department where id = $1
+    returning id
+)
+select gone.id, takes.student_id, takes.section_id
+from gone
+    left join major on major.department = gone.id
+    left join student on student.major = major.id
+    left join takes on takes.student_id = student.id
+''')
+registry.register('get_all_departments', 'select * from department')
+registry.register('get_department', '''
+select * from department where id = $1
+''', hot=True)
+
 
 class department_service(DepartmentService):
 
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool,
+                 references: Optional[reference_cache] = None,
+                 passed: Optional[lru] = None,
+                 grades: Optional[Grades] = None,
+                 course_tables: Optional[course_table_cache] = None):
         self.__pool = pool
+        self.__references = references or reference_cache()
+        # of the student service, enrollments go with the students
+        self.__passed = passed if passed is not None else lru(1 << 16)
+        self.__grades = grades if grades is not None else {}
+        self.__course_tables = course_tables or course_table_cache()
 
     async def add_department(self, name: str) -> int:
         async with self.__pool.acquire() as con:
             try:
-                return await con.fetchval('''
-                insert into department (name) values ('%s')
-                    returning id
-                ''' % (name))
+                return await registry.fetchval(con, 'add_department', name)
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
     async def remove_department(self, department_id: int):
         async with self.__pool.acquire() as con:
-            res = await con.execute('delete from department where id='
-                                    + department_id)
-            if res == 'DELETE 0':
+            res = await registry.fetch(con, 'remove_department',
+                                       department_id)
+            forget_takes(self.__passed, self.__grades, self.__course_tables,
+                         [(r['student_id'], r['section_id']) for r in res])
+            self.__references.discard('department', department_id)
+            # its majors went with it
+            self.__references.clear('major')
+            if not res:
                 raise EntityNotFoundError
 
     async def get_all_departments(self) -> List[Department]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('select * from department')
+            res = await registry.fetch(con, 'get_all_departments')
             if res:
                 return [Department(r['id'], r['name']) for r in res]
             else:
                 return []
 
     async def get_department(self, department_id: int) -> Department:
+        res = await self.__references.get(
+            'department', department_id,
+            lambda: self.__department(department_id))
+        if res is None:
+            raise EntityNotFoundError
+        return res
+
+    async def __department(self, department_id: int) -> Optional[Department]:
         async with self.__pool.acquire() as con:
-            res = await con.fetchrow('select * from department where id ='
-                                     + department_id)
+            res = await registry.fetchrow(con, 'get_department',
+                                          department_id)
             if res:
                 return Department(res['id'], res['name'])
             else:
-                raise EntityNotFoundError
+                return None
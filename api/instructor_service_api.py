@@ -1,10 +1,24 @@
 from exception import EntityNotFoundError, IntegrityViolationError
 import asyncpg
 from service.instructor_service import InstructorService
-from typing import List
+from typing import AsyncIterable, Iterable, List, Tuple, Union
 
 from dto import CourseSection
 
+from .bulk import copy_staged
+from .metrics import timed
+from .statement import registry
+from .user_service_api import full_name
+
+registry.register('add_instructor', '''
+insert into instructor (id, full_name) values ($1, $2)
+''', hot=True)
+registry.register('get_instructed_course_sections', '''
+select section.id, section.name, total_capacity, left_capacity
+from class join section on class.section = section.id
+where class.instructor = $1 and semester = $2
+''')
+
 
 class instructor_service(InstructorService):
 
@@ -15,25 +29,58 @@ class instructor_service(InstructorService):
                              last_name: str):
         async with self.__pool.acquire() as con:
             try:
-                if str.isascii(first_name) and str.isascii(last_name):
-                    full_name = first_name+' '+last_name
-                else:
-                    full_name = first_name+last_name
-                await con.execute('''
-                insert into instructor (id, full_name) values (%d, '%s')
-                ''' % (user_id, full_name))
+                await registry.execute(con, 'add_instructor', user_id,
+                                       full_name(first_name, last_name))
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
+    async def add_instructors(
+            self,
+            records: Union[Iterable[Tuple[int, str, str]],
+                           AsyncIterable[Tuple[int, str, str]]]
+    ) -> List[bool]:
+        async with self.__pool.acquire() as con:
+            async with con.transaction():
+                await timed(con.execute('''
+                create temp table instructor_import (
+                    idx         integer,
+                    id          integer,
+                    full_name   varchar
+                ) on commit drop
+                '''))
+                n = await copy_staged(
+                    con, 'instructor_import', ('id', 'full_name'), records,
+                    lambda user_id, first, last: (user_id,
+                                                  full_name(first, last)))
+                # taken ids are skipped, duplicates keep their first
+                # occurrence
+                res = await timed(con.fetch('''
+                with pick as (
+                    select distinct on (id) *
+                    from instructor_import
+                    where id is not null and full_name is not null
+                    order by id, idx
+                ),
+                ins as (
+                    insert into instructor (id, full_name)
+                    select id, full_name
+                    from pick
+                    on conflict do nothing
+                    returning id
+                )
+                select idx from ins join pick using (id)
+                '''))
+        accepted = [False] * n
+        for r in res:
+            accepted[r['idx']] = True
+        return accepted
+
     async def get_instructed_course_sections(self, instructor_id: int,
                                              semester_id: int
                                              ) -> List[CourseSection]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('''
-            select section.id, section.name, total_capacity, left_capacity
-            from class join section on class.section = section.id
-            where class.instructor = %d and semester = %d
-            ''' % (instructor_id, semester_id))
+            res = await registry.fetch(con, 'get_instructed_course_sections',
+                                       instructor_id, semester_id)
             if res:
                 return [CourseSection(r['id'], r['name'],
                         r['total_capacity'], r['left_capacity']) for r in res]
@@ -0,0 +1,165 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import asyncpg
+
+from .admission import section_admission
+from .cache import lru
+from .course_table import course_table_cache
+from .occupancy import occupancy_cache
+from .prerequisite import prerequisite_cache
+from .reference import reference_cache
+from .semester_index import semester_index
+from .statement import registry
+from .takes import Grades
+
+# channel the notify triggers of cs307.sql announce changed keys on
+CHANNEL = 'cs307_cache'
+# seconds between attempts to listen again after the connection was lost
+RETRY = 1.0
+# kinds of the hot path that the services invalidate where they write them;
+# applied again, a 'seat' of our own batch would drop the seat view that
+# very batch just stored
+LOCAL = ('takes', 'passed', 'seat')
+
+
+class cache_listener:
+    # Applies every committed write to the caches of this process: the
+    # triggers send 'kind:key,key,...' after every statement on takes,
+    # section, class, course, prerequisite and semester. Our own catalog
+    # writes are applied as well, so whatever a cascade touched that the
+    # services did not discard themselves goes too; our own enrollments and
+    # seats are not, see LOCAL. While not listening nothing can be trusted
+    # and every cache is dropped.
+    def __init__(self, pool: asyncpg.Pool,
+                 prerequisites: prerequisite_cache,
+                 passed: lru,
+                 occupancy: occupancy_cache,
+                 admission: section_admission,
+                 course_tables: course_table_cache,
+                 references: reference_cache,
+                 grades: Grades,
+                 semesters: semester_index):
+        self.__pool = pool
+        self.__prerequisites = prerequisites
+        self.__passed = passed
+        self.__occupancy = occupancy
+        self.__admission = admission
+        self.__course_tables = course_tables
+        self.__references = references
+        self.__grades = grades
+        self.__semesters = semesters
+        self.__con: Optional[asyncpg.Connection] = None
+        self.__retry: Optional[asyncio.Task] = None
+        self.__closed = False
+        self.notifications = 0
+        self.own = 0
+        self.reconnects = 0
+
+    async def start(self):
+        con = await self.__pool.acquire()
+        try:
+            await con.add_listener(CHANNEL, self.__notified)
+        except BaseException:
+            await self.__pool.release(con)
+            raise
+        con.add_termination_listener(self.__lost)
+        self.__con = con
+
+    async def close(self):
+        self.__closed = True
+        if self.__retry is not None:
+            self.__retry.cancel()
+        con, self.__con = self.__con, None
+        if con is not None and not con.is_closed():
+            con.remove_termination_listener(self.__lost)
+            await con.remove_listener(CHANNEL, self.__notified)
+            await self.__pool.release(con)
+
+    def __lost(self, con: asyncpg.Connection):
+        self.__con = None
+        self.__clear()
+        if not self.__closed:
+            self.__retry = asyncio.ensure_future(self.__listen_again())
+
+    async def __listen_again(self):
+        while not self.__closed:
+            await asyncio.sleep(RETRY)
+            try:
+                await self.start()
+            except (OSError, asyncpg.exceptions.PostgresError,
+                    asyncpg.exceptions.InterfaceError):
+                continue
+            self.reconnects += 1
+            # whatever changed while deaf was never announced
+            self.__clear()
+            return
+
+    def __clear(self):
+        self.__prerequisites.clear()
+        self.__passed.clear()
+        self.__occupancy.discard()
+        self.__course_tables.clear()
+        self.__references.clear()
+        self.__grades.clear()
+        self.__semesters.reset()
+
+    def __notified(self, con: asyncpg.Connection, pid: int, channel: str,
+                   payload: str):
+        self.notifications += 1
+        kind, _, keys = payload.partition(':')
+        if registry.owns(pid):
+            self.own += 1
+            if kind in LOCAL:
+                return
+        self.apply(kind, keys.split(','))
+
+    def apply(self, kind: str, keys: List[str]):
+        if kind == 'takes':
+            for key in keys:
+                student_id, section_id = map(int, key.split('.'))
+                self.__grades.pop((student_id, section_id), None)
+                self.__course_tables.discard(student_id)
+        elif kind == 'passed':
+            for student_id in keys:
+                self.__passed.discard(int(student_id))
+        elif kind == 'seat':
+            for key in keys:
+                self.__references.discard('section', int(key))
+                self.__admission.discard(int(key))
+        elif kind == 'section':
+            for key in keys:
+                section_id, semester_id = map(int, key.split('.'))
+                self.__prerequisites.discard_section(section_id)
+                self.__occupancy.discard(semester_id)
+                self.__admission.discard(section_id)
+                for ref in ('course', 'section', 'classes'):
+                    self.__references.discard(ref, section_id)
+            self.__course_tables.clear()
+        elif kind == 'class':
+            for key in keys:
+                class_id, section_id, semester_id = key.split('.')
+                self.__references.discard('class_section', int(class_id))
+                self.__references.discard('classes', int(section_id))
+                # empty if the section went too, its 'section' names it
+                if semester_id:
+                    self.__occupancy.discard(int(semester_id))
+            self.__course_tables.clear()
+        elif kind == 'course':
+            for course_id in keys:
+                self.__prerequisites.forget(course_id)
+            self.__references.clear('course')
+            self.__course_tables.clear()
+        elif kind == 'prerequisite':
+            for course_id in keys:
+                self.__prerequisites.forget(course_id)
+        elif kind == 'semester':
+            for semester_id in keys:
+                self.__references.discard('semester', int(semester_id))
+            self.__semesters.reset()
+
+    def stats(self) -> Dict[str, int]:
+        return {'listening': self.__con is not None,
+                'notifications': self.notifications,
+                'own': self.own,
+                'reconnects': self.reconnects}
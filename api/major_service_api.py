@@ -1,40 +1,85 @@
 from exception import EntityNotFoundError, IntegrityViolationError
 import asyncpg
 from service.major_service import MajorService
-from typing import List
+from typing import List, Optional
 
 from dto import Major, Department
 
+from .cache import lru
+from .course_table import course_table_cache
+from .reference import reference_cache
+from .statement import registry
+from .takes import Grades, forget_takes
+
+registry.register('add_major', '''
+insert into major (name, department) values ($1, $2)
+    returning id
+''')
+# the takes rows the delete cascades to through its students, one row with
+# null takes columns if there were none, no row if not found
+registry.register('remove_major', '''
+with gone as (
+    delete from major where id = $1
+    returning id
+)
+select gone.id, takes.student_id, takes.section_id
+from gone
+    left join student on student.major = gone.id
+    left join takes on takes.student_id = student.id
+''')
+registry.register('get_all_majors', '''
+select major.id, major.name as major_name, department,
+    department.name as department_name
+from major
+    join department on major.department = department.id
+''')
+registry.register('get_major', '''
+select major.id, major.name as major_name, department,
+    department.name as department_name
+from major
+    join department on major.department = department.id
+where major.id = $1
+''', hot=True)
+registry.register('add_major_course', '''
+insert into major_course (major_id, course_id, course_type)
+values ($1, $2, $3)
+''')
+
 
 class major_service(MajorService):
 
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool,
+                 references: Optional[reference_cache] = None,
+                 passed: Optional[lru] = None,
+                 grades: Optional[Grades] = None,
+                 course_tables: Optional[course_table_cache] = None):
         self.__pool = pool
+        self.__references = references or reference_cache()
+        # of the student service, enrollments go with the students
+        self.__passed = passed if passed is not None else lru(1 << 16)
+        self.__grades = grades if grades is not None else {}
+        self.__course_tables = course_tables or course_table_cache()
 
     async def add_major(self, name: str, department_id: int) -> int:
         async with self.__pool.acquire() as con:
             try:
-                return await con.fetchval('''
-                insert into major (name, department) values ('%s', %d)
-                    returning id
-                ''' % (name, department_id))
+                return await registry.fetchval(con, 'add_major', name,
+                                               department_id)
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
     async def remove_major(self, major_id: int):
         async with self.__pool.acquire() as con:
-            res = await con.execute('delete from major where id='+major_id)
-            if res == 'DELETE 0':
+            res = await registry.fetch(con, 'remove_major', major_id)
+            forget_takes(self.__passed, self.__grades, self.__course_tables,
+                         [(r['student_id'], r['section_id']) for r in res])
+            self.__references.discard('major', major_id)
+            if not res:
                 raise EntityNotFoundError
 
     async def get_all_majors(self) -> List[Major]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('''
-            select major.id, major.name as major_name, department,
-                department.name as department_name
-            from major
-                join department on major.department = department.id
-            ''')
+            res = await registry.fetch(con, 'get_all_majors')
             if res:
                 return [Major(r['id'],
                               r['major_name'],
@@ -45,38 +90,35 @@ class major_service(MajorService):
                 return []
 
     async def get_major(self, major_id: int) -> Major:
+        res = await self.__references.get(
+            'major', major_id, lambda: self.__major(major_id))
+        if res is None:
+            raise EntityNotFoundError
+        return res
+
+    async def __major(self, major_id: int) -> Optional[Major]:
         async with self.__pool.acquire() as con:
-            res = await con.fetchrow('''
-            select major.id, major.name as major_name, department,
-                department.name as department_name
-            from major
-                join department on major.department = department.id
-            where major.id = %d
-            ''' % major_id)
+            res = await registry.fetchrow(con, 'get_major', major_id)
             if res:
                 return Major(res['id'],
                              res['major_name'],
                              Department(res['department'],
                                         res['department_name']))
             else:
-                raise EntityNotFoundError
+                return None
 
     async def add_major_compulsory_course(self, major_id: int, course_id: str):
         async with self.__pool.acquire() as con:
             try:
-                await con.execute('''
-                insert into major_course (major_id, course_id, course_type)
-                values (%d, '%s', '%s')
-                ''' % (major_id, course_id, 'C'))
+                await registry.execute(con, 'add_major_course', major_id,
+                                       course_id, 'C')
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
     async def add_major_elective_course(self, major_id: int, course_id: str):
         async with self.__pool.acquire() as con:
             try:
-                await con.execute('''
-                insert into major_course (major_id, course_id, course_type)
-                values (%d, '%s', '%s')
-                ''' % (major_id, course_id, 'E'))
+                await registry.execute(con, 'add_major_course', major_id,
+                                       course_id, 'E')
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
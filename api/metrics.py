@@ -0,0 +1,191 @@
+import asyncio
+from abc import ABCMeta
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Type
+
+# upper bounds in seconds, from fifty microseconds to ten seconds; calls
+# answered from the caches finish well below a millisecond
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class histogram:
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        # the last bucket holds everything above the largest bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th value, the largest
+        # observation when it falls into the overflow bucket
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict:
+        cumulative = []
+        seen = 0
+        for n in self.counts[:-1]:
+            seen += n
+            cumulative.append(seen)
+        return {'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+                'buckets': dict(zip(self.bounds, cumulative))}
+
+
+# seconds spent in the database by the instrumented call running in this
+# context, None outside of one
+_db_time: ContextVar[Optional[List[float]]] = ContextVar('db_time',
+                                                         default=None)
+
+
+def timed(aw: Awaitable) -> Awaitable:
+    # charge a database round trip to the current call, free when no
+    # instrumented call is running
+    acc = _db_time.get()
+    if acc is None:
+        return aw
+    return _timed(aw, acc)
+
+
+async def _timed(aw: Awaitable, acc: List[float]) -> Any:
+    start = perf_counter()
+    try:
+        return await aw
+    finally:
+        acc[0] += perf_counter() - start
+
+
+class method_stats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = histogram()
+        self.db = histogram()
+
+    def observe(self, seconds: float, db_seconds: float):
+        self.calls += 1
+        self.total.observe(seconds)
+        self.db.observe(db_seconds)
+
+    def snapshot(self) -> Dict:
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'p50': self.total.quantile(0.5),
+                'p95': self.total.quantile(0.95),
+                'p99': self.total.quantile(0.99),
+                'max': self.total.max,
+                'seconds': self.total.sum,
+                'db_seconds': self.db.sum,
+                'python_seconds': self.total.sum - self.db.sum,
+                'db_p50': self.db.quantile(0.5),
+                'db_p99': self.db.quantile(0.99)}
+
+
+class service_metrics:
+    def __init__(self):
+        self.__methods: Dict[str, method_stats] = {}
+
+    def method(self, name: str) -> method_stats:
+        stats = self.__methods.get(name)
+        if stats is None:
+            stats = self.__methods[name] = method_stats()
+        return stats
+
+    def instrument(self, service: Any, prefix: str) -> 'instrumented':
+        return _proxy_class(type(service))(service, self, prefix)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {name: m.snapshot() for name, m in self.__methods.items()}
+
+    def prometheus(self) -> str:
+        lines = []
+        for metric, kind in (('service_call_seconds', 'total'),
+                             ('service_db_seconds', 'db')):
+            lines.append('# TYPE %s histogram' % metric)
+            for name, m in sorted(self.__methods.items()):
+                h = getattr(m, kind)
+                label = 'method="%s"' % name
+                for bound, n in h.snapshot()['buckets'].items():
+                    lines.append('%s_bucket{%s,le="%g"} %d'
+                                 % (metric, label, bound, n))
+                lines.append('%s_bucket{%s,le="+Inf"} %d'
+                             % (metric, label, h.count))
+                lines.append('%s_sum{%s} %.9f' % (metric, label, h.sum))
+                lines.append('%s_count{%s} %d' % (metric, label, h.count))
+        lines.append('# TYPE service_call_errors_total counter')
+        for name, m in sorted(self.__methods.items()):
+            lines.append('service_call_errors_total{method="%s"} %d'
+                         % (name, m.errors))
+        return '\n'.join(lines) + '\n'
+
+
+class instrumented:
+    # stands in for a service and records every public coroutine method;
+    # the wrappers are built on first use and cached on the proxy
+    def __init__(self, service: Any, metrics: service_metrics, prefix: str):
+        self.__service = service
+        self.__metrics = metrics
+        self.__prefix = prefix
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.__service, name)
+        if name.startswith('_') or not asyncio.iscoroutinefunction(attr):
+            return attr
+        wrapped = _wrap(attr, self.__metrics.method(
+            '%s.%s' % (self.__prefix, name)))
+        setattr(self, name, wrapped)
+        return wrapped
+
+
+# service class -> proxy class standing in for it
+_proxies: Dict[type, Type[instrumented]] = {}
+
+
+def _proxy_class(cls: type) -> Type[instrumented]:
+    # a proxy class per service class, registered with the service's ABCs
+    # so that isinstance(proxy, CourseService) holds as for the service
+    proxy = _proxies.get(cls)
+    if proxy is None:
+        proxy = _proxies[cls] = type('instrumented_' + cls.__name__,
+                                     (instrumented,), {})
+        for base in cls.__mro__:
+            if isinstance(base, ABCMeta):
+                base.register(proxy)
+    return proxy
+
+
+def _wrap(method, stats: method_stats):
+    async def call(*args, **kwargs):
+        acc = [0.0]
+        token = _db_time.set(acc)
+        start = perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except BaseException:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            _db_time.reset(token)
+            stats.observe(elapsed, acc[0])
+    return call
@@ -0,0 +1,122 @@
+from typing import Dict, Iterable, List, Optional
+
+import asyncpg
+import numpy as np
+from dto import DayOfWeek
+
+from .statement import registry
+
+registry.register('get_semester_classes', '''
+select section, course, course.name||'['||section.name||']' as _name,
+    day_of_week, class_begin, class_end, week_mask
+from class
+    join section on class.section = section.id
+    join course on section.course = course.id
+where semester = $1
+order by section
+''')
+registry.register('get_enrolled_sections_in_semester', '''
+select section_id
+from takes
+    join section on section_id = section.id
+where student_id = $1 and semester = $2
+''', hot=True)
+
+# class_end < 30 is checked by the schema
+PERIODS = 32
+DAYS = {d.name: i for i, d in enumerate(DayOfWeek)}
+
+
+class semester_occupancy:
+    # one row per section with classes, one column per (day, period) slot
+    # holding the week mask of the classes in that slot; two sections
+    # conflict iff some slot of both rows shares a week bit
+    def __init__(self, rows: List[asyncpg.Record]):
+        sections = sorted({r['section'] for r in rows})
+        self.__row = {s: i for i, s in enumerate(sections)}
+        self.__course = {}
+        self.__name = {}
+        self.matrix = np.zeros((len(sections), len(DAYS) * PERIODS),
+                               dtype=np.uint64)
+        idx, slot, mask = [], [], []
+        for r in rows:
+            self.__course[r['section']] = r['course']
+            self.__name[r['section']] = r['_name']
+            day = DAYS[r['day_of_week']] * PERIODS
+            for p in range(r['class_begin'], r['class_end'] + 1):
+                idx.append(self.__row[r['section']])
+                slot.append(day + p)
+                mask.append(r['week_mask'])
+        np.bitwise_or.at(self.matrix, (np.array(idx, dtype=np.intp),
+                                       np.array(slot, dtype=np.intp)),
+                         np.array(mask, dtype=np.int64).view(np.uint64))
+        self.sections = np.array(sections, dtype=np.int64)
+        self.courses = np.array([self.__course[s] for s in sections],
+                                dtype=object)
+
+    def __contains__(self, section_id: int) -> bool:
+        # whether the section has classes
+        return section_id in self.__row
+
+    def __enrolled(self, enrolled: Iterable[int]) -> List[int]:
+        # sections without classes never conflict, as in the schema
+        return [s for s in enrolled if s in self.__row]
+
+    def conflicting(self, enrolled: Iterable[int]) -> np.ndarray:
+        # ids of every section that clashes with one of `enrolled`, by
+        # time or by being a section of the same course
+        enrolled = self.__enrolled(enrolled)
+        if not enrolled:
+            return self.sections[:0]
+        rows = [self.__row[s] for s in enrolled]
+        busy = np.bitwise_or.reduce(self.matrix[rows], axis=0)
+        hit = (self.matrix & busy).any(axis=1)
+        hit |= np.isin(self.courses, [self.__course[s] for s in enrolled])
+        return self.sections[hit]
+
+    def conflict_names(self, enrolled: Iterable[int],
+                       candidates: Iterable[int]) -> Dict[int, List[str]]:
+        enrolled = self.__enrolled(enrolled)
+        candidates = [s for s in candidates if s in self.__row]
+        if not enrolled or not candidates:
+            return {}
+        mine = self.matrix[[self.__row[s] for s in enrolled]]
+        theirs = self.matrix[[self.__row[s] for s in candidates]]
+        # candidates x enrolled
+        hit = (theirs[:, None, :] & mine[None, :, :]).any(axis=2)
+        hit |= (self.courses[[self.__row[s] for s in candidates]][:, None]
+                == self.courses[[self.__row[s] for s in enrolled]][None, :])
+        return {c: sorted({self.__name[enrolled[j]]
+                           for j in np.flatnonzero(hit[i])})
+                for i, c in enumerate(candidates)}
+
+
+class occupancy_cache:
+    def __init__(self):
+        self.__semester: Dict[int, semester_occupancy] = {}
+        # bumped by every invalidation, a matrix read before the latest one
+        # may be stale and is not stored
+        self.__epoch = 0
+
+    async def get(self, con: asyncpg.Connection, semester_id: int) \
+            -> semester_occupancy:
+        occ = self.__semester.get(semester_id)
+        if occ is None:
+            epoch = self.__epoch
+            rows = await registry.fetch(con, 'get_semester_classes',
+                                        semester_id)
+            occ = semester_occupancy(rows)
+            if epoch == self.__epoch:
+                self.__semester[semester_id] = occ
+        return occ
+
+    def peek(self, semester_id: int) -> Optional[semester_occupancy]:
+        return self.__semester.get(semester_id)
+
+    def discard(self, semester_id: Optional[int] = None):
+        # classes of a section moved, None drops every semester
+        self.__epoch += 1
+        if semester_id is None:
+            self.__semester.clear()
+        else:
+            self.__semester.pop(semester_id, None)
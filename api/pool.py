@@ -0,0 +1,86 @@
+import asyncio
+from time import perf_counter
+from typing import Dict, Optional
+
+import asyncpg
+
+from .metrics import histogram
+
+
+class pool_monitor:
+    # wraps an asyncpg pool so that every acquire is timed; anything else is
+    # passed through, so the services use it like the pool itself
+    def __init__(self, pool: asyncpg.Pool,
+                 acquire_timeout: Optional[float] = None):
+        self.__pool = pool
+        self.__timeout = acquire_timeout
+        self.wait = histogram()
+        self.acquires = 0
+        self.timeouts = 0
+
+    def acquire(self, *, timeout: Optional[float] = None) \
+            -> '_acquire_context':
+        return _acquire_context(self, timeout or self.__timeout)
+
+    async def _acquire(self, timeout: Optional[float]) \
+            -> asyncpg.pool.PoolConnectionProxy:
+        start = perf_counter()
+        try:
+            con = await self.__pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait.observe(perf_counter() - start)
+        self.acquires += 1
+        return con
+
+    def __getattr__(self, name: str):
+        return getattr(self.__pool, name)
+
+    def __await__(self):
+        return self.__init().__await__()
+
+    async def __init(self) -> 'pool_monitor':
+        await self.__pool
+        return self
+
+    async def __aenter__(self) -> 'pool_monitor':
+        return await self.__init()
+
+    async def __aexit__(self, *exc):
+        await self.__pool.close()
+
+    def stats(self) -> Dict:
+        size = self.__pool.get_size()
+        idle = self.__pool.get_idle_size()
+        return {'size': size,
+                'in_use': size - idle,
+                'idle': idle,
+                'min_size': self.__pool.get_min_size(),
+                'max_size': self.__pool.get_max_size(),
+                'acquires': self.acquires,
+                'timeouts': self.timeouts,
+                'wait': self.wait.snapshot(),
+                'wait_p50': self.wait.quantile(0.5),
+                'wait_p99': self.wait.quantile(0.99)}
+
+
+class _acquire_context:
+    __slots__ = ('monitor', 'timeout', 'con')
+
+    def __init__(self, monitor: pool_monitor, timeout: Optional[float]):
+        self.monitor = monitor
+        self.timeout = timeout
+        self.con = None
+
+    async def __aenter__(self) -> asyncpg.pool.PoolConnectionProxy:
+        self.con = await self.monitor._acquire(self.timeout)
+        return self.con
+
+    async def __aexit__(self, *exc):
+        con, self.con = self.con, None
+        await self.monitor.release(con)
+
+    def __await__(self):
+        return self.monitor._acquire(self.timeout).__await__()
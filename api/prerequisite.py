@@ -0,0 +1,201 @@
+from itertools import product
+from typing import (AbstractSet, Dict, FrozenSet, Iterable, List, Mapping,
+                    Optional, Sequence, Tuple, Union)
+
+import asyncpg
+from dto import (AndPrerequisite, CoursePrerequisite, OrPrerequisite,
+                 Prerequisite)
+
+from .statement import registry
+
+registry.register('get_prerequisite', '''
+select idx, val, ptr
+from prerequisite
+where id = $1
+''')
+registry.register('get_all_prerequisites', '''
+select id, idx, val, ptr
+from prerequisite
+order by id
+''')
+
+# terms a compiled prerequisite may have; an AND of many ORs multiplies
+# out past it, such a prerequisite is kept as its tree and walked instead
+MAX_TERMS = 256
+
+# disjunctive normal form: the prerequisite holds if every course of any
+# one term has been passed, or the tree when that form is too large; None
+# means the course has no prerequisite
+Dnf = Optional[Union[Tuple[FrozenSet[str], ...], Prerequisite]]
+
+
+def compile_dnf(prerequisite: Optional[Prerequisite]) -> Dnf:
+    if prerequisite is None:
+        return None
+    terms = _dnf(prerequisite)
+    return prerequisite if terms is None else tuple(terms)
+
+
+def _dnf(p: Prerequisite) -> Optional[List[FrozenSet[str]]]:
+    # None once the terms would exceed MAX_TERMS
+    if isinstance(p, CoursePrerequisite):
+        return [frozenset((p.course_id,))]
+    children = [_dnf(c) for c in p.terms]
+    if any(c is None for c in children):
+        return None
+    if isinstance(p, OrPrerequisite):
+        if sum(map(len, children)) > MAX_TERMS:
+            return None
+        terms = [t for c in children for t in c]
+    else:
+        size = 1
+        for c in children:
+            size *= len(c)
+            if size > MAX_TERMS:
+                return None
+        terms = [frozenset().union(*ts) for ts in product(*children)]
+    # drop terms implied by a smaller one, (A) or (A and B) is just (A)
+    terms = sorted(set(terms), key=len)
+    res = []
+    for t in terms:
+        if not any(r <= t for r in res):
+            res.append(t)
+    return res
+
+
+def satisfied(dnf: Dnf, passed: AbstractSet[str]) -> bool:
+    if dnf is None:
+        return True
+    if isinstance(dnf, tuple):
+        return any(t <= passed for t in dnf)
+    return _holds(dnf, passed)
+
+
+def _holds(p: Prerequisite, passed: AbstractSet[str]) -> bool:
+    if isinstance(p, CoursePrerequisite):
+        return p.course_id in passed
+    if isinstance(p, AndPrerequisite):
+        return all(_holds(c, passed) for c in p.terms)
+    return any(_holds(c, passed) for c in p.terms)
+
+
+def nodes(prerequisite: Prerequisite) \
+        -> List[Tuple[int, str, Optional[List[int]]]]:
+    # flatten the tree into (idx, val, ptr) rows of the prerequisite table,
+    # the root is node 0 and inner nodes point at their children
+    res = []
+    stack = [(0, prerequisite)]
+    cnt = 0
+    while stack:
+        i, p = stack.pop()
+        if isinstance(p, CoursePrerequisite):
+            res.append((i, p.course_id, None))
+        else:
+            ptr = []
+            for c in p.terms:
+                cnt += 1
+                ptr.append(cnt)
+                stack.append((cnt, c))
+            res.append((i, 'AND' if isinstance(p, AndPrerequisite) else 'OR',
+                        ptr))
+    return res
+
+
+def tree(rows: Sequence[Mapping]) -> Optional[Prerequisite]:
+    # rebuild the tree stored by course_service.add_course, node `idx`
+    # points at its children through `ptr` and the root is node 0
+    if not rows:
+        return None
+    nodes = {r['idx']: r for r in rows}
+
+    def build(i):
+        r = nodes[i]
+        if r['ptr'] is None:
+            return CoursePrerequisite(r['val'])
+        elif r['val'] == 'AND':
+            return AndPrerequisite([build(c) for c in r['ptr']])
+        else:
+            return OrPrerequisite([build(c) for c in r['ptr']])
+    return build(0)
+
+
+def compile_all(rows: Iterable[Mapping]) -> Dict[str, Dnf]:
+    # course -> compiled prerequisite, from (id, idx, val, ptr) rows
+    trees = {}
+    for r in rows:
+        trees.setdefault(r['id'], []).append(r)
+    return {c: compile_dnf(tree(rs)) for c, rs in trees.items()}
+
+
+class prerequisite_cache:
+    def __init__(self):
+        self.__dnf: Dict[str, Dnf] = {}
+        self.__section: Dict[int, str] = {}
+        self.__complete = False
+        # bumped by every change, rows read before the latest one may be
+        # stale and are not stored
+        self.__epoch = 0
+
+    def put(self, course_id: str, prerequisite: Optional[Prerequisite]):
+        self.__epoch += 1
+        self.__dnf[course_id] = compile_dnf(prerequisite)
+
+    def put_section(self, section_id: int, course_id: str):
+        self.__section[section_id] = course_id
+
+    def discard(self, course_id: str):
+        self.__epoch += 1
+        self.__dnf.pop(course_id, None)
+        for s in [s for s, c in self.__section.items() if c == course_id]:
+            del self.__section[s]
+
+    def forget(self, course_id: str):
+        # changed by another process, read again on next use
+        self.__epoch += 1
+        self.__dnf.pop(course_id, None)
+        self.__complete = False
+
+    def clear(self):
+        self.__epoch += 1
+        self.__dnf.clear()
+        self.__section.clear()
+        self.__complete = False
+
+    def discard_section(self, section_id: int):
+        self.__section.pop(section_id, None)
+
+    def course_of(self, section_id: int) -> Optional[str]:
+        return self.__section.get(section_id)
+
+    def peek(self, course_id: str) -> Tuple[bool, Dnf]:
+        if course_id in self.__dnf:
+            return True, self.__dnf[course_id]
+        return self.__complete, None
+
+    async def get(self, con: asyncpg.Connection, course_id: str) -> Dnf:
+        if course_id in self.__dnf or self.__complete:
+            return self.__dnf.get(course_id)
+        epoch = self.__epoch
+        res = await registry.fetch(con, 'get_prerequisite', course_id)
+        dnf = compile_dnf(tree(res))
+        if epoch == self.__epoch:
+            self.__dnf[course_id] = dnf
+        return dnf
+
+    async def all(self, con: asyncpg.Connection) -> Dict[str, Dnf]:
+        # every course is compiled once, add_course and remove_course keep
+        # the map complete afterwards
+        if not self.__complete:
+            epoch = self.__epoch
+            res = await registry.fetch(con, 'get_all_prerequisites')
+            if epoch != self.__epoch:
+                # answered from the rows, the next call reads again
+                return compile_all(res)
+            self.fill(res)
+        return self.__dnf
+
+    def fill(self, rows: Iterable[Mapping]):
+        # every (id, idx, val, ptr) row of the prerequisite table at once
+        self.__dnf.update(compile_all(rows))
+        self.__complete = True
+
@@ -0,0 +1,60 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from .cache import lru
+
+# entries kept of every kind, and seconds one is trusted without a write
+# through this process having discarded it
+REFERENCES = 1 << 14
+TTL = 600.0
+
+# department id -> Department, major id -> Major, semester id -> Semester,
+# section id -> Course, class id -> section id, section id -> CourseSection,
+# section id -> [CourseSectionClass]
+KINDS = ('department', 'major', 'semester', 'course', 'class_section',
+         'section', 'classes')
+# everything keyed by a section or a class, gone with a cascade over them
+SECTIONS = ('course', 'class_section', 'section', 'classes')
+
+
+class reference_cache:
+    # read-through cache of the catalog rows that barely change within a
+    # term, one lru per kind so that a scan of one kind cannot evict another.
+    # The services discard exactly what their writes touch, the ttl bounds
+    # how long a change made by another process goes unseen. A row read
+    # before its key was discarded may be stale and is not stored; the
+    # tokens are per key, so the discard of one section on every enroll
+    # does not void the reads of all the others
+    def __init__(self, maxsize: int = REFERENCES,
+                 ttl: Optional[float] = TTL):
+        self.__kinds = {kind: lru(maxsize, ttl) for kind in KINDS}
+
+    def lookup(self, kind: str, key: Hashable) -> Any:
+        return self.__kinds[kind].get(key)
+
+    async def get(self, kind: str, key: Hashable,
+                  load: Callable[[], Awaitable[Any]]) -> Any:
+        # None from load, e.g. no such row, is returned but not stored
+        value = self.__kinds[kind].get(key)
+        if value is not None:
+            return value
+        token = self.__kinds[kind].token()
+        value = await load()
+        if value is not None:
+            self.put(kind, key, value, token)
+        return value
+
+    def token(self, kind: str) -> int:
+        return self.__kinds[kind].token()
+
+    def put(self, kind: str, key: Hashable, value: Any, token: int):
+        self.__kinds[kind].put(key, value, token)
+
+    def discard(self, kind: str, key: Hashable):
+        self.__kinds[kind].discard(key)
+
+    def clear(self, *kinds: str):
+        for kind in kinds or KINDS:
+            self.__kinds[kind].clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {kind: cache.stats() for kind, cache in self.__kinds.items()}
@@ -0,0 +1,123 @@
+import base64
+import json
+from typing import AbstractSet, Dict, Sequence, Tuple
+
+from exception import IntegrityViolationError
+
+from .cache import lru
+from .statement import registry
+
+# one parameterized fragment per search filter, in the order they are
+# composed; `{name}` placeholders become bind parameters
+FILTERS: Dict[str, str] = {
+    'cid': '''
+    and cid like {cid} ''',
+    'name': '''
+    and _name like {name} ''',
+    'instructor': '''
+    and sid in (
+        select section
+        from class
+            join instructor on instructor = instructor.id
+        where full_name like {instructor}
+    ) ''',
+    'day': '''
+    and exists(
+        select null
+        from (select cls, generate_subscripts(cls, 1) as i) i
+        where cls[i].day_of_week = {day}
+    ) ''',
+    'time': '''
+    and exists(
+        select null
+        from (select cls, generate_subscripts(cls, 1) as i) i
+        where {time} between cls[i].class_begin and cls[i].class_end
+    ) ''',
+    'locations': '''
+    and exists(
+        select null
+        from (select cls, generate_subscripts(cls, 1) as i) i
+        where cls[i].location ~ ANY({locations}::varchar[])
+    ) ''',
+    'MAJOR_COMPULSORY': '''
+    and cid in (
+        select course_id
+        from major_course
+        where major_id = {major} and course_type = 'C'
+    ) ''',
+    'MAJOR_ELECTIVE': '''
+    and cid in (
+        select course_id
+        from major_course
+        where major_id = {major} and course_type = 'E'
+    ) ''',
+    'CROSS_MAJOR': '''
+    and cid in (
+        select course_id
+        from major_course
+        where major_id <> {major}
+    ) ''',
+    'PUBLIC': '''
+    and cid NOT in (select course_id from major_course) ''',
+    'full': '''
+    and left_capacity > 0 ''',
+    'passed': '''
+    and cid <> all({passed}::varchar[]) ''',
+    'missing': '''
+    and cid <> all({missing}::varchar[]) ''',
+    'after': '''
+    and (cid, _name) > ({after_cid}, {after_name}) ''',
+    'conflict': '''
+    and sid <> all({conflicting}::integer[]) ''',
+}
+
+PAGE = '''
+select * from schedule
+where semester = {semester} %s
+order by cid, _name
+limit {limit} offset {offset}
+'''
+
+
+class _params(dict):
+    # numbers the placeholders in order of first use
+    def __missing__(self, key):
+        self[key] = '$%d' % (len(self) + 1)
+        return self[key]
+
+
+# filter shape -> (statement name, parameter order)
+_plans = lru(256)
+
+
+def compose(shape: Sequence[str]) -> Tuple[str, Tuple[str, ...]]:
+    sql = PAGE % ''.join(FILTERS[f] for f in shape)
+    params = _params()
+    return sql.format_map(params), tuple(params)
+
+
+def plan(filters: AbstractSet[str]) -> Tuple[str, Tuple[str, ...]]:
+    # the statement text only depends on which filters are present, so
+    # searches of the same shape share one prepared plan per connection
+    shape = tuple(f for f in FILTERS if f in filters)
+    res = _plans.get(shape)
+    if res is None:
+        sql, order = compose(shape)
+        name = registry.register('search_course[%s]' % ','.join(shape), sql)
+        res = name, order
+        _plans.put(shape, res)
+    return res
+
+
+def encode_cursor(cid: str, name: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([cid, name]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        cid, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise IntegrityViolationError from e
+    if not isinstance(cid, str) or not isinstance(name, str):
+        raise IntegrityViolationError
+    return cid, name
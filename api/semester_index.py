@@ -0,0 +1,92 @@
+from bisect import bisect_right
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import asyncpg
+
+from .statement import registry
+
+registry.register('get_semester_calendar', '''
+select id, begin_date, end_date from semester
+order by begin_date, id
+''')
+
+
+class semester_index:
+    # semesters sorted by begin date with the furthest end reached so far,
+    # so resolving a day is a bisect instead of a day_in_semester_week
+    # round trip; kept current by the semester service, reset by the cache
+    # listener when another process changes a semester
+    def __init__(self):
+        self.__rows: List[Tuple[date, date, int]] = []
+        self.__begins: List[date] = []
+        self.__reach: List[date] = []
+        self.__spans: Dict[int, Tuple[date, date]] = {}
+        # bumped by every change, a load that raced one is redone
+        self.__version = 0
+        self.loaded = False
+
+    async def load(self, con: asyncpg.Connection):
+        while True:
+            version = self.__version
+            rows = await registry.fetch(con, 'get_semester_calendar')
+            if version == self.__version:
+                break
+        self.__build([(r['begin_date'], r['end_date'], r['id'])
+                      for r in rows])
+        self.loaded = True
+
+    def fill(self, rows: Iterable[Tuple[date, date, int]]):
+        # (begin, end, id) of every semester, e.g. from a snapshot
+        self.__version += 1
+        self.__build(list(rows))
+        self.loaded = True
+
+    def __build(self, rows: List[Tuple[date, date, int]]):
+        self.__rows = sorted(rows)
+        self.__begins = [r[0] for r in self.__rows]
+        self.__reach = []
+        for _, end, _ in self.__rows:
+            self.__reach.append(max(end, self.__reach[-1])
+                                if self.__reach else end)
+        self.__spans = {id: (begin, end) for begin, end, id in self.__rows}
+
+    def add(self, semester_id: int, begin: date, end: date):
+        self.__version += 1
+        if self.loaded:
+            self.__build(self.__rows + [(begin, end, semester_id)])
+
+    def discard(self, semester_id: int):
+        self.__version += 1
+        if self.loaded:
+            self.__build([r for r in self.__rows if r[2] != semester_id])
+
+    def reset(self):
+        # changed elsewhere, the next lookup loads the calendar again
+        self.__version += 1
+        self.loaded = False
+
+    def locate(self, day: date) -> Tuple[Optional[int], Optional[int]]:
+        # (semester id, week from 1) of the day, as day_in_semester_week
+        i = bisect_right(self.__begins, day) - 1
+        # overlapping semesters are walked back while one may still reach
+        while i >= 0 and self.__reach[i] >= day:
+            begin, end, semester_id = self.__rows[i]
+            if day <= end:
+                return semester_id, (day - begin).days // 7 + 1
+            i -= 1
+        return None, None
+
+    def span(self, semester_id: int) -> Optional[Tuple[date, date]]:
+        return self.__spans.get(semester_id)
+
+    def weeks(self, begin: date, end: date) -> List[Tuple[int, int]]:
+        # (semester id, week) of every day in [begin, end], in order
+        res = {}
+        day = begin
+        while day <= end:
+            key = self.locate(day)
+            if key[0] is not None:
+                res.setdefault(key)
+            day += timedelta(days=1)
+        return list(res)
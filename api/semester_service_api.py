@@ -2,37 +2,83 @@ from exception import EntityNotFoundError, IntegrityViolationError
 import asyncpg
 from service.semester_service import SemesterService
 from datetime import date
-from typing import List
+from typing import List, Optional
 
 from dto import Semester
 
+from .admission import section_admission
+from .cache import lru
+from .course_table import course_table_cache
+from .reference import SECTIONS, reference_cache
+from .semester_index import semester_index
+from .statement import registry
+from .takes import Grades, forget_takes
+
+registry.register('add_semester', '''
+insert into semester (name, begin_date, end_date)
+values ($1, $2, $3)
+    returning id
+''')
+registry.register('remove_semester', '''
+with gone as (
+    delete from semester where id = $1
+    returning id
+)
+select gone.id, takes.student_id, takes.section_id
+from gone
+    left join section on section.semester = gone.id
+    left join takes on takes.section_id = section.id
+''')
+registry.register('get_all_semesters', 'select * from semester')
+registry.register('get_semester', '''
+select * from semester where id = $1
+''', hot=True)
+
 
 class semester_service(SemesterService):
 
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool,
+                 index: Optional[semester_index] = None,
+                 references: Optional[reference_cache] = None,
+                 passed: Optional[lru] = None,
+                 grades: Optional[Grades] = None,
+                 course_tables: Optional[course_table_cache] = None,
+                 admission: Optional[section_admission] = None):
         self.__pool = pool
+        self.__index = index or semester_index()
+        self.__references = references or reference_cache()
+        # of the student service, enrollments go with sections
+        self.__passed = passed if passed is not None else lru(1 << 16)
+        self.__grades = grades if grades is not None else {}
+        self.__course_tables = course_tables or course_table_cache()
+        self.__admission = admission or section_admission(pool)
 
     async def add_semester(self, name: str, begin: date, end: date) -> int:
         async with self.__pool.acquire() as con:
             try:
-                return await con.fetchval('''
-                insert into semester (name, begin_date, end_date)
-                values ('%s', '%s', '%s')
-                    returning id
-                ''' % (name, begin, end))
+                semester_id = await registry.fetchval(con, 'add_semester',
+                                                      name, begin, end)
+                self.__index.add(semester_id, begin, end)
+                return semester_id
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
     async def remove_semester(self, semester_id: int):
         async with self.__pool.acquire() as con:
-            res = await con.execute('delete from semester where id ='
-                                    + semester_id)
-            if res == 'DELETE 0':
+            res = await registry.fetch(con, 'remove_semester', semester_id)
+            forget_takes(self.__passed, self.__grades, self.__course_tables,
+                         [(r['student_id'], r['section_id']) for r in res])
+            self.__index.discard(semester_id)
+            self.__admission.clear()
+            self.__references.discard('semester', semester_id)
+            # its sections and classes went with it
+            self.__references.clear(*SECTIONS)
+            if not res:
                 raise EntityNotFoundError
 
     async def get_all_semesters(self) -> List[Semester]:
         async with self.__pool.acquire() as con:
-            res = await con.fetch('select * from semester')
+            res = await registry.fetch(con, 'get_all_semesters')
             if res:
                 return [Semester(
                                 r['id'],
@@ -44,9 +90,15 @@ class semester_service(SemesterService):
                 return []
 
     async def get_semester(self, semester_id: int) -> Semester:
+        res = await self.__references.get(
+            'semester', semester_id, lambda: self.__semester(semester_id))
+        if res is None:
+            raise EntityNotFoundError
+        return res
+
+    async def __semester(self, semester_id: int) -> Optional[Semester]:
         async with self.__pool.acquire() as con:
-            res = await con.fetchrow('select * from semester where id ='
-                                     + semester_id)
+            res = await registry.fetchrow(con, 'get_semester', semester_id)
             if res:
                 return Semester(
                                 res['id'],
@@ -55,4 +107,4 @@ class semester_service(SemesterService):
                                 res['end_date']
                                 )
             else:
-                raise EntityNotFoundError
+                return None
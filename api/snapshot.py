@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+from dto import (Course, CourseGrading, CourseSectionClass, DayOfWeek,
+                 Department, Instructor, Major, Semester)
+
+from .prerequisite import prerequisite_cache
+from .reference import reference_cache
+from .semester_index import semester_index
+from .statement import registry
+
+# catalog_change is bumped by the catalog triggers of cs307.sql, seats are
+# not part of it. The sequence is not transactional: a writer still in
+# flight may have moved it, so the stamp only describes the rows of a
+# snapshot no writer was running at
+registry.register('snapshot_stamp', '''
+select epoch || '.' || (select case when is_called then last_value else 0 end
+                        from catalog_change) as stamp,
+    pg_snapshot_xmax(pg_current_snapshot())::text as xmax,
+    not exists(select null
+               from pg_snapshot_xip(pg_current_snapshot())) as settled
+from catalog_version
+''')
+# afterwards: no transaction ended since the snapshot (xmax did not move)
+# and none is running, so none was running at the snapshot either, even
+# above its xmax where the snapshot does not list them
+registry.register('snapshot_settled', '''
+select pg_snapshot_xmax(pg_current_snapshot())::text = $1
+    and not exists(select null
+                   from pg_locks
+                   where locktype = 'transactionid'
+                     and pid <> pg_backend_pid())
+''')
+# table -> query, the columns of each row in the order fill() reads them
+QUERIES = {
+    'department': registry.register('snapshot_department', '''
+select id, name from department
+'''),
+    'major': registry.register('snapshot_major', '''
+select id, name, department from major
+'''),
+    'semester': registry.register('snapshot_semester', '''
+select id, name, begin_date, end_date from semester
+'''),
+    'instructor': registry.register('snapshot_instructor', '''
+select id, full_name from instructor
+'''),
+    'course': registry.register('snapshot_course', '''
+select id, name, credit, class_hour, grading from course
+'''),
+    'prerequisite': registry.register('snapshot_prerequisite', '''
+select id, idx, val, ptr from prerequisite
+'''),
+    'section': registry.register('snapshot_section', '''
+select id, course from section
+'''),
+    'class': registry.register('snapshot_class', '''
+select id, section, instructor, day_of_week, week_list, class_begin,
+    class_end, location
+from class
+'''),
+}
+
+# bumped whenever the layout of the tables changes
+FORMAT = 2
+
+# table -> rows, each a list of plain JSON values in the column order of
+# QUERIES; dates are ISO strings
+Tables = Dict[str, List[List[Any]]]
+
+
+async def fetch_tables(con: asyncpg.Connection) -> Tables:
+    tables = {t: [list(r) for r in await registry.fetch(con, name)]
+              for t, name in QUERIES.items()}
+    for r in tables['semester']:
+        r[2], r[3] = r[2].isoformat(), r[3].isoformat()
+    return tables
+
+
+def read_snapshot(path: str, stamp: str) -> Optional[Tables]:
+    # None if the file is missing, damaged or from another catalog; the
+    # header line is checked before the tables are parsed
+    try:
+        with open(path, encoding='utf-8') as f:
+            if json.loads(f.readline()) != {'format': FORMAT, 'stamp': stamp}:
+                return None
+            tables = json.load(f)
+    except Exception:
+        return None
+    if not isinstance(tables, dict) or any(
+            not isinstance(tables.get(t), list) for t in QUERIES):
+        return None
+    return tables
+
+
+def write_snapshot(path: str, stamp: str, tables: Tables):
+    # written aside and renamed, a worker starting meanwhile never reads
+    # half a file. The file only saves the next start a query, failing to
+    # write it is not an error
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'format': FORMAT, 'stamp': stamp}, f)
+            f.write('\n')
+            json.dump(tables, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.getLogger(__name__).warning(
+            'catalog snapshot not written to %s: %s', path, e)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def fill(tables: Tables, references: reference_cache,
+         semesters: semester_index, prerequisites: prerequisite_cache):
+    departments = {}
+    for id, name in tables['department']:
+        departments[id] = Department(id, name)
+        references.put('department', id, departments[id],
+                       references.token('department'))
+    for id, name, department in tables['major']:
+        references.put('major', id,
+                       Major(id, name, departments[department]),
+                       references.token('major'))
+    rows = [(id, name, date.fromisoformat(begin), date.fromisoformat(end))
+            for id, name, begin, end in tables['semester']]
+    for id, name, begin, end in rows:
+        references.put('semester', id, Semester(id, name, begin, end),
+                       references.token('semester'))
+    semesters.fill((begin, end, id) for id, _, begin, end in rows)
+    prerequisites.fill({'id': c, 'idx': idx, 'val': val, 'ptr': ptr}
+                       for c, idx, val, ptr in tables['prerequisite'])
+
+    courses = {id: Course(id, name, credit, class_hour, CourseGrading[grading])
+               for id, name, credit, class_hour, grading in tables['course']}
+    for id, course in tables['section']:
+        prerequisites.put_section(id, course)
+        references.put('course', id, courses[course],
+                       references.token('course'))
+    instructors = dict(tables['instructor'])
+    classes: Dict[int, List[Any]] = {}
+    for id, section, instructor, day, weeks, begin, end, location \
+            in tables['class']:
+        references.put('class_section', id, section,
+                       references.token('class_section'))
+        classes.setdefault(section, []).append(
+            CourseSectionClass(id,
+                               Instructor(instructor, instructors[instructor]),
+                               DayOfWeek[day], weeks, begin, end, location))
+    for section, cls in classes.items():
+        references.put('classes', section, cls, references.token('classes'))
+
+
+async def warm(con: asyncpg.Connection, path: Optional[str],
+               references: reference_cache, semesters: semester_index,
+               prerequisites: prerequisite_cache) -> str:
+    # preload the catalog from the file at `path` when its stamp is still
+    # the database's, else from the database, refreshing the file; returns
+    # which. One view throughout, the stamp describes exactly these rows
+    source = 'file'
+    async with con.transaction(isolation='repeatable_read', readonly=True):
+        stamp = await registry.fetchrow(con, 'snapshot_stamp')
+        tables = read_snapshot(path, stamp['stamp']) if path else None
+        if tables is None:
+            tables = await fetch_tables(con)
+            source = 'database'
+    if source == 'database' and path and stamp['settled'] \
+            and await registry.fetchval(con, 'snapshot_settled',
+                                        stamp['xmax']):
+        write_snapshot(path, stamp['stamp'], tables)
+    fill(tables, references, semesters, prerequisites)
+    return source
@@ -0,0 +1,97 @@
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+import asyncpg
+
+from .metrics import timed
+
+# size of asyncpg's per-connection statement cache, meant to hold the
+# registered statements and the search shapes without evicting; nothing
+# here can observe an eviction, asyncpg just prepares the text again
+STATEMENT_CACHE_SIZE = 1024
+
+
+class statement_registry:
+    def __init__(self):
+        self.__sql: Dict[str, str] = {}
+        self.__hot: Set[str] = set()
+        # backend pid -> names of the statements this registry has warmed
+        # or run on it, bookkeeping of the registry and not a view of
+        # asyncpg's statement cache
+        self.__prepared: Dict[int, Set[str]] = {}
+        # per name, runs on a backend the registry had not warmed or run it
+        # on yet and runs on one it had. Only bookkeeping: whether asyncpg
+        # still holds the prepared statement is not visible from here
+        self.first_on_backend: Counter = Counter()
+        self.again_on_backend: Counter = Counter()
+
+    def register(self, name: str, sql: str, hot: bool = False) -> str:
+        self.__sql[name] = sql
+        if hot:
+            self.__hot.add(name)
+        return name
+
+    async def init(self, con: asyncpg.Connection):
+        # pool `init` hook, runs once for every new pooled connection.
+        # Statements live in the connection's own statement cache, keyed by
+        # their text, so they survive the connection going back to the pool.
+        # prepare() does not help: its PreparedStatement stays out of that
+        # cache and asyncpg invalidates it on release. executemany with no
+        # arguments prepares through the cache and runs nothing
+        pid = con.get_server_pid()
+        prepared = self.__prepared[pid] = set()
+        con.add_termination_listener(
+            lambda c: self.__prepared.pop(pid, None))
+        for name in self.__hot:
+            try:
+                await con.executemany(self.__sql[name], [])
+                prepared.add(name)
+            except asyncpg.exceptions.PostgresError:
+                # e.g. the schema is not loaded yet, prepare on first use
+                pass
+        # a prepare is only flushed, not synced, so the connection would sit
+        # in the implicit transaction holding locks on every table it read
+        await con.execute('select 1')
+
+    def owns(self, pid: int) -> bool:
+        # whether the backend is one of this process's pooled connections
+        return pid in self.__prepared
+
+    def __count(self, con: asyncpg.Connection, name: str) -> str:
+        prepared = self.__prepared.setdefault(con.get_server_pid(), set())
+        if name in prepared:
+            self.again_on_backend[name] += 1
+        else:
+            self.first_on_backend[name] += 1
+            prepared.add(name)
+        return self.__sql[name]
+
+    async def fetch(self, con: asyncpg.Connection, name: str, *args) \
+            -> List[asyncpg.Record]:
+        return await timed(con.fetch(self.__count(con, name), *args))
+
+    async def fetchrow(self, con: asyncpg.Connection, name: str, *args) \
+            -> Optional[asyncpg.Record]:
+        return await timed(con.fetchrow(self.__count(con, name), *args))
+
+    async def fetchval(self, con: asyncpg.Connection, name: str, *args) \
+            -> Any:
+        return await timed(con.fetchval(self.__count(con, name), *args))
+
+    async def execute(self, con: asyncpg.Connection, name: str, *args) \
+            -> str:
+        # status tag of the command, e.g. 'DELETE 0'
+        return await timed(con.execute(self.__count(con, name), *args))
+
+    async def executemany(self, con: asyncpg.Connection, name: str,
+                          args: Iterable[Sequence]):
+        await timed(con.executemany(self.__count(con, name), args))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {'first_on_backend': self.first_on_backend[name],
+                       'again_on_backend': self.again_on_backend[name]}
+                for name in self.__sql}
+
+
+# statements of every service, registered by the api modules at import
+registry = statement_registry()
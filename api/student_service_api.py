@@ -1,19 +1,149 @@
 import datetime
-from typing import List, Mapping, Optional
+from typing import (AsyncIterable, Dict, Iterable, List, Mapping, Optional,
+                    Set, Tuple, Union)
 
 import asyncpg
-from dto import (Course, CourseGrading, CourseSearchEntry, CourseSection,
-                 CourseSectionClass, CourseTable, CourseTableEntry, CourseType,
-                 DayOfWeek, Department, EnrollResult, Grade, Instructor, Major,
-                 PassOrFailGrade, )
+from dto import (Course, CourseGrading, CourseSearchEntry, CourseSearchPage,
+                 CourseSection, CourseSectionClass, CourseTable,
+                 CourseTableEntry, CourseType, DayOfWeek, Department,
+                 EnrollResult, Grade, Instructor, Major, PassOrFailGrade, )
 from exception import EntityNotFoundError, IntegrityViolationError
 from service.student_service import StudentService
 
+from .admission import section_admission
+from .bulk import copy_staged
+from .course_table import course_table_cache
+from .metrics import timed
+from .cache import lru
+from . import search
+from .occupancy import occupancy_cache
+from .prerequisite import prerequisite_cache, satisfied
+from .reference import reference_cache
+from .semester_index import semester_index
+from .statement import registry
+from .takes import Grades
+from .user_service_api import full_name
+
+registry.register('add_student', '''
+insert into student (id, full_name, enrolled_date, major)
+values ($1, $2, $3, $4)
+''', hot=True)
+registry.register('get_student_row', '''
+select * from student where id = $1
+''', hot=True)
+registry.register('get_passed_courses', '''
+select distinct course
+from takes
+    join section on section_id = section.id
+where student_id = $1
+  and case when grade in ('PASS', 'FAIL') then grade = 'PASS'
+           else cast(grade as integer) >= 60 end
+''', hot=True)
+registry.register('get_takes_grade', '''
+select grade from takes
+where student_id = $1 and section_id = $2
+''', hot=True)
+registry.register('delete_takes', '''
+delete from takes
+where student_id = $1 and section_id = $2
+''', hot=True)
+registry.register('release_seat', '''
+update section
+set left_capacity = left_capacity+1
+where id = $1
+''', hot=True)
+registry.register('add_takes', '''
+insert into takes (student_id, section_id, grade)
+values ($1, $2, $3)
+''', hot=True)
+registry.register('get_course_grading_by_section', '''
+select id, grading
+from course
+where id = (select course from section where section.id = $1)
+''', hot=True)
+registry.register('set_takes_grade', '''
+update takes
+set grade = $3
+from section
+where student_id = $1 and section_id = $2
+  and section_id = section.id
+returning section.course
+''')
+registry.register('get_enrolled_courses_and_grades_in_semester', '''
+select course.*, grade
+from course
+    join section on course.id = section.course and semester = $2
+    join takes on section.id = section_id and student_id = $1
+''')
+registry.register('get_enrolled_courses_and_grades', '''
+select course.*, grade
+from course
+    join section on course.id = section.course
+    join takes on section.id = section_id and student_id = $1
+    join semester on section.semester = semester.id
+order by begin_date
+''')
+registry.register('get_course_table', '''
+select day_of_week,
+       course.name || '[' || section.name || ']' as class_name,
+       instructor,
+       full_name,
+       class_begin,
+       class_end,
+       location
+from class
+    join section on section = section.id and semester = $2
+    join takes on section = section_id and student_id = $1
+    join course on section.course = course.id
+    join instructor on instructor = instructor.id
+where $3 < 64 and week_mask & (1::bigint << $3) <> 0
+''', hot=True)
+registry.register('get_course_tables', '''
+select semester,
+       week_list,
+       day_of_week,
+       course.name || '[' || section.name || ']' as class_name,
+       instructor,
+       full_name,
+       class_begin,
+       class_end,
+       location
+from class
+    join section on section = section.id and semester = any($2::int[])
+    join takes on section = section_id and student_id = $1
+    join course on section.course = course.id
+    join instructor on instructor = instructor.id
+''', hot=True)
+registry.register('get_student_major', '''
+select major.id, major.name as major_name, department,
+    department.name as department_name
+from major
+    join department on department = department.id
+where major.id = (select major from student where student.id = $1)
+''')
+
 
 class student_service(StudentService):
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool,
+                 prerequisites: Optional[prerequisite_cache] = None,
+                 passed: Optional[lru] = None,
+                 occupancy: Optional[occupancy_cache] = None,
+                 admission: Optional[section_admission] = None,
+                 course_tables: Optional[course_table_cache] = None,
+                 semesters: Optional[semester_index] = None,
+                 references: Optional[reference_cache] = None,
+                 grades: Optional[Grades] = None):
         self.__pool = pool
-        self.__cache = {}
+        # (student id, section id) -> grade, None while only enrolled
+        self.__cache = grades if grades is not None else {}
+        self.__prerequisites = prerequisites or prerequisite_cache()
+        # student id -> set of passed course ids
+        self.__passed = passed if passed is not None else lru(1 << 16)
+        self.__occupancy = occupancy or occupancy_cache()
+        self.__admission = admission or section_admission(pool)
+        self.__course_tables = course_tables or course_table_cache()
+        self.__semesters = semesters or semester_index()
+        self.__references = references or reference_cache()
 
     async def add_student(self,
                           user_id: int,
@@ -23,17 +153,60 @@ class student_service(StudentService):
                           enrolled_date: datetime.date):
         async with self.__pool.acquire() as con:
             try:
-                if str.isascii(first_name) and str.isascii(last_name):
-                    full_name = first_name+' '+last_name
-                else:
-                    full_name = first_name+last_name
-                await con.execute('''
-                insert into student (id, full_name, enrolled_date, major)
-                values (%d, '%s', '%s', %d)
-                ''' % (user_id, full_name, enrolled_date, major_id))
+                await registry.execute(con, 'add_student', user_id,
+                                       full_name(first_name, last_name),
+                                       enrolled_date, major_id)
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
+    async def add_students(
+            self,
+            records: Union[Iterable[Tuple[int, int, str, str,
+                                          datetime.date]],
+                           AsyncIterable[Tuple[int, int, str, str,
+                                               datetime.date]]]
+    ) -> List[bool]:
+        async with self.__pool.acquire() as con:
+            async with con.transaction():
+                await timed(con.execute('''
+                create temp table student_import (
+                    idx             integer,
+                    id              integer,
+                    major           integer,
+                    full_name       varchar,
+                    enrolled_date   date
+                ) on commit drop
+                '''))
+                n = await copy_staged(
+                    con, 'student_import',
+                    ('id', 'major', 'full_name', 'enrolled_date'), records,
+                    lambda user_id, major_id, first, last, date: (
+                        user_id, major_id, full_name(first, last), date))
+                # rows with a taken id or an unknown major are skipped,
+                # duplicates keep their first occurrence
+                res = await timed(con.fetch('''
+                with pick as (
+                    select distinct on (i.id) i.*
+                    from student_import i
+                        join major on i.major = major.id
+                    where i.id is not null and i.full_name is not null
+                      and i.enrolled_date is not null
+                    order by i.id, i.idx
+                ),
+                ins as (
+                    insert into student (id, full_name, enrolled_date, major)
+                    select id, full_name, enrolled_date, major
+                    from pick
+                    on conflict do nothing
+                    returning id
+                )
+                select idx from ins join pick using (id)
+                '''))
+        accepted = [False] * n
+        for r in res:
+            accepted[r['idx']] = True
+        return accepted
+
     async def search_course(self, *,
                             student_id: int,
                             semester_id: int,
@@ -51,121 +224,122 @@ class student_service(StudentService):
                             page_size: int,
                             page_index: int
                             ) -> List[CourseSearchEntry]:
+        ans, _ = await self.__search(
+            student_id, semester_id, search_cid, search_name,
+            search_instructor, search_day_of_week, search_class_time,
+            search_class_locations, search_course_type, ignore_full,
+            ignore_conflict, ignore_passed, ignore_missing_prerequisites,
+            {'limit': page_size, 'offset': page_size*page_index})
+        return ans
+
+    async def search_course_page(self, *,
+                                 student_id: int,
+                                 semester_id: int,
+                                 search_cid: Optional[str] = None,
+                                 search_name: Optional[str] = None,
+                                 search_instructor: Optional[str] = None,
+                                 search_day_of_week:
+                                 Optional[DayOfWeek] = None,
+                                 search_class_time: Optional[int] = None,
+                                 search_class_locations: List[str] = None,
+                                 search_course_type: CourseType,
+                                 ignore_full: bool,
+                                 ignore_conflict: bool,
+                                 ignore_passed: bool,
+                                 ignore_missing_prerequisites: bool,
+                                 page_size: int,
+                                 cursor: Optional[str] = None
+                                 ) -> CourseSearchPage:
+        # seek past the last (cid, _name) of the previous page instead of
+        # producing and discarding every earlier row
+        paging = {'limit': page_size, 'offset': 0}
+        if cursor is not None:
+            paging['after'] = None
+            paging['after_cid'], paging['after_name'] = \
+                search.decode_cursor(cursor)
+        ans, last = await self.__search(
+            student_id, semester_id, search_cid, search_name,
+            search_instructor, search_day_of_week, search_class_time,
+            search_class_locations, search_course_type, ignore_full,
+            ignore_conflict, ignore_passed, ignore_missing_prerequisites,
+            paging)
+        if len(ans) < page_size or last is None:
+            return CourseSearchPage(ans, None)
+        return CourseSearchPage(ans, search.encode_cursor(*last))
+
+    async def __search(self, student_id: int, semester_id: int,
+                       search_cid: Optional[str],
+                       search_name: Optional[str],
+                       search_instructor: Optional[str],
+                       search_day_of_week: Optional[DayOfWeek],
+                       search_class_time: Optional[int],
+                       search_class_locations: Optional[List[str]],
+                       search_course_type: CourseType,
+                       ignore_full: bool,
+                       ignore_conflict: bool,
+                       ignore_passed: bool,
+                       ignore_missing_prerequisites: bool,
+                       paging: dict
+                       ) -> Tuple[List[CourseSearchEntry],
+                                  Optional[Tuple[str, str]]]:
         async with self.__pool.acquire() as con:
-            stu = await con.fetchrow('select * from student where id = %d'
-                                     % student_id)
+            stu = await registry.fetchrow(con, 'get_student_row', student_id)
             if stu is None:
                 raise EntityNotFoundError(student_id)
-            HEAD = 'select * from schedule'
-            BODY = '''
-            where semester = %d ''' % semester_id
+            values = {'semester': semester_id}
+            values.update(paging)
             if search_cid:
-                BODY += "and cid like '%%%s%%' " % search_cid
+                values['cid'] = '%%%s%%' % search_cid
             if search_name:
-                BODY += "and _name like '%%%s%%' " % search_name
+                values['name'] = '%%%s%%' % search_name
             if search_instructor:
-                BODY += '''
-                and exists(
-                    select null
-                    from (select ins, generate_subscripts(ins, 1) as i) i
-                    where ins[i].full_name like '%%%s%%'
-                ) ''' % search_instructor
+                values['instructor'] = '%%%s%%' % search_instructor
             if search_day_of_week:
-                BODY += '''
-                and exists(
-                    select null
-                    from (select cls, generate_subscripts(cls, 1) as i) i
-                    where cls[i].day_of_week = '%s'
-                ) ''' % search_day_of_week.name
+                values['day'] = search_day_of_week.name
             if search_class_time:
-                BODY += '''
-                and exists(
-                    select null
-                    from (select cls, generate_subscripts(cls, 1) as i) i
-                    where %d between cls[i].class_begin and cls[i].class_end
-                ) ''' % search_class_time
+                values['time'] = search_class_time
             if search_class_locations:
-                BODY += '''
-                and exists(
-                    select null
-                    from (select cls, generate_subscripts(cls, 1) as i) i
-                    where cls[i].location ~ ANY(array%s)
-                ) ''' % search_class_locations
-            if search_course_type is CourseType.ALL:
-                pass
-            if search_course_type is CourseType.MAJOR_COMPULSORY:
-                BODY += '''
-                and cid in (
-                    select course_id
-                    from major_course
-                    where major_id = %d and course_type = 'C'
-                ) ''' % stu['major']
-            if search_course_type is CourseType.MAJOR_ELECTIVE:
-                BODY += '''
-                and cid in (
-                    select course_id
-                    from major_course
-                    where major_id = %d and course_type = 'E'
-                ) ''' % stu['major']
-            if search_course_type is CourseType.CROSS_MAJOR:
-                BODY += '''
-                and cid in (
-                    select course_id
-                    from major_course
-                    where major_id <> %d
-                ) ''' % stu['major']
-            if search_course_type is CourseType.PUBLIC:
-                BODY += 'and cid NOT in \
-                    (select course_id from major_course) '
+                values['locations'] = search_class_locations
+            if search_course_type is not CourseType.ALL:
+                values[search_course_type.name] = None
+                values['major'] = stu['major']
             if ignore_full:
-                BODY += 'and left_capacity > 0 '
+                values['full'] = None
             if ignore_passed:
-                BODY += '''
-                and sid NOT in (
-                    select section_id
-                    from takes
-                    where student_id = %d
-                        and grade <> 'FAIL'
-                        and (grade = 'PASS' or cast(grade as integer) >= 60)
-                ) ''' % student_id
+                values['passed'] = list(
+                    await self.__passed_courses(con, student_id))
             if ignore_missing_prerequisites:
-                BODY += 'and pass_pre(%d, cid) ' % student_id
+                passed = await self.__passed_courses(con, student_id)
+                values['missing'] = [
+                    c for c, p in (await self.__prerequisites.all(con)).items()
+                    if not satisfied(p, passed)]
+            # conflicts by time or course against the student's sections,
+            # decided in process from the semester's occupancy matrix
+            occ = await self.__occupancy.get(con, semester_id)
+            enrolled = self.__course_tables.sections(student_id, semester_id)
+            if enrolled is None:
+                token = self.__course_tables.token()
+                enrolled = [r['section_id'] for r in await registry.fetch(
+                    con, 'get_enrolled_sections_in_semester',
+                    student_id, semester_id)]
+                self.__course_tables.put_sections(token, student_id,
+                                                  semester_id, enrolled)
             if ignore_conflict:
-                BODY += '''
-                and NOT exists (
-                    select null
-                    from takes
-                        join section on section_id = section.id
-                        join class c on section.id = c.section
-                    where student_id = %d
-                      and semester = %d
-                      and (course = cid
-                       or exists(
-                          select null
-                          from (select cls, generate_subscripts(cls, 1) as i) i
-                          where cls[i].week_list && c.week_list
-                            and cls[i].day_of_week = c.day_of_week
-                            and cls[i].class_begin <= c.class_end
-                            and cls[i].class_end >= c.class_begin
-                      ))
-                ) ''' % (student_id, semester_id)
-
-            TAIL = '''
-            order by cid, _name
-            limit %d offset %d
-            ''' % (page_size, page_size*page_index)
+                values['conflict'] = None
+                values['conflicting'] = occ.conflicting(enrolled).tolist()
 
-            try:
-                stm = await con.prepare(HEAD+BODY+TAIL)
-            except asyncpg.exceptions.SyntaxOrAccessError as e:
-                print(HEAD+BODY+TAIL)
-                print(e)
-
-            res = await stm.fetch()
+            name, params = search.plan(values.keys())
+            res = await registry.fetch(con, name,
+                                       *[values[p] for p in params])
 
             if not res:
-                return []
+                return [], None
             else:
+                if ignore_conflict:
+                    names = {}
+                else:
+                    names = occ.conflict_names(enrolled,
+                                               [r['sid'] for r in res])
                 ans = []
                 for r in res:
                     ins = {i['id']: Instructor(i['id'], i['full_name']) for i in r['ins']}
@@ -186,119 +360,80 @@ class student_service(StudentService):
                                               c['class_end'],
                                               c['location']
                                               ) for c in r['cls']]
-                    if ignore_conflict:
-                        conf = []
-                    else:
-                        conf = await con.fetch('''
-                        select distinct course.name||'['||section.name||']' as _name
-                        from takes
-                            join section on section_id = section.id
-                            join class on section.id = class.section
-                            join course on section.course = course.id
-                        where student_id = %d and semester = %d
-                          and (
-                              course = '%s'
-                              or exists (
-                                  select null
-                                  from class this
-                                  where section = %d
-                                    and week_list && this.week_list
-                                    and day_of_week = this.day_of_week
-                                    and class_begin <= this.class_end
-                                    and class_end >= this.class_begin
-                              )
-                          )
-                        order by _name
-                        ''' % (student_id, semester_id, r['cid'], r['sid']))
-                        conf = [c['_name'] for c in conf]
+                    conf = names.get(r['sid'], [])
 
+                    self.__prerequisites.put_section(r['sid'], r['cid'])
                     ans.append(CourseSearchEntry(cos, sec, cls, conf))
-                return ans
+                return ans, (res[-1]['cid'], res[-1]['_name'])
 
     async def enroll_course(self,
                             student_id: int,
                             section_id: int) -> EnrollResult:
-        async with self.__pool.acquire() as con:
-            try:
-                sec = await con.fetchrow('''
-                select * from section where id = %d
-                ''' % section_id)
-                if sec is None:
-                    return EnrollResult.COURSE_NOT_FOUND
-
-                took = await con.fetchrow('''
-                select null
-                from takes
-                where student_id = %d and section_id = %d
-                ''' % (student_id, section_id))
-                if took:
-                    return EnrollResult.ALREADY_ENROLLED
-
-                grade = await con.fetch('''
-                select grade
-                from takes
-                where student_id = %d
-                  and section_id in (select id from section where course ='%s')
-                ''' % (student_id, sec['course']))
-                if (grade and grade[-1][0]):
-                    if grade[-1][0] == 'PASS':
-                        return EnrollResult.ALREADY_PASSED
-                    if grade[-1][0] != 'FAIL' and int(grade[-1][0]) >= 60:
-                        return EnrollResult.ALREADY_PASSED
-
-                pas = await con.fetchval("select pass_pre(%d, '%s')"
-                                         % (student_id, sec['course']))
-                if not pas:
-                    return EnrollResult.PREREQUISITES_NOT_FULFILLED
-
-                conf = await con.fetch('''
-                select null
-                from takes
-                    join section on section_id = section.id
-                    join class on section.id = class.section
-                where student_id = %d and semester = %d
-                  and (
-                       course = '%s'
-                       or exists (
-                          select null
-                          from class this
-                              join section on this.section = %d
-                          where this.week_list && class.week_list
-                            and this.day_of_week = class.day_of_week
-                            and this.class_begin <= class.class_end
-                            and this.class_end >= class.class_begin
-                       )
-                  )
-                ''' % (student_id, sec['semester'], sec['course'], section_id))
-                if conf:
-                    return EnrollResult.COURSE_CONFLICT_FOUND
-
-                if sec['left_capacity'] == 0:
-                    return EnrollResult.COURSE_IS_FULL
-
-                async with con.transaction() as tr:
-                    await con.execute('''
-                    insert into takes (student_id, section_id)
-                    values (%d, %d)
-                    ''' % (student_id, section_id))
-                    await con.execute('''
-                    update section
-                    set left_capacity = left_capacity - 1
-                    where id = %d
-                    ''' % (section_id))
-
-                    capacity = await con.fetchval('''
-                        select left_capacity
-                        from section
-                        where id = %d
-                    ''' % (section_id))
-                    if capacity >= 0:
-                        return EnrollResult.SUCCESS
-                    else:
-                        await tr.rollback()
-                        return EnrollResult.COURSE_IS_FULL
-            except asyncpg.exceptions.IntegrityConstraintViolationError as e:
-                raise IntegrityViolationError from e
+        passed, pre_ok = self.__hints(student_id, section_id)
+        try:
+            res = await self.__admission.enroll(
+                student_id, section_id, passed, pre_ok,
+                lambda semester_id: self.__settle(
+                    student_id, section_id, semester_id, passed, pre_ok))
+            if res == 'SUCCESS':
+                self.__course_tables.discard(student_id)
+                self.__references.discard('section', section_id)
+            return EnrollResult[res]
+        except asyncpg.exceptions.IntegrityConstraintViolationError as e:
+            raise IntegrityViolationError from e
+
+    def __hints(self, student_id: int, section_id: int) \
+            -> Tuple[Optional[bool], Optional[bool]]:
+        # settle the passed and prerequisite checks in process when it needs
+        # no query, None leaves them to enroll_course on the server
+        course_id = self.__prerequisites.course_of(section_id)
+        if course_id is None:
+            return None, None
+        known, dnf = self.__prerequisites.peek(course_id)
+        passed = self.__passed.get(student_id)
+        if passed is None:
+            return None, True if known and dnf is None else None
+        return (course_id in passed,
+                satisfied(dnf, passed) if known else None)
+
+    def __settle(self, student_id: int, section_id: int, semester_id: int,
+                 passed: Optional[bool], pre_ok: Optional[bool]) \
+            -> Optional[str]:
+        # enroll_course's checks ahead of COURSE_IS_FULL, answered from the
+        # caches once every one of them is known, None otherwise
+        enrolled = self.__course_tables.sections(student_id, semester_id)
+        occ = self.__occupancy.peek(semester_id)
+        if passed is None or pre_ok is None or enrolled is None \
+                or occ is None or section_id not in occ:
+            return None
+        if section_id in enrolled:
+            return 'ALREADY_ENROLLED'
+        if passed:
+            return 'ALREADY_PASSED'
+        if not pre_ok:
+            return 'PREREQUISITES_NOT_FULFILLED'
+        if section_id in occ.conflicting(enrolled):
+            return 'COURSE_CONFLICT_FOUND'
+        return 'COURSE_IS_FULL'
+
+    def __pass(self, student_id: int, course_id: str):
+        passed = self.__passed.peek(student_id)
+        if passed is not None:
+            passed.add(course_id)
+        else:
+            # a set being loaded may have missed the course
+            self.__passed.discard(student_id)
+
+    async def __passed_courses(self, con: asyncpg.Connection,
+                               student_id: int) -> Set[str]:
+        passed = self.__passed.get(student_id)
+        if passed is not None:
+            return passed
+        token = self.__passed.token()
+        res = await registry.fetch(con, 'get_passed_courses', student_id)
+        passed = {r['course'] for r in res}
+        self.__passed.put(student_id, passed, token)
+        return passed
 
     async def drop_course(self,
                           student_id: int,
@@ -307,25 +442,20 @@ class student_service(StudentService):
             if (student_id, section_id) in self.__cache:
                 grade = self.__cache[(student_id, section_id)]
             else:
-                res = await con.fetchrow('''
-                select grade from takes
-                where student_id = %d and section_id = %d
-                ''' % (student_id, section_id))
+                res = await registry.fetchrow(con, 'get_takes_grade',
+                                              student_id, section_id)
                 if res is None:
                     raise EntityNotFoundError
                 grade = res['grade']
             if grade is not None:
                 raise RuntimeError
             async with con.transaction():
-                await con.execute('''
-                delete from takes
-                where student_id = %d and section_id = %d
-                ''' % (student_id, section_id))
-                await con.execute('''
-                update section
-                set left_capacity = left_capacity+1
-                where id = %d
-                ''' % section_id)
+                await registry.execute(con, 'delete_takes',
+                                       student_id, section_id)
+                await registry.execute(con, 'release_seat', section_id)
+            self.__admission.release(section_id)
+            self.__course_tables.discard(student_id)
+            self.__references.discard('section', section_id)
 
     async def add_enrolled_course_with_grade(self,
                                              student_id: int,
@@ -334,18 +464,15 @@ class student_service(StudentService):
         async with self.__pool.acquire() as con:
             try:
                 if grade is None:
-                    await con.execute('''
-                    insert into takes (student_id, section_id)
-                    values (%d, %d)
-                    ''' % (student_id, section_id))
+                    await registry.execute(con, 'add_takes',
+                                           student_id, section_id, None)
+                    self.__course_tables.discard(student_id)
                 else:
-                    grading = await con.fetchval('''
-                    select grading
-                    from course
-                    where id = (select course from section where section.id=%d)
-                    ''' % section_id)
-                    if (grading is None):
+                    course = await registry.fetchrow(
+                        con, 'get_course_grading_by_section', section_id)
+                    if (course is None):
                         raise EntityNotFoundError
+                    grading = course['grading']
                     if (grading == 'PASS_OR_FAIL' and type(grade) == int or
                             grading == 'HUNDRED_MARK_SCORE' and
                             isinstance(grade, PassOrFailGrade)):
@@ -355,14 +482,76 @@ class student_service(StudentService):
                         grade = str(grade)
                     else:
                         grade = grade.name
-                    await con.execute('''
-                    insert into takes (student_id, section_id, grade)
-                    values (%d, %d, '%s')
-                    ''' % (student_id, section_id, grade))
+                    await registry.execute(con, 'add_takes',
+                                           student_id, section_id, grade)
+                    self.__course_tables.discard(student_id)
                     self.__cache[(student_id, section_id)] = grade
+                    if student_service.passing(grade):
+                        self.__pass(student_id, course['id'])
             except asyncpg.exceptions.IntegrityConstraintViolationError as e:
                 raise IntegrityViolationError from e
 
+    async def add_enrolled_courses_with_grade(
+            self,
+            records: Union[Iterable[Tuple[int, int, Optional[Grade]]],
+                           AsyncIterable[Tuple[int, int, Optional[Grade]]]]
+    ) -> List[bool]:
+        async with self.__pool.acquire() as con:
+            async with con.transaction():
+                await timed(con.execute('''
+                create temp table takes_import (
+                    idx         integer,
+                    student_id  integer,
+                    section_id  integer,
+                    grade       varchar
+                ) on commit drop
+                '''))
+                n = await copy_staged(
+                    con, 'takes_import',
+                    ('student_id', 'section_id', 'grade'), records,
+                    lambda stu, sec, grade: (stu, sec,
+                                             student_service.db(grade)))
+                # grading types are checked against course.grading for the
+                # whole batch; duplicates keep their first valid occurrence,
+                # which is the one reported accepted
+                res = await timed(con.fetch('''
+                with pick as (
+                    select distinct on (i.student_id, i.section_id)
+                        i.idx, i.student_id, i.section_id, i.grade,
+                        section.course
+                    from takes_import i
+                        join student on i.student_id = student.id
+                        join section on i.section_id = section.id
+                        join course on section.course = course.id
+                    where i.grade is null
+                       or (grading = 'PASS_OR_FAIL'
+                           and i.grade in ('PASS', 'FAIL'))
+                       or (grading = 'HUNDRED_MARK_SCORE'
+                           and case when i.grade ~ '^[0-9]{1,3}$'
+                               then cast(i.grade as integer) <= 100
+                               else false end)
+                    order by i.student_id, i.section_id, i.idx
+                ),
+                ins as (
+                    insert into takes (student_id, section_id, grade)
+                    select student_id, section_id, grade
+                    from pick
+                    on conflict do nothing
+                    returning student_id, section_id
+                )
+                select pick.*
+                from ins join pick using (student_id, section_id)
+                '''))
+        accepted = [False] * n
+        for r in res:
+            accepted[r['idx']] = True
+            self.__course_tables.discard(r['student_id'])
+            if r['grade'] is not None:
+                self.__cache[(r['student_id'], r['section_id'])] = r['grade']
+                if student_service.passing(r['grade']):
+                    self.__pass(r['student_id'], r['course'])
+        return accepted
+
     async def set_enrolled_course_grade(self,
                                         student_id: int,
                                         section_id: int,
@@ -372,15 +561,17 @@ class student_service(StudentService):
                 grade = str(grade)
             else:
                 grade = grade.name
-            res = await con.execute('''
-            update takes
-            set grade = '%s'
-            where student_id = %d and section_id = %d
-            ''' % (grade, student_id, section_id))
-            if res == 'UPDATE 0':
+            course = await registry.fetchval(con, 'set_takes_grade',
+                                             student_id, section_id, grade)
+            if course is None:
                 raise EntityNotFoundError
             else:
                 self.__cache[(student_id, section_id)] = grade
+                if student_service.passing(grade):
+                    self.__pass(student_id, course)
+                else:
+                    # the course may still be passed in another section
+                    self.__passed.discard(student_id)
 
     async def get_enrolled_courses_and_grades(self,
                                               student_id: int,
@@ -388,21 +579,12 @@ class student_service(StudentService):
             -> Mapping[Course, Grade]:
         async with self.__pool.acquire() as con:
             if semester_id:
-                res = await con.fetch('''
-                select course.*, grade
-                from course
-                    join section on course.id = section.course and semester =%d
-                    join takes on section.id = section_id and student_id = %d
-                ''' % (semester_id, student_id))
+                res = await registry.fetch(
+                    con, 'get_enrolled_courses_and_grades_in_semester',
+                    student_id, semester_id)
             else:
-                res = await con.fetch('''
-                select course.*, grade
-                from course
-                    join section on course.id = section.course
-                    join takes on section.id = section_id and student_id = %d
-                    join semester on section.semester = semester.id
-                order by begin_date
-                ''' % student_id)
+                res = await registry.fetch(
+                    con, 'get_enrolled_courses_and_grades', student_id)
             if res:
                 return {Course(r['id'],
                                r['name'],
@@ -424,99 +606,117 @@ class student_service(StudentService):
             grade = int(grade)
         return grade
 
+    def passing(grade: str) -> bool:
+        if grade in ('PASS', 'FAIL'):
+            return grade == 'PASS'
+        return int(grade) >= 60
+
+    def db(grade: Optional[Grade]) -> Optional[str]:
+        if grade is None:
+            return None
+        elif type(grade) == int:
+            return str(grade)
+        else:
+            return grade.name
+
     async def get_course_table(self,
                                student_id: int,
                                date: datetime.date) -> CourseTable:
+        if not self.__semesters.loaded:
+            async with self.__pool.acquire() as con:
+                await self.__semesters.load(con)
+        semester, week = self.__semesters.locate(date)
+        if semester is None or week is None:
+            return {day: [] for day in DayOfWeek}
+        table = self.__course_tables.get(student_id, semester, week)
+        if table is not None:
+            return table
+
         async with self.__pool.acquire() as con:
-            semester, week = await con.fetchval('''
-            select day_in_semester_week('%s')
-            ''' % date)
-            if semester is None or week is None:
-                return {day: [] for day in DayOfWeek}
-
-            res = await con.fetch('''
-            select day_of_week,
-                   course.name || '[' || section.name || ']' as class_name,
-                   instructor,
-                   full_name,
-                   class_begin,
-                   class_end,
-                   location
-            from class
-                join section on section = section.id and semester = %d
-                join takes on section = section_id and student_id = %d
-                join course on section.course = course.id
-                join instructor on instructor = instructor.id
-            where %d = ANY(week_list)
-            ''' % (semester, student_id, week))
+            token = self.__course_tables.token()
+            res = await registry.fetch(con, 'get_course_table',
+                                       student_id, semester, week)
             table = {day: [] for day in DayOfWeek}
             for r in res:
-                day = DayOfWeek[r['day_of_week']]
-                entry = CourseTableEntry(r['class_name'],
-                                         Instructor(r['instructor'],
-                                                    r['full_name']),
-                                         r['class_begin'],
-                                         r['class_end'],
-                                         r['location'])
-                table[day].append(entry)
+                table[DayOfWeek[r['day_of_week']]].append(
+                    student_service.entry(r))
+            self.__course_tables.put(token, student_id, semester, week, table)
             return table
 
+    def entry(r: asyncpg.Record) -> CourseTableEntry:
+        return CourseTableEntry(r['class_name'],
+                                Instructor(r['instructor'], r['full_name']),
+                                r['class_begin'],
+                                r['class_end'],
+                                r['location'])
+
+    async def get_semester_course_tables(self,
+                                         student_id: int,
+                                         semester_id: int) \
+            -> Mapping[int, CourseTable]:
+        if not self.__semesters.loaded:
+            async with self.__pool.acquire() as con:
+                await self.__semesters.load(con)
+        span = self.__semesters.span(semester_id)
+        if span is None:
+            raise EntityNotFoundError
+        begin, end = span
+        weeks = (end - begin).days // 7 + 1
+        tables = await self.__course_tables_of(
+            student_id, [(semester_id, w) for w in range(1, weeks + 1)])
+        return {week: table for (_, week), table in tables.items()}
+
+    async def get_course_tables(self,
+                                student_id: int,
+                                begin: datetime.date,
+                                end: datetime.date) \
+            -> Mapping[Tuple[int, int], CourseTable]:
+        if not self.__semesters.loaded:
+            async with self.__pool.acquire() as con:
+                await self.__semesters.load(con)
+        return await self.__course_tables_of(
+            student_id, self.__semesters.weeks(begin, end))
+
+    async def __course_tables_of(self, student_id: int,
+                                 keys: List[Tuple[int, int]]) \
+            -> Dict[Tuple[int, int], CourseTable]:
+        # the weeks not cached come from one query over the student's
+        # classes in their semesters, expanding each class's week list
+        tables = {key: self.__course_tables.get(student_id, *key)
+                  for key in keys}
+        missing = {key for key, table in tables.items() if table is None}
+        if not missing:
+            return tables
+        for key in missing:
+            tables[key] = {day: [] for day in DayOfWeek}
+        async with self.__pool.acquire() as con:
+            token = self.__course_tables.token()
+            res = await registry.fetch(con, 'get_course_tables', student_id,
+                                       list({s for s, _ in missing}))
+        for r in res:
+            day = DayOfWeek[r['day_of_week']]
+            for week in r['week_list']:
+                key = (r['semester'], week)
+                if key in missing:
+                    tables[key][day].append(student_service.entry(r))
+        for key in missing:
+            self.__course_tables.put(token, student_id, *key, tables[key])
+        return tables
+
     async def passed_prerequisites_for_course(self,
                                               student_id: int,
                                               course_id: str) -> bool:
-        return await self.__pool.acquire().fetchval("select pass_pre(%d, '%s'"
-                                                    % student_id, course_id)
-        # async with self.__pool.acquire() as con:
-        #     res = await con.fetch('''
-        #     select *
-        #     from prerequisite
-        #     where id = '%s'
-        #     order by idx
-        #     ''' % course_id)
-        #     if not res:
-        #         return True
-        #     pas = await con.fetch('''
-        #     select course
-        #     from takes
-        #         join section on section_id = section.id
-        #     where student_id = %d
-        #       and grade <> 'FAIL'
-        #       and (grade = 'PASS' or cast(grade as integer) >= 60)
-        #     ''' % student_id)
-        #     pas = [str(t['course']) for t in pas]
-
-        #     stack = [0]
-        #     val = [False for i in range(len(res))]
-        #     visited = [False for i in range(len(res))]
-        #     while stack:
-        #         i = stack[-1]
-        #         if visited[i]:
-        #             if res[i]['val'] == 'AND':
-        #                 val[i] = all([val[c] for c in res[i]['ptr']])
-        #                 stack.pop()
-        #             elif res[i]['val'] == 'OR':
-        #                 val[i] = any([val[c] for c in res[i]['ptr']])
-        #                 stack.pop()
-        #         else:
-        #             visited[i] = True
-        #             if res[i]['ptr']:
-        #                 for j in res[i]['ptr']:
-        #                     stack.append(j)
-        #             else:
-        #                 val[i] = (res[i]['val'] in pas)
-        #                 stack.pop()
-        #     return val[0]
+        async with self.__pool.acquire() as con:
+            dnf = await self.__prerequisites.get(con, course_id)
+            if dnf is None:
+                return True
+            return satisfied(dnf, await self.__passed_courses(con, student_id))
 
     async def get_student_major(self,
                                 student_id: int) -> Major:
         async with self.__pool.acquire() as con:
-            res = await con.fetchrow('''
-            select major.id, major.name as major_name, department,
-                department.name as department_name
-            from major
-                join department on department = department.id
-            where major.id = (select major from student where student.id = %d)
-            ''' % student_id)
+            res = await registry.fetchrow(con, 'get_student_major',
+                                          student_id)
             if res:
                 return Major(res['id'],
                              res['major_name'],
@@ -0,0 +1,22 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from .cache import lru
+from .course_table import course_table_cache
+
+# (student id, section id) -> grade, as recorded by the student service
+Grades = Dict[Tuple[int, int], str]
+
+
+def forget_takes(passed: lru, grades: Grades,
+                 course_tables: course_table_cache,
+                 rows: Iterable[Tuple[Optional[int], Optional[int]]]):
+    # enrollments deleted by a cascade, e.g. with their section or student;
+    # the student's passed set, tables and the grade of each row are read
+    # again.
+    # (None, None) stands for a deleted parent that had no takes rows
+    for student_id, section_id in rows:
+        if student_id is None:
+            continue
+        passed.discard(student_id)
+        course_tables.discard(student_id)
+        grades.pop((student_id, section_id), None)
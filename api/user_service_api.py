@@ -1,35 +1,108 @@
 from exception import EntityNotFoundError
 import asyncpg
 from service.user_service import UserService
-from typing import List
+from typing import List, Optional
 
 from dto import Instructor, Student, User, Major, Department
 
+from .cache import lru
+from .course_table import course_table_cache
+from .occupancy import occupancy_cache
+from .reference import reference_cache
+from .statement import registry
+from .takes import Grades, forget_takes
+
+registry.register('remove_instructor', '''
+with gone as (
+    delete from instructor where id = $1
+    returning id
+)
+select distinct gone.id, section.semester
+from gone
+    left join class on class.instructor = gone.id
+    left join section on section.id = class.section
+''')
+registry.register('remove_student', '''
+with gone as (
+    delete from student where id = $1
+    returning id
+)
+select gone.id, takes.student_id, takes.section_id
+from gone
+    left join takes on takes.student_id = gone.id
+''')
+registry.register('get_all_instructors', 'select * from instructor')
+registry.register('get_all_students', '''
+select student.id as student_id, full_name, enrolled_date,
+    major.id as major_id, major.name as major_name,
+    department.id as department_id, department.name as department_name
+from student join major
+    on student.major = major.id
+    join department
+    on major.department = department.id
+''')
+registry.register('get_student', '''
+select student.id as student_id, full_name, enrolled_date,
+    major.id as major_id, major.name as major_name,
+    department.id as department_id, department.name as department_name
+from student join major
+    on student.major = major.id
+    join department
+    on major.department = department.id
+where student.id = $1
+''')
+registry.register('get_instructor', '''
+select * from instructor where id = $1
+''')
+
+
+def full_name(first_name: str, last_name: str) -> str:
+    # latin names are joined with a space, CJK names are not
+    if str.isascii(first_name) and str.isascii(last_name):
+        return first_name+' '+last_name
+    return first_name+last_name
+
 
 class user_service(UserService):
 
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool,
+                 course_tables: Optional[course_table_cache] = None,
+                 references: Optional[reference_cache] = None,
+                 passed: Optional[lru] = None,
+                 grades: Optional[Grades] = None,
+                 occupancy: Optional[occupancy_cache] = None):
         self.__pool = pool
+        self.__course_tables = course_tables or course_table_cache()
+        self.__references = references or reference_cache()
+        # of the student service, enrollments go with the student
+        self.__passed = passed if passed is not None else lru(1 << 16)
+        self.__grades = grades if grades is not None else {}
+        self.__occupancy = occupancy or occupancy_cache()
 
     async def remove_user(self, user_id: int):
         async with self.__pool.acquire() as con:
-            res1 = await con.execute('delete from instructor where id='+user_id)
-            res2 = await con.execute('delete from student where id='+user_id)
-            if res1 == 'DELETE 0' and res2 == 'DELETE 0':
+            res1 = await registry.fetch(con, 'remove_instructor', user_id)
+            res2 = await registry.fetch(con, 'remove_student', user_id)
+            if res1:
+                # their classes went with them
+                self.__course_tables.clear()
+                for r in res1:
+                    if r['semester'] is not None:
+                        self.__occupancy.discard(r['semester'])
+                self.__references.clear('class_section', 'classes')
+            if res2:
+                self.__course_tables.discard(user_id)
+                forget_takes(self.__passed, self.__grades,
+                             self.__course_tables,
+                             [(r['student_id'], r['section_id'])
+                              for r in res2])
+            if not res1 and not res2:
                 raise EntityNotFoundError
 
     async def get_all_users(self) -> List[User]:
         async with self.__pool.acquire() as con:
-            instructors = await con.fetch('select * from instructor')
-            students = await con.fetch('''
-                select student.id as student_id, full_name, enrolled_date,
-                    major.id as major_id, major.name as major_name,
-                    department.id as department_id, department.name as department_name
-                from student join major
-                    on student.major = major.id
-                    join department
-                    on major.department = department.id
-            ''')
+            instructors = await registry.fetch(con, 'get_all_instructors')
+            students = await registry.fetch(con, 'get_all_students')
             if(instructors and students):
                 return ([Instructor(i['id'], i['full_name']) for i in instructors]
                         + [Student(s['student_id'],
@@ -60,17 +133,8 @@ class user_service(UserService):
 
     async def get_user(self, user_id: int) -> User:
         async with self.__pool.acquire() as con:
-            s = await con.fetchrow('''
-                select student.id as student_id, full_name, enrolled_date,
-                    major.id as major_id, major.name as major_name,
-                    department.id as department_id, department.name as department_name
-                from student join major
-                    on student.major = major.id
-                    join department
-                    on major.department = department.id
-                where student.id =
-            '''+user_id)
-            i = await con.fetchrow('select * from instructor where id='+user_id)
+            s = await registry.fetchrow(con, 'get_student', user_id)
+            i = await registry.fetchrow(con, 'get_instructor', user_id)
             if s:
                 return Student(s['student_id'],
                                s['full_name'],
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 
+import argparse
 import asyncio
-from collections import defaultdict
 import json
 import os
-from datetime import datetime
-from time import time
-from typing import Optional
+import sys
+from datetime import date, datetime
+from statistics import median
+from time import perf_counter, time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from dto import AndPrerequisite, Instructor, OrPrerequisite, CoursePrerequisite, PassOrFailGrade, CourseSearchEntry, \
     Course, \
@@ -21,23 +23,86 @@ cls_id = {}
 did = {}
 mid = {}
 
-inserted = set()
-course_inserting = defaultdict(asyncio.Lock)
-cd = {}
-cs = json.load(open('data/courses.json', encoding='utf-8'))
-ps = json.load(open('data/coursePrerequisites.json', encoding='utf-8'))
-ss = json.load(open('data/semesters.json', encoding='utf-8'))
-ds = json.load(open('data/departments.json', encoding='utf-8'))
-ms = json.load(open('data/majors.json', encoding='utf-8'))
-css = json.load(open('data/courseSections.json', encoding='utf-8'))
-cscs = json.load(open('data/courseSectionClasses.json', encoding='utf-8'))
+# the data set, data/ or one written by generate.py
+data_dir = 'data'
+# size of the chunks the data files are read in
+CHUNK = 1 << 16
+decoder = json.JSONDecoder()
+
+
+class json_stream:
+    # the elements of a top-level JSON array, or the (key, value) pairs of a
+    # top-level object, decoded one at a time from chunks of the file, so
+    # memory stays flat whatever the size of the data set
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator:
+        with open(self.path, encoding='utf-8') as f:
+            self.file, self.buf, self.pos = f, '', 0
+            first = self.next_char()
+            if first not in ('[', '{'):
+                raise ValueError(f'{self.path}: expected an array or an object')
+            self.pos += 1
+            while True:
+                c = self.next_char()
+                if c == ',':
+                    self.pos += 1
+                    c = self.next_char()
+                if c in (']', '}'):
+                    return
+                if c == '':
+                    raise ValueError(f'{self.path}: truncated')
+                if first == '[':
+                    yield self.value()
+                    continue
+                key = self.value()
+                if self.next_char() != ':':
+                    raise ValueError(f'{self.path}: expected a colon')
+                self.pos += 1
+                self.next_char()
+                yield key, self.value()
+
+    def fill(self) -> bool:
+        chunk = self.file.read(CHUNK)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def next_char(self) -> str:
+        # skips whitespace, '' at the end of the file
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def value(self):
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may go on in the next chunk
+                if end < len(self.buf):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            if not self.fill():
+                value, self.pos = decoder.raw_decode(self.buf, self.pos)
+                return value
+
 
-mcc = json.load(open('data/majorCompulsoryCourses.json', encoding='utf-8'))
-mec = json.load(open('data/majorElectiveCourses.json', encoding='utf-8'))
+def records(name: str) -> json_stream:
+    return json_stream(f'{data_dir}/{name}.json')
 
-us = json.load(open('data/users.json', encoding='utf-8'))
 
-sc = json.load(open('data/studentCourses.json', encoding='utf-8'))
+def cases(path: str) -> Iterator[Tuple[list, Any]]:
+    # (query, answer) pairs of every workload file in path
+    for x in sorted(os.listdir(path)):
+        if (not x.endswith('.json')) or 'Result' in x:
+            continue
+        yield from zip(json_stream(f'{path}/{x}'), json_stream(f'{path}/{x.split(".")[0]}Result.json'))
+
 
 rcs: Optional[CourseService] = None
 rds: Optional[DepartmentService] = None
@@ -47,167 +112,195 @@ rss: Optional[SemesterService] = None
 rsts: Optional[StudentService] = None
 rus: Optional[UserService] = None
 
+# students of the data set sent at one new section all at once, and its seats
+RUSH_STUDENTS = 300
+RUSH_CAPACITY = 38
+
+# latencies of the service calls of the running phase, in seconds
+latencies: List[float] = []
+# tasks working through the records of a phase, None for one per record
+workers: Optional[int] = None
+
+
+async def op(aw):
+    # one timed service call
+    start = perf_counter()
+    try:
+        return await aw
+    finally:
+        latencies.append(perf_counter() - start)
+
 
-async def pc(pre_json: Optional[dict]):
+async def each(fn, items: Iterable) -> int:
+    # sums fn over the items; the workers pull from one shared iterator so
+    # neither the records nor the pending tasks pile up
+    if workers is None:
+        return sum(r or 0 for r in await asyncio.gather(*[fn(i) for i in items]))
+    it = iter(items)
+
+    async def worker():
+        total = 0
+        for i in it:
+            total += await fn(i) or 0
+        return total
+
+    return sum(await asyncio.gather(*[worker() for _ in range(workers)]))
+
+
+def pc(pre_json: Optional[dict]):
     if pre_json is None:
         return None
     if 'And' in pre_json.get('@type', '') or 'And' in pre_json.get('@class', ''):
-        return AndPrerequisite(terms=[await pc(t) for t in pre_json['terms']])
+        return AndPrerequisite(terms=[pc(t) for t in pre_json['terms']])
     elif 'Or' in pre_json.get('@type', '') or 'Or' in pre_json.get('@class', ''):
-        return OrPrerequisite(terms=[await pc(t) for t in pre_json['terms']])
+        return OrPrerequisite(terms=[pc(t) for t in pre_json['terms']])
     else:
-        await insert_course(cd[pre_json['courseID']])
         return CoursePrerequisite(course_id=pre_json['courseID'])
 
 
-async def insert_course(c):
-    if c['id'] in inserted:
-        return
-    async with course_inserting[c['id']]:
-        if c['id'] in inserted:
-            return
-        p = ps[c['id']]
-        await rcs.add_course(c['id'], c['name'], c['credit'], c['classHour'], CourseGrading[c['grading']], await pc(p))
-        inserted.add(c['id'])
-
-
 async def test_add_course():
-    async def add_one(c):
-        cd[c['id']] = c
-        await insert_course(c)
-        sections = css[c['id']]
-        for sem in list(sections.keys())[1:]:
-            for s in sections[f'{sem}'][1:]:
-                for s2 in s:
-                    section_id = await rcs.add_course_section(c['id'], sid[int(sem)], s2['name'], s2['totalCapacity'])
-                    sec_id[s2['id']] = section_id
-                    cls = cscs[f"{s2['id']}"][1]
-                    for cl in cls:
-                        class_id = await rcs.add_course_section_class(section_id, cl['instructor']['id'],
-                                                                      DayOfWeek[cl['dayOfWeek']],
-                                                                      cl['weekList'], cl['classBegin'], cl['classEnd'],
-                                                                      cl['location'])
-                        cls_id[cl['id']] = class_id
-
-    await asyncio.gather(*[add_one(c) for c in cs])
+    def courses():
+        # both files list the courses in the same order, read side by side
+        for c, (cid, pre) in zip(records('courses'), records('coursePrerequisites')):
+            if c['id'] != cid:
+                raise ValueError(f'coursePrerequisites.json: {cid} where courses.json has {c["id"]}')
+            yield c['id'], c['name'], c['credit'], c['classHour'], CourseGrading[c['grading']], pc(pre)
+
+    await op(rcs.add_courses(courses()))
+
+    # json ids in the order the services return the new ids
+    order = []
+
+    def sections():
+        for cid, semesters in records('courseSections'):
+            for sem in semesters:
+                if sem == '@type':
+                    continue
+                for s2 in semesters[sem][1]:
+                    order.append(s2['id'])
+                    yield cid, sid[int(sem)], s2['name'], s2['totalCapacity']
+
+    sec_id.update(zip(order, await op(rcs.add_course_sections(sections()))))
+    order = []
+
+    def classes():
+        for sec, cls in records('courseSectionClasses'):
+            if int(sec) not in sec_id:
+                continue
+            for cl in cls[1]:
+                order.append(cl['id'])
+                yield (sec_id[int(sec)], cl['instructor']['id'], DayOfWeek[cl['dayOfWeek']],
+                       cl['weekList'], cl['classBegin'], cl['classEnd'], cl['location'])
+
+    cls_id.update(zip(order, await op(rcs.add_course_section_classes(classes()))))
 
 
 async def test_add_semester():
     async def add_one(s):
         b = datetime.fromtimestamp(float(s['begin']) / 1000).date()
         e = datetime.fromtimestamp(float(s['end']) / 1000).date()
-        sid[s['id']] = await rss.add_semester(s['name'], b, e)
+        sid[s['id']] = await op(rss.add_semester(s['name'], b, e))
 
-    await asyncio.gather(*[add_one(s) for s in ss])
+    await each(add_one, records('semesters'))
 
 
 async def test_add_department():
     async def add_one(d):
-        did[d['id']] = await rds.add_department(d['name'])
+        did[d['id']] = await op(rds.add_department(d['name']))
 
-    await asyncio.gather(*[add_one(d) for d in ds])
+    await each(add_one, records('departments'))
 
 
 async def test_add_major():
     async def add_one(m):
-        mid[m['id']] = await rms.add_major(m['name'], did[m['department']['id']])
+        mid[m['id']] = await op(rms.add_major(m['name'], did[m['department']['id']]))
 
-    await asyncio.gather(*[add_one(m) for m in ms])
+    await each(add_one, records('majors'))
 
 
 async def test_add_major_course():
-    async def add_one_major(m, cc, ec):
-        for c in cc:
-            await rms.add_major_compulsory_course(mid[int(m)], c)
-        for c in ec:
-            await rms.add_major_elective_course(mid[int(m)], c)
+    async def add_compulsory(item):
+        m, cc = item
+        for c in cc[1]:
+            await op(rms.add_major_compulsory_course(mid[int(m)], c))
+
+    async def add_elective(item):
+        m, ec = item
+        for c in ec[1]:
+            await op(rms.add_major_elective_course(mid[int(m)], c))
 
-    await asyncio.gather(*[add_one_major(m, mcc[str(m)][1], mec[str(m)][1]) for m in mid])
+    await each(add_compulsory, records('majorCompulsoryCourses'))
+    await each(add_elective, records('majorElectiveCourses'))
 
 
 async def test_add_user():
-    async def add_one(u):
-        if 'Instructor' in u['@type']:
-            await (ris.add_instructor(u['id'], u['fullName'].split(',')[0], u['fullName'].split(',')[1]))
-        else:
-            await (rsts.add_student(u['id'], mid[u['major']['id']], u['fullName'].split(',')[0],
-                                    u['fullName'].split(',')[1],
-                                    datetime.fromtimestamp(u['enrolledDate'] / 1000).date()))
+    def name(u):
+        return u['fullName'].split(',')[0], u['fullName'].split(',')[1]
 
-    await asyncio.gather(*[add_one(u) for u in us])
+    # two passes over the file rather than holding it
+    await op(ris.add_instructors((u['id'],) + name(u) for u in records('users') if 'Instructor' in u['@type']))
+    await op(rsts.add_students((u['id'], mid[u['major']['id']]) + name(u) +
+                               (datetime.fromtimestamp(u['enrolledDate'] / 1000).date(),)
+                               for u in records('users') if 'Instructor' not in u['@type']))
 
 
 async def test_drop_except():
-    async def drop_one_student(stu, gradebook):
+    async def drop_one_student(item):
+        stu, gradebook = item
         exc = 0
         for sec in gradebook:
             if sec == '@type' or gradebook[sec] is None:
                 continue
             try:
-                await rsts.drop_course(int(stu), sec_id[int(sec)])
+                await op(rsts.drop_course(int(stu), sec_id[int(sec)]))
             except Exception:
                 exc += 1
         return exc
 
-    return sum(await asyncio.gather(*[drop_one_student(k, sc[k]) for k in sc]))
+    return await each(drop_one_student, records('studentCourses'))
 
 
 async def test_import_course():
-    async def import_one_student(stu, gradebook):
-        ok = 0
-        for sec in gradebook:
-            if sec == '@type':
-                continue
-            grade = gradebook[sec]
-            if grade is None:
-                pass
-            else:
+    def grades():
+        for stu, gradebook in records('studentCourses'):
+            for sec in gradebook:
+                if sec == '@type' or int(sec) not in sec_id:
+                    continue
+                grade = gradebook[sec]
                 if isinstance(grade, dict):
                     grade = grade['mark']
                 if isinstance(grade, list):
                     grade = PassOrFailGrade[grade[1]]
-            try:
-                await rsts.add_enrolled_course_with_grade(int(stu), sec_id[int(sec)], grade)
-                ok += 1
-            except Exception:
-                pass
-        return ok
+                yield int(stu), sec_id[int(sec)], grade
 
-    tasks = []
-    for k in sc:
-        tasks.append(asyncio.create_task(import_one_student(k, sc[k])))
-    return sum(await asyncio.gather(*tasks))
-    # return sum(await asyncio.gather(*[import_one_student(k, sc[k]) for k in sc]))
+    return sum(await op(rsts.add_enrolled_courses_with_grade(grades())))
 
 
 async def test_course_table(path):
-    async def test_one(p, a):
-        ans = {DayOfWeek[k]: [CourseTableEntry(e['courseFullName'],
-                                               Instructor(e['instructor']['id'],
-                                                          e['instructor']['fullName']
-                                                          ),
-                                               e['classBegin'],
-                                               e['classEnd'],
-                                               e['location']
-                                               ) for e in a['table'][k]].sort(key=lambda it: it.course_full_name)
+    def key(it):
+        return it.course_full_name, it.class_begin, it.location
+
+    async def test_one(case):
+        p, a = case
+        ans = {DayOfWeek[k]: sorted([CourseTableEntry(e['courseFullName'],
+                                                      Instructor(e['instructor']['id'],
+                                                                 e['instructor']['fullName']
+                                                                 ),
+                                                      e['classBegin'],
+                                                      e['classEnd'],
+                                                      e['location']
+                                                      ) for e in a['table'][k]], key=key)
                for k in a['table']}
         s = p[1][0]
         d = datetime.fromtimestamp(p[1][1] * 86400).date()
-        res = await rsts.get_course_table(s, d)
-        res = {k: res[k].sort(key=lambda it: it.course_full_name) for k in res.keys()}
+        res = await op(rsts.get_course_table(s, d))
+        res = {k: sorted(res[k], key=key) for k in res.keys()}
         if ans == res:
             return 1
         else:
             return 0
 
-    ok = 0
-    for x in os.listdir(path):
-        if (not x.endswith('.json')) or 'Result' in x:
-            continue
-        params = json.load(open(f'{path}/{x}', encoding='utf-8'))
-        ans = json.load(open(f'{path}/{x.split(".")[0]}Result.json', encoding='utf-8'))
-        ok += sum(await asyncio.gather(*[test_one(p, a) for (p, a) in zip(params, ans)]))
-    return ok
+    return await each(test_one, cases(path))
 
 
 async def test_enroll_course(path):
@@ -215,7 +308,7 @@ async def test_enroll_course(path):
         stu = p[1][0]
         sec = int(p[1][1])
         sec = sec_id[sec] if sec in sec_id else sec
-        res = await rsts.enroll_course(stu, sec)
+        res = await op(rsts.enroll_course(stu, sec))
         ans = EnrollResult[a[1]]
         if res is ans:
             return 1
@@ -226,195 +319,333 @@ async def test_enroll_course(path):
             # raise Exception("DEBUG")
             return 0
 
+    # in file order, the expected results depend on it
     ok = 0
-    for x in os.listdir(path):
-        if (not x.endswith('.json')) or 'Result' in x:
-            continue
-        params = json.load(open(f'{path}/{x}'))
-        ans = json.load(open(f'{path}/{x.split(".")[0]}Result.json'))
-        ok += sum([await test_one(p, a) for p, a in zip(params, ans)])
+    for p, a in cases(path):
+        ok += await test_one(p, a)
+    return ok
+
+
+async def test_rush():
+    # every request is in flight at once whatever --concurrency says; the
+    # count is the seats taken, only right if it is RUSH_CAPACITY, everyone
+    # else was told COURSE_IS_FULL and the database agrees
+    students = []
+    for u in records('users'):
+        if 'Instructor' not in u['@type'] and len(students) < RUSH_STUDENTS:
+            students.append(u['id'])
+    instructor = next(u['id'] for u in records('users') if 'Instructor' in u['@type'])
+    semester = await rss.add_semester('Rush', date(2000, 2, 1), date(2000, 6, 1))
+    await rcs.add_course('RUSH', 'Rush', 1, 16, CourseGrading.PASS_OR_FAIL, None)
+    section = await rcs.add_course_section('RUSH', semester, 'Rush', RUSH_CAPACITY)
+    await rcs.add_course_section_class(section, instructor, DayOfWeek.MONDAY, [1], 1, 2, 'Rush')
+
+    res = await asyncio.gather(*[op(rsts.enroll_course(stu, section)) for stu in students])
+    ok = res.count(EnrollResult.SUCCESS)
+    full = res.count(EnrollResult.COURSE_IS_FULL)
+    left = (await rcs.get_course_sections_in_semester('RUSH', semester))[0].left_capacity
+    enrolled = len(await rcs.get_enrolled_students_in_semester('RUSH', semester))
+    if ok + full != len(students) or left != RUSH_CAPACITY - ok or enrolled != ok:
+        print(f'RUSH ERROR: {ok} SUCCESS, {full} COURSE_IS_FULL of {len(students)}, '
+              f'{left} seats left, {enrolled} enrolled')
+        return 0
     return ok
 
 
 async def test_drop_course(path):
-    async def drop_one(p):
+    async def drop_one(case):
+        p, _ = case
         stu = p[1][0]
         sec = int(p[1][1])
         sec = sec_id[sec] if sec in sec_id else sec
         try:
-            await rsts.drop_course(stu, sec)
+            await op(rsts.drop_course(stu, sec))
             return 1
         except Exception:
             print(f'DROP FAIL {stu} {sec}')
             return 0
 
-    ok = 0
-    for x in os.listdir(path):
-        if (not x.endswith('.json')) or 'Result' in x:
-            continue
-        params = json.load(open(f'{path}/{x}'))
-        ans = json.load(open(f'{path}/{x.split(".")[0]}Result.json'))
-        ok += sum(await asyncio.gather(*[drop_one(p) for p, a in zip(params, ans) if a[1]=='SUCCESS']))
-    return ok
-
-
-async def json_query_reader(f):
-    async def query_one(q):
-        x = q[1]
-        if x[8] is not None:
-            x[8] = CourseType[x[8][1]]
-        if x[5] is not None:
-            x[5] = DayOfWeek[x[5][1]]
-        if x[7] is not None:
-            x[7] = x[7][1]
-        return await rsts.search_course(student_id=x[0],
-                                        semester_id=sid[x[1]],
-                                        search_cid=x[2],
-                                        search_name=x[3],
-                                        search_instructor=x[4],
-                                        search_day_of_week=x[5],
-                                        search_class_time=x[6],
-                                        search_class_locations=x[7],
-                                        search_course_type=x[8],
-                                        ignore_full=x[9],
-                                        ignore_conflict=x[10],
-                                        ignore_passed=x[11],
-                                        ignore_missing_prerequisites=x[12],
-                                        page_size=x[13],
-                                        page_index=x[14])
-
-    query = json.load(f)
-    return await asyncio.gather(*[query_one(q) for q in query])
-
-
-async def json_answer_reader(f):
-    ans = json.load(f)
-    res = []
-    for a in ans:
-        r = []
-        for e in a[1]:
-            cos = Course(e['course']['id'], e['course']['name'], e['course']['credit'], e['course']['classHour'],
-                         CourseGrading[e['course']['grading']])
-            sec = CourseSection(sec_id[e['section']['id']], e['section']['name'], e['section']['totalCapacity'],
-                                e['section']['leftCapacity'])
-            cls = [CourseSectionClass(cls_id[c['id']], Instructor(c['instructor']['id'], c['instructor']['fullName']),
-                                      DayOfWeek[c['dayOfWeek']], c['weekList'], c['classBegin'], c['classEnd'],
-                                      c['location']) for c in e['sectionClasses']]
-            r.append(CourseSearchEntry(cos, sec, cls, e['conflictCourseNames']))
-        res.append(r)
-    return res
+    return await each(drop_one, ((p, a) for p, a in cases(path) if a[1] == 'SUCCESS'))
+
+
+async def query_one(q):
+    x = q[1]
+    if x[8] is not None:
+        x[8] = CourseType[x[8][1]]
+    if x[5] is not None:
+        x[5] = DayOfWeek[x[5][1]]
+    if x[7] is not None:
+        x[7] = x[7][1]
+    return await op(rsts.search_course(student_id=x[0],
+                                       semester_id=sid[x[1]],
+                                       search_cid=x[2],
+                                       search_name=x[3],
+                                       search_instructor=x[4],
+                                       search_day_of_week=x[5],
+                                       search_class_time=x[6],
+                                       search_class_locations=x[7],
+                                       search_course_type=x[8],
+                                       ignore_full=x[9],
+                                       ignore_conflict=x[10],
+                                       ignore_passed=x[11],
+                                       ignore_missing_prerequisites=x[12],
+                                       page_size=x[13],
+                                       page_index=x[14]))
+
+
+def answer_of(a) -> List[CourseSearchEntry]:
+    r = []
+    for e in a[1]:
+        cos = Course(e['course']['id'], e['course']['name'], e['course']['credit'], e['course']['classHour'],
+                     CourseGrading[e['course']['grading']])
+        sec = CourseSection(sec_id[e['section']['id']], e['section']['name'], e['section']['totalCapacity'],
+                            e['section']['leftCapacity'])
+        cls = [CourseSectionClass(cls_id[c['id']], Instructor(c['instructor']['id'], c['instructor']['fullName']),
+                                  DayOfWeek[c['dayOfWeek']], c['weekList'], c['classBegin'], c['classEnd'],
+                                  c['location']) for c in e['sectionClasses']]
+        r.append(CourseSearchEntry(cos, sec, cls, e['conflictCourseNames']))
+    return r
 
 
 async def test_query(path: str):
-    ok = 0
-    for x in os.listdir(path):
-        if (not x.endswith('.json')) or 'Result' in x:
-            continue
-        res = await json_query_reader(open(f'{path}/{x}', encoding='utf-8'))
-        ans = await json_answer_reader(open(f"{path}/{x.split('.')[0]}Result.json", encoding='utf-8'))
-        # que = json.load(open(path + '/' + x, encoding='utf-8'))
-        # for i in range(len(que)):
-        #     if res[i] == ans[i]:
-        #         ok += 1
-        #     else:
-        #         print(ans[i])
-        #         print(que[i])
-        for r, a in zip(res, ans):
-            if r == a:
-                ok += 1
+    async def test_one(case):
+        q, a = case
+        r = await query_one(q)
+        a = answer_of(a)
+        if r == a:
+            return 1
+        for i, j in zip(r, a):
+            if i.conflict_course_names==j.conflict_course_names:
+                pass
             else:
-                for i, j in zip(r, a):
-                    if i.conflict_course_names==j.conflict_course_names:
-                        pass
-                    else:
-                        print(i)
-                        print(j)
-    return ok
-
-
-async def main():
-    async with create_async_context() as context:
-        factory = ServiceFactory(context)
-        if hasattr(factory, 'async_init') and callable(getattr(factory, 'async_init')):
-            await factory.async_init()
-        global rcs, rds, ris, rms, rss, rsts, rus
-        rcs = factory.create_course_service()
-        rds = factory.create_department_service()
-        ris = factory.create_instructor_service()
-        rms = factory.create_major_service()
-        rss = factory.create_semester_service()
-        rsts = factory.create_student_service()
-        rus = factory.create_user_service()
-
-        start = time()
-        print('Import departments')
-        await test_add_department()
-        print('Import majors')
-        await test_add_major()
-        print('Import users')
-        await test_add_user()
-        print('Import semesters')
-        await test_add_semester()
-        print('Import courses')
-        await test_add_course()
-        print('Import major courses')
-        await test_add_major_course()
-        print(f'Import time usage: {round(time() - start, 2)}s')
-
-        print('Testing search course 1')
-        start = time()
-        ok = await test_query('data/searchCourse1')
-        print(f'Test search course 1: {ok}')
-        print(f'Test search course 1 time: {round(time() - start, 2)}s')
-
-        print('Testing enroll course 1')
+                print(i)
+                print(j)
+        return 0
+
+    return await each(test_one, cases(path))
+
+
+async def test_import():
+    print('Import departments')
+    await test_add_department()
+    print('Import majors')
+    await test_add_major()
+    print('Import users')
+    await test_add_user()
+    print('Import semesters')
+    await test_add_semester()
+    print('Import courses')
+    await test_add_course()
+    print('Import major courses')
+    await test_add_major_course()
+
+
+# (key, progress line, result label, test); every phase builds on the state
+# left by the ones before it
+PHASES = [
+    ('import', None, 'Import', test_import),
+    ('search1', 'Testing search course 1', 'Test search course 1',
+     lambda: test_query(f'{data_dir}/searchCourse1')),
+    ('enroll1', 'Testing enroll course 1', 'Test enroll course 1',
+     lambda: test_enroll_course(f'{data_dir}/enrollCourse1')),
+    ('drop1', 'Testing drop enrolled course 1', 'Test drop enrolled course 1',
+     lambda: test_drop_course(f'{data_dir}/enrollCourse1')),
+    ('student_course', 'Importing student courses', 'Import student course', test_import_course),
+    ('drop_except', 'Testing drop course exception', 'Test drop course exception', test_drop_except),
+    ('table2', 'Testing course table 2', 'Test course table 2',
+     lambda: test_course_table(f'{data_dir}/courseTable2')),
+    ('search2', 'Testing search course 2', 'Test search course 2',
+     lambda: test_query(f'{data_dir}/searchCourse2')),
+    ('enroll2', 'Testing enroll course 2', 'Test enroll course 2',
+     lambda: test_enroll_course(f'{data_dir}/enrollCourse2')),
+    ('drop2', 'Testing drop enrolled course 2', 'Test drop enrolled course 2',
+     lambda: test_drop_course(f'{data_dir}/enrollCourse2')),
+    ('rush', 'Testing enroll rush', 'Test enroll rush', test_rush),
+]
+PHASE_KEYS = [p[0] for p in PHASES]
+# only run when --phases names them, so a run without options reports the
+# same lines as before they were added
+OPT_IN = ['rush']
+DEFAULT_PHASES = [k for k in PHASE_KEYS if k not in OPT_IN]
+
+
+def percentile(values: List[float], q: float) -> float:
+    # nearest rank on sorted values
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+
+
+def phase_report(count: Optional[int], seconds: float, samples: List[float]) -> dict:
+    samples = sorted(samples)
+    return {'count': count,
+            'seconds': round(seconds, 4),
+            'ops': len(samples),
+            'throughput': round(len(samples) / seconds, 2) if seconds > 0 else 0.0,
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            'max_ms': round(samples[-1] * 1000, 3) if samples else 0.0}
+
+
+async def reset_schema(context, path: str):
+    async with context.acquire() as con:
+        await con.execute(open(path, encoding='utf-8').read())
+    # the pooled connections hold plans of the dropped tables
+    await context.expire_connections()
+
+
+async def run_once(context, phases: List[str], concurrency: Optional[int]) -> Dict[str, dict]:
+    global rcs, rds, ris, rms, rss, rsts, rus, workers
+    for ids in (sid, sec_id, cls_id, did, mid):
+        ids.clear()
+    factory = ServiceFactory(context)
+    if hasattr(factory, 'async_init') and callable(getattr(factory, 'async_init')):
+        await factory.async_init()
+    rcs = factory.create_course_service()
+    rds = factory.create_department_service()
+    ris = factory.create_instructor_service()
+    rms = factory.create_major_service()
+    rss = factory.create_semester_service()
+    rsts = factory.create_student_service()
+    rus = factory.create_user_service()
+    workers = concurrency
+
+    # phases before the last selected one still run to build its state, but
+    # are neither printed nor reported
+    last = max(PHASE_KEYS.index(p) for p in phases)
+    res = {}
+    for key, progress, label, test in PHASES[:last + 1]:
+        report = key in phases
+        if report and progress:
+            print(progress)
+        latencies.clear()
         start = time()
-        ok = await test_enroll_course('data/enrollCourse1')
-        print(f'Test enroll course 1: {ok}')
-        print(f'Test enroll course 1 time: {round(time() - start, 2)}s')
-
-        print('Testing drop enrolled course 1')
-        start = time()
-        ok = await test_drop_course('data/enrollCourse1')
-        print(f'Test drop enrolled course 1: {ok}')
-        print(f'Test drop enrolled course 1 time: {round(time()-start, 2)}s')
-
-        print('Importing student courses')
-        start = time()
-        ok = await test_import_course()
-        print(f'Import student course: {ok}')
-        print(f'Import student course time: {round(time() - start, 2)}s')
-
-        print('Testing drop course exception')
-        start = time()
-        exc = await test_drop_except()
-        print(f'Test drop course exception: {exc}')
-        print(f'Test drop course exception time: {round(time()-start, 2)}s')
-
-        print('Testing course table 2')
-        start = time()
-        ok = await test_course_table('data/courseTable2')
-        print(f'Test course table 2: {ok}')
-        print(f'Test course table 2 time: {round(time() - start, 2)}s')
-
-        print('Testing search course 2')
-        start = time()
-        ok = await test_query('data/searchCourse2')
-        print(f'Test search course 2: {ok}')
-        print(f'Test search course 2 time: {round(time() - start, 2)}s')
+        ok = await test()
+        seconds = time() - start
+        if not report:
+            continue
+        if ok is None:
+            print(f'{label} time usage: {round(seconds, 2)}s')
+        else:
+            print(f'{label}: {ok}')
+            print(f'{label} time: {round(seconds, 2)}s')
+        res[key] = phase_report(ok, seconds, latencies)
+    if hasattr(factory, 'close') and callable(getattr(factory, 'close')):
+        await factory.close()
+    return res
 
-        print('Testing enroll course 2')
-        start = time()
-        ok = await test_enroll_course('data/enrollCourse2')
-        print(f'Test enroll course 2: {ok}')
-        print(f'Test enroll course 2 time: {round(time() - start, 2)}s')
 
-        print('Testing drop enrolled course 2')
-        start = time()
-        ok = await test_drop_course('data/enrollCourse2')
-        print(f'Test drop enrolled course 2: {ok}')
-        print(f'Test drop enrolled course 2 time: {round(time()-start, 2)}s')
+def level_name(concurrency: Optional[int]) -> str:
+    return str(concurrency) if concurrency else 'all'
+
+
+def summarize(runs: List[dict]) -> Dict[str, Dict[str, dict]]:
+    # medians over the repetitions of each concurrency level
+    summary = {}
+    for run in runs:
+        level = summary.setdefault(level_name(run['concurrency']), {})
+        for key, phase in run['phases'].items():
+            level.setdefault(key, []).append(phase)
+    for level in summary.values():
+        for key, reps in level.items():
+            counts = [r['count'] for r in reps]
+            level[key] = {k: round(median(r[k] for r in reps), 4)
+                          for k in ('seconds', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')}
+            level[key]['ops'] = reps[0]['ops']
+            level[key]['count'] = counts[0] if len(set(counts)) == 1 else counts
+            level[key]['repetitions'] = len(reps)
+    return summary
+
+
+def compare(summary: dict, baseline: dict, threshold: float) -> List[str]:
+    # a phase regresses when its median time grows beyond the threshold or
+    # its correctness count changes
+    failures = []
+    for level, phases in summary.items():
+        for key, cur in phases.items():
+            base = baseline.get(level, {}).get(key)
+            if base is None:
+                continue
+            change = cur['seconds'] / base['seconds'] - 1 if base['seconds'] > 0 else 0.0
+            print(f'{key} @ {level}: {base["seconds"]}s -> {cur["seconds"]}s ({change:+.1%})')
+            if cur['count'] != base['count']:
+                failures.append(f'{key} @ {level}: count {base["count"]} -> {cur["count"]}')
+            if change > threshold:
+                failures.append(f'{key} @ {level}: {change:+.1%} slower than baseline')
+    return failures
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run the project benchmark phases.')
+    parser.add_argument('--data', default='data', help='data set directory, see generate.py')
+    parser.add_argument('--phases', default=','.join(DEFAULT_PHASES),
+                        help=f'comma separated phases to report, of {",".join(PHASE_KEYS)}; '
+                             f'{",".join(OPT_IN)} only when named')
+    parser.add_argument('--warmup', type=int, default=0, help='unreported runs before the measured ones')
+    parser.add_argument('--repeat', type=int, default=1, help='measured runs per concurrency level')
+    parser.add_argument('--concurrency', default='64',
+                        help='comma separated worker counts per phase, "all" for a task per record')
+    parser.add_argument('--reset', metavar='SQL', help='schema script reloaded before every run')
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='fail on regressions against a saved result')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown of a phase in compare mode, 0.2 for 20%%')
+    args = parser.parse_args(argv)
+    args.phases = [p.strip() for p in args.phases.split(',') if p.strip()]
+    unknown = [p for p in args.phases if p not in PHASE_KEYS]
+    if unknown or not args.phases:
+        parser.error(f'unknown phases: {",".join(unknown)}')
+    try:
+        args.concurrency = [None if c.strip() == 'all' else int(c) for c in args.concurrency.split(',')]
+    except ValueError:
+        parser.error('--concurrency takes positive integers or "all"')
+    if any(c is not None and c <= 0 for c in args.concurrency):
+        parser.error('--concurrency takes positive integers or "all"')
+    if args.repeat < 1 or args.warmup < 0:
+        parser.error('--repeat must be positive and --warmup not negative')
+    runs = (args.warmup + args.repeat) * len(args.concurrency)
+    if runs > 1 and args.reset is None:
+        # every run imports the data again into an empty schema
+        parser.error('more than one run needs --reset')
+    return args
+
+
+async def main(args: argparse.Namespace) -> int:
+    global data_dir
+    data_dir = args.data
+    runs = []
+    async with create_async_context() as context:
+        for concurrency in args.concurrency:
+            for i in range(args.warmup + args.repeat):
+                warmup = i < args.warmup
+                if args.reset:
+                    await reset_schema(context, args.reset)
+                if len(args.concurrency) > 1 or args.warmup + args.repeat > 1:
+                    kind = f'warm-up {i + 1}' if warmup else f'run {i - args.warmup + 1}'
+                    print(f'# concurrency {level_name(concurrency)}, {kind}')
+                res = await run_once(context, args.phases, concurrency)
+                if not warmup:
+                    runs.append({'concurrency': concurrency, 'repetition': i - args.warmup, 'phases': res})
+
+    summary = summarize(runs)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'),
+                       'phases': args.phases,
+                       'warmup': args.warmup,
+                       'repeat': args.repeat,
+                       'runs': runs,
+                       'summary': summary}, f, indent=2)
+    if args.compare:
+        baseline = json.load(open(args.compare, encoding='utf-8'))
+        failures = compare(summary, baseline['summary'], args.threshold)
+        for f in failures:
+            print(f'REGRESSION {f}')
+        if failures:
+            return 1
+    return 0
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    sys.exit(asyncio.run(main(parse_args())))
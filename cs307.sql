@@ -1,5 +1,8 @@
 drop schema public CASCADE;
 create schema public;
+-- trigram indexes for the substring filters of search_course; pg_trgm is a
+-- contrib module and has to be installed on the server
+create extension if not exists pg_trgm;
 create table semester (
 	id			    serial primary key,
 	name			varchar not null,
@@ -54,6 +57,13 @@ create table section (
 	UNIQUE (course, semester, name)
 );
 
+-- bit w is set for every week w of the list
+create or replace function week_mask(weeks integer[])
+    returns bigint
+as $$
+    select coalesce(bit_or(1::bigint << w), 0) from unnest(weeks) w
+$$ language sql immutable;
+
 -- class means lecture
 create table class (
 	id			    serial primary key,
@@ -64,7 +74,12 @@ create table class (
 	class_begin		integer not null,
 	class_end		integer not null,
 	location		varchar not null,
+	-- two classes overlap iff they share a day and both masks intersect
+	week_mask		bigint not null generated always as (week_mask(week_list)) stored,
+	period_mask		integer not null generated always as ((1 << (class_end + 1)) - (1 << class_begin)) stored,
 	CHECK (class_begin < class_end),
+	CHECK (0 <= all(week_list) and 64 > all(week_list)),
+	CHECK (0 <= class_begin and class_end < 30),
 	CHECK (day_of_week in ('MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY'))
 );
 
@@ -97,27 +112,397 @@ create index on class (section);
 create index on section (course);
 create index on prerequisite (id);
 create index on takes (student_id);
+create index on class (instructor);
+create index on instructor using gin (full_name gin_trgm_ops);
+
+-- one row per section with classes, the aggregation formerly done by a view
+-- on every search; kept current by the triggers below
+create table schedule (
+    _name           varchar not null,
+    cid             varchar not null,
+    cname           varchar not null,
+    credit          integer not null,
+    hour            integer not null,
+    grading         varchar not null,
+    sid             integer primary key references section ON DELETE CASCADE,
+    sname           varchar not null,
+    semester        integer not null,
+    total_capacity  integer not null,
+    left_capacity   integer not null,
+    cls             class[] not null,
+    ins             instructor[] not null
+);
 
-create view schedule as(
-    select course.name||'['||section.name||']' as _name,
-        course.id as cid,
-        course.name as cname,
-        course.credit as credit,
-        course.class_hour as hour,
-        course.grading as grading,
-        section.id as sid,
-        section.name as sname,
-        section.semester as semester,
-        section.total_capacity as total_capacity,
-        section.left_capacity as left_capacity,
-        array_agg(class.*) as cls,
-        array_agg(instructor.*) as ins
+create index on schedule (semester, cid, _name);
+create index on schedule using gin (cid gin_trgm_ops);
+create index on schedule using gin (_name gin_trgm_ops);
+
+create or replace function refresh_schedule(sec integer)
+    returns void
+as $$
+begin
+    delete from schedule where sid = sec;
+    insert into schedule
+    select course.name||'['||section.name||']',
+        course.id,
+        course.name,
+        course.credit,
+        course.class_hour,
+        course.grading,
+        section.id,
+        section.name,
+        section.semester,
+        section.total_capacity,
+        section.left_capacity,
+        array_agg(class.*),
+        array_agg(instructor.*)
     from course
         join section on course.id = section.course
         join class on section.id = class.section
         join instructor on class.instructor = instructor.id
-    group by _name, cid, cname, hour, grading, sid, sname, total_capacity, left_capacity
+    where section.id = sec
+    group by course.id, section.id;
+end
+$$ language plpgsql;
+
+create or replace function class_schedule()
+    returns trigger
+as $$
+begin
+    if tg_op = 'INSERT' then
+        perform refresh_schedule(new.section);
+    elseif tg_op = 'DELETE' then
+        perform refresh_schedule(old.section);
+    else
+        perform refresh_schedule(old.section);
+        if new.section <> old.section then
+            perform refresh_schedule(new.section);
+        end if;
+    end if;
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function section_schedule()
+    returns trigger
+as $$
+begin
+    -- enroll and drop only move left_capacity, skip the re-aggregation
+    if (new.name, new.course, new.semester, new.total_capacity)
+        is not distinct from
+       (old.name, old.course, old.semester, old.total_capacity) then
+        update schedule
+        set left_capacity = new.left_capacity
+        where sid = new.id;
+    else
+        perform refresh_schedule(new.id);
+    end if;
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function course_schedule()
+    returns trigger
+as $$
+begin
+    perform refresh_schedule(id) from section where course = new.id;
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function instructor_schedule()
+    returns trigger
+as $$
+begin
+    perform refresh_schedule(section)
+    from (select distinct section from class where instructor = new.id) x;
+    return null;
+end
+$$ language plpgsql;
+
+create trigger class_schedule
+    after insert or update or delete on class
+    for each row execute function class_schedule();
+
+create trigger section_schedule
+    after update on section
+    for each row execute function section_schedule();
+
+create trigger course_schedule
+    after update on course
+    for each row execute function course_schedule();
+
+create trigger instructor_schedule
+    after update on instructor
+    for each row execute function instructor_schedule();
+
+-- every process keeps caches of these tables; each statement announces the
+-- keys it touched on channel cs307_cache as 'kind:key,key,...' so that the
+-- other processes drop exactly those entries (api/listener.py)
+create or replace function notify_cache(kind varchar, keys text[])
+    returns void
+as $$
+begin
+    -- a payload is limited to 8000 bytes
+    perform pg_notify('cs307_cache', kind || ':' || string_agg(k, ','))
+    from (select k, (row_number() over () - 1) / 256 as chunk
+          from unnest(keys) k) t
+    group by chunk;
+end
+$$ language plpgsql;
+
+-- whether this session announces its enrollments and seats; a NOTIFY takes
+-- the database-wide notify queue lock at commit, so a process that does not
+-- listen turns it off for its connections (factory.py) and its enroll and
+-- drop commits do not queue up behind each other
+create or replace function announcing()
+    returns boolean
+as $$
+    select current_setting('cs307.announce', true) is distinct from 'off'
+$$ language sql stable;
+
+-- 'takes' carries every row, 'passed' the students whose graded rows
+-- changed; enroll and drop leave what a student passed alone
+create or replace function takes_notify()
+    returns trigger
+as $$
+begin
+    if not announcing() then
+        return null;
+    end if;
+    if TG_OP = 'INSERT' then
+        perform notify_cache('takes', array(
+            select distinct student_id || '.' || section_id from new_rows));
+        perform notify_cache('passed', array(
+            select distinct student_id::text from new_rows
+            where grade is not null));
+    elsif TG_OP = 'DELETE' then
+        perform notify_cache('takes', array(
+            select distinct student_id || '.' || section_id from old_rows));
+        perform notify_cache('passed', array(
+            select distinct student_id::text from old_rows
+            where grade is not null));
+    else
+        perform notify_cache('takes', array(
+            select student_id || '.' || section_id from new_rows
+            union
+            select student_id || '.' || section_id from old_rows));
+        perform notify_cache('passed', array(
+            select student_id::text from new_rows where grade is not null
+            union
+            select student_id::text from old_rows where grade is not null));
+    end if;
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function section_notify()
+    returns trigger
+as $$
+begin
+    if TG_OP = 'DELETE' then
+        perform notify_cache('section', array(
+            select id || '.' || semester from old_rows));
+        return null;
+    end if;
+    -- enroll and drop only move seats, nothing built from classes changes
+    if announcing() then
+        perform notify_cache('seat', array(
+            select new_rows.id::text
+            from new_rows join old_rows on new_rows.id = old_rows.id
+            where (new_rows.name, new_rows.course, new_rows.semester,
+                   new_rows.total_capacity)
+                  is not distinct from
+                  (old_rows.name, old_rows.course, old_rows.semester,
+                   old_rows.total_capacity)
+              and new_rows.left_capacity <> old_rows.left_capacity));
+    end if;
+    perform notify_cache('section', array(
+        select distinct k
+        from new_rows join old_rows on new_rows.id = old_rows.id,
+            unnest(array[new_rows.id || '.' || new_rows.semester,
+                         old_rows.id || '.' || old_rows.semester]) k
+        where (new_rows.name, new_rows.course, new_rows.semester,
+               new_rows.total_capacity)
+              is distinct from
+              (old_rows.name, old_rows.course, old_rows.semester,
+               old_rows.total_capacity)));
+    return null;
+end
+$$ language plpgsql;
+
+-- keys are 'class.section.semester', the semester is empty when the
+-- section was deleted along with the class and has notified on its own
+create or replace function class_notify()
+    returns trigger
+as $$
+begin
+    if TG_OP = 'INSERT' then
+        perform notify_cache('class', array(
+            select c.id || '.' || c.section || '.' || coalesce(s.semester::text, '')
+            from new_rows c left join section s on s.id = c.section));
+    elsif TG_OP = 'DELETE' then
+        perform notify_cache('class', array(
+            select c.id || '.' || c.section || '.' || coalesce(s.semester::text, '')
+            from old_rows c left join section s on s.id = c.section));
+    else
+        perform notify_cache('class', array(
+            select c.id || '.' || c.section || '.' || coalesce(s.semester::text, '')
+            from (select id, section from new_rows
+                  union
+                  select id, section from old_rows) c
+                left join section s on s.id = c.section));
+    end if;
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function course_notify()
+    returns trigger
+as $$
+begin
+    if TG_OP = 'DELETE' then
+        perform notify_cache('course', array(select id from old_rows));
+    else
+        perform notify_cache('course', array(select id from new_rows));
+    end if;
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function semester_notify()
+    returns trigger
+as $$
+begin
+    if TG_OP = 'DELETE' then
+        perform notify_cache('semester', array(select id::text from old_rows));
+    else
+        perform notify_cache('semester', array(select id::text from new_rows));
+    end if;
+    return null;
+end
+$$ language plpgsql;
+
+create or replace function prerequisite_notify()
+    returns trigger
+as $$
+begin
+    if TG_OP = 'DELETE' then
+        perform notify_cache('prerequisite', array(
+            select distinct id from old_rows));
+    else
+        perform notify_cache('prerequisite', array(
+            select distinct id from new_rows));
+    end if;
+    return null;
+end
+$$ language plpgsql;
+
+-- transition tables allow a single event per trigger
+create trigger takes_insert_notify
+    after insert on takes referencing new table as new_rows
+    for each statement execute function takes_notify();
+create trigger takes_update_notify
+    after update on takes
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function takes_notify();
+create trigger takes_delete_notify
+    after delete on takes referencing old table as old_rows
+    for each statement execute function takes_notify();
+
+create trigger section_update_notify
+    after update on section
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function section_notify();
+create trigger section_delete_notify
+    after delete on section referencing old table as old_rows
+    for each statement execute function section_notify();
+
+create trigger class_insert_notify
+    after insert on class referencing new table as new_rows
+    for each statement execute function class_notify();
+create trigger class_update_notify
+    after update on class
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function class_notify();
+create trigger class_delete_notify
+    after delete on class referencing old table as old_rows
+    for each statement execute function class_notify();
+
+create trigger course_update_notify
+    after update on course referencing new table as new_rows
+    for each statement execute function course_notify();
+create trigger course_delete_notify
+    after delete on course referencing old table as old_rows
+    for each statement execute function course_notify();
+
+create trigger semester_insert_notify
+    after insert on semester referencing new table as new_rows
+    for each statement execute function semester_notify();
+create trigger semester_update_notify
+    after update on semester referencing new table as new_rows
+    for each statement execute function semester_notify();
+create trigger semester_delete_notify
+    after delete on semester referencing old table as old_rows
+    for each statement execute function semester_notify();
+
+create trigger prerequisite_insert_notify
+    after insert on prerequisite referencing new table as new_rows
+    for each statement execute function prerequisite_notify();
+create trigger prerequisite_update_notify
+    after update on prerequisite referencing new table as new_rows
+    for each statement execute function prerequisite_notify();
+create trigger prerequisite_delete_notify
+    after delete on prerequisite referencing old table as old_rows
+    for each statement execute function prerequisite_notify();
+
+-- stamp of the catalog api/snapshot.py keeps on disk: the epoch tells apart
+-- databases created by this script, catalog_change moves with every
+-- statement that changes the catalog; seats are not part of it. nextval
+-- neither locks nor waits, so catalog writers do not queue on the stamp
+create table catalog_version (
+    epoch           text not null default md5(random()::text || clock_timestamp()::text)
 );
+insert into catalog_version default values;
+create sequence catalog_change;
+
+create or replace function catalog_bump()
+    returns trigger
+as $$
+begin
+    perform nextval('catalog_change');
+    return null;
+end
+$$ language plpgsql;
+
+create trigger department_catalog
+    after insert or update or delete or truncate on department
+    for each statement execute function catalog_bump();
+create trigger major_catalog
+    after insert or update or delete or truncate on major
+    for each statement execute function catalog_bump();
+create trigger semester_catalog
+    after insert or update or delete or truncate on semester
+    for each statement execute function catalog_bump();
+create trigger instructor_catalog
+    after insert or update or delete or truncate on instructor
+    for each statement execute function catalog_bump();
+create trigger course_catalog
+    after insert or update or delete or truncate on course
+    for each statement execute function catalog_bump();
+create trigger prerequisite_catalog
+    after insert or update or delete or truncate on prerequisite
+    for each statement execute function catalog_bump();
+-- enroll and drop only set left_capacity
+create trigger section_catalog
+    after insert or delete or truncate on section
+    for each statement execute function catalog_bump();
+create trigger section_update_catalog
+    after update of id, name, course, semester, total_capacity on section
+    for each statement execute function catalog_bump();
+create trigger class_catalog
+    after insert or update or delete or truncate on class
+    for each statement execute function catalog_bump();
 
 -- create view coursetable as(
 -- 	select day_of_week,
@@ -207,14 +592,14 @@ begin
             if res[i].val = 'AND' then
                 all_flag := true;
                 foreach ptri in array res[i].ptr loop
-                    all_flag := val[ptri] and all_flag;
+                    all_flag := val[ptri + 1] and all_flag;
                 end loop;
                 val[i] := all_flag;
                 top := top-1;
             elseif res[i].val = 'OR' then
                 any_flag := false;
                 foreach ptri in array res[i].ptr loop
-                    any_flag := val[ptri] or any_flag;
+                    any_flag := val[ptri + 1] or any_flag;
                 end loop;
                 val[i] := any_flag;
                 top := top-1;
@@ -224,7 +609,8 @@ begin
             if res[i].ptr is not null then
                 foreach ptri in array res[i].ptr loop
                     top := top + 1;
-                    stack[top] := ptri;
+                    -- ptr holds idx values, res is 1-based in idx order
+                    stack[top] := ptri + 1;
                 end loop;
             else
                 val[i] := false;
@@ -239,4 +625,110 @@ begin
     end loop;
     return val[1];
 end;
-$$ language plpgsql;
\ No newline at end of file
+$$ language plpgsql;
+
+-- the whole enrollment decision in one round trip, results are the names
+-- of dto.EnrollResult and are checked in the same priority order
+-- passed and pre_ok carry checks already settled by the caller
+create or replace function enroll_course(stu integer, sec integer,
+                                         passed boolean default null,
+                                         pre_ok boolean default null)
+    returns varchar
+as $$
+declare
+    cur section%rowtype;
+begin
+    select * into cur from section where id = sec;
+    if not found then
+        return 'COURSE_NOT_FOUND';
+    end if;
+
+    if exists(
+        select null
+        from takes
+        where student_id = stu and section_id = sec
+    ) then
+        return 'ALREADY_ENROLLED';
+    end if;
+
+    if coalesce(passed, exists(
+        select null
+        from takes
+            join section on section_id = section.id
+        where student_id = stu
+          and course = cur.course
+          and case when grade in ('PASS', 'FAIL') then grade = 'PASS'
+                   else cast(grade as integer) >= 60 end
+    )) then
+        return 'ALREADY_PASSED';
+    end if;
+
+    if not coalesce(pre_ok, pass_pre(stu, cur.course)) then
+        return 'PREREQUISITES_NOT_FULFILLED';
+    end if;
+
+    if exists(
+        select null
+        from takes
+            join section on section_id = section.id
+            join class on section.id = class.section
+        where student_id = stu and semester = cur.semester
+          and (
+               course = cur.course
+               or exists (
+                  select null
+                  from class this
+                  where this.section = sec
+                    and this.day_of_week = class.day_of_week
+                    and this.week_mask & class.week_mask <> 0
+                    and this.period_mask & class.period_mask <> 0
+               )
+          )
+    ) then
+        return 'COURSE_CONFLICT_FOUND';
+    end if;
+
+    -- an exhausted section is answered without writing or locking
+    if cur.left_capacity <= 0 then
+        return 'COURSE_IS_FULL';
+    end if;
+
+    insert into takes (student_id, section_id)
+    values (stu, sec)
+    on conflict do nothing;
+    if not found then
+        return 'ALREADY_ENROLLED';
+    end if;
+
+    update section
+    set left_capacity = left_capacity - 1
+    where id = sec and left_capacity > 0;
+    if not found then
+        delete from takes where student_id = stu and section_id = sec;
+        return 'COURSE_IS_FULL';
+    end if;
+
+    return 'SUCCESS';
+end
+$$ language plpgsql;
+
+-- one batch of queued enrollments into a section, decided in queue order
+-- within a single transaction
+create or replace function enroll_courses(stu integer[], sec integer,
+                                          passed boolean[],
+                                          pre_ok boolean[],
+                                          out results varchar[],
+                                          out left_capacity integer,
+                                          out semester integer)
+as $$
+begin
+    results := '{}';
+    for i in 1 .. coalesce(array_length(stu, 1), 0) loop
+        results := results || enroll_course(stu[i], sec, passed[i], pre_ok[i]);
+    end loop;
+    select section.left_capacity, section.semester
+    into left_capacity, semester
+    from section
+    where id = sec;
+end
+$$ language plpgsql;
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from datetime import date
 from enum import Enum
-from typing import List, Mapping, Union
+from typing import List, Mapping, Optional, Union
 
 
 class DayOfWeek(Enum):
@@ -196,6 +196,13 @@ class CourseSearchEntry:
                and sorted(self.conflict_course_names) == sorted(other.conflict_course_names)
 
 
+@dataclass()
+class CourseSearchPage:
+    entries: List[CourseSearchEntry]
+    # opaque token for the following page, None after the last one
+    next_cursor: Optional[str]
+
+
 @dataclass()
 class CourseTableEntry:
     course_full_name: str
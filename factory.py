@@ -1,5 +1,6 @@
 from configparser import ConfigParser
 from pathlib import Path
+from time import perf_counter
 
 import asyncpg
 
@@ -9,60 +10,201 @@ from service import (CourseService, DepartmentService, InstructorService,
 from api import (course_service, department_service, instructor_service,
                  major_service, semester_service, student_service,
                  user_service)
+from api.admission import section_admission
+from api.cache import lru
+from api.course_table import course_table_cache
+from api.listener import cache_listener
+from api.metrics import service_metrics
+from api.occupancy import occupancy_cache
+from api.pool import pool_monitor
+from api.prerequisite import prerequisite_cache
+from api.reference import REFERENCES, TTL, reference_cache
+from api.semester_index import semester_index
+from api.snapshot import warm
+from api.statement import STATEMENT_CACHE_SIZE, registry
+
+
+def load_config() -> ConfigParser:
+    config = ConfigParser()
+    config.read(Path(__file__).parent / 'config.ini')
+    return config
 
 
 def create_async_context():
     # You can customize the async context manager in this function.
     # e.g., you may use other connection pool implementation.
-    config = ConfigParser()
-    config.read(Path(__file__).parent / 'config.ini')
+    config = load_config()
     db_cfg = config['database']
-    return asyncpg.create_pool(host=db_cfg['host'],
-                               port=db_cfg['port'],
-                               database=db_cfg['database'],
-                               user=db_cfg['username'],
-                               password=db_cfg['password'])
+    if not config.has_section('pool'):
+        config.add_section('pool')
+    pool_cfg = config['pool']
+    init_sql = pool_cfg.get('init_sql')
+    # a process that does not listen for other processes' writes does not
+    # announce its enrollments and seats either, see announcing() in cs307.sql
+    if config.getboolean('listen', 'enabled', fallback=True):
+        server_settings = None
+    else:
+        server_settings = {'cs307.announce': 'off'}
+
+    async def init(con: asyncpg.Connection):
+        if init_sql:
+            await con.execute(init_sql)
+        await registry.init(con)
+
+    return pool_monitor(
+        asyncpg.create_pool(
+            host=db_cfg['host'],
+            port=db_cfg['port'],
+            database=db_cfg['database'],
+            user=db_cfg['username'],
+            password=db_cfg['password'],
+            min_size=pool_cfg.getint('min_size', 10),
+            max_size=pool_cfg.getint('max_size', 20),
+            statement_cache_size=pool_cfg.getint('statement_cache_size',
+                                                 STATEMENT_CACHE_SIZE),
+            max_queries=pool_cfg.getint('max_queries', 50000),
+            max_inactive_connection_lifetime=pool_cfg.getfloat(
+                'max_inactive_connection_lifetime', 300.0),
+            server_settings=server_settings,
+            init=init),
+        acquire_timeout=pool_cfg.getfloat('acquire_timeout', None))
 
 
 class ServiceFactory:
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: pool_monitor):
         self.__pool = pool
-        self.__pool._minsize = 10
-        self.__pool._maxsize = 20
+        # shared by the services so that catalog writes reach the readers
+        self.__prerequisites = prerequisite_cache()
+        self.__passed = lru(1 << 16)
+        self.__occupancy = occupancy_cache()
+        self.__admission = section_admission(pool)
+        self.__course_tables = course_table_cache()
+        self.__semesters = semester_index()
+        config = load_config()
+        ttl = config.getfloat('reference', 'ttl', fallback=TTL)
+        self.__references = reference_cache(
+            config.getint('reference', 'maxsize', fallback=REFERENCES),
+            ttl if ttl > 0 else None)
+        # the catalog is preloaded by async_init, kept in `path` if set
+        self.__preload = config.getboolean('snapshot', 'enabled',
+                                           fallback=False)
+        path = config.get('snapshot', 'path', fallback=None)
+        self.__snapshot_path = (str(Path(__file__).parent / path)
+                                if path else None)
+        self.__snapshot = {}
+        # (student id, section id) -> grade, of the student service
+        self.__grades = {}
+        # other processes' writes reach the caches through NOTIFY
+        if config.getboolean('listen', 'enabled', fallback=True):
+            self.__listener = cache_listener(
+                pool, self.__prerequisites, self.__passed, self.__occupancy,
+                self.__admission, self.__course_tables, self.__references,
+                self.__grades, self.__semesters)
+        else:
+            self.__listener = None
+        # services are only wrapped when enabled, so disabled costs nothing
+        if config.getboolean('metrics', 'enabled', fallback=False):
+            self.__metrics = service_metrics()
+        else:
+            self.__metrics = None
 
     async def async_init(self):
         # You can add asynchronous initialization steps here.
-        # return await self.__pool._async__init__()
-        if self.__pool._initialized:
-            return
-        if self.__pool._initializing:
-            raise asyncpg.exceptions.InterfaceError
-        if self.__pool._closed:
-            raise asyncpg.exceptions.InterfaceError
-        self.__pool._initializing = True
-        try:
-            await self.__pool._initialize()
-        finally:
-            self.__pool._initializing = False
-            self.__pool._initialized = True
+        await self.__pool
+        # listening before anything is cached, no change can slip between
+        if self.__listener:
+            await self.__listener.start()
+        async with self.__pool.acquire() as con:
+            try:
+                if self.__preload:
+                    start = perf_counter()
+                    source = await warm(con, self.__snapshot_path,
+                                        self.__references, self.__semesters,
+                                        self.__prerequisites)
+                    self.__snapshot = {'source': source,
+                                       'seconds': perf_counter() - start}
+                else:
+                    await self.__semesters.load(con)
+            except asyncpg.exceptions.PostgresError:
+                # no schema yet, the caches fill on first use
+                pass
+
+    async def close(self):
+        # gives back the connection the listener holds
+        if self.__listener:
+            await self.__listener.close()
+
+    def pool_stats(self):
+        return self.__pool.stats()
+
+    def statement_stats(self):
+        return registry.stats()
+
+    def course_table_stats(self):
+        return self.__course_tables.stats()
+
+    def reference_stats(self):
+        return self.__references.stats()
+
+    def listener_stats(self):
+        return self.__listener.stats() if self.__listener else {}
+
+    def snapshot_stats(self):
+        # where async_init preloaded the catalog from and how long it took
+        return self.__snapshot
+
+    def metrics_snapshot(self):
+        return self.__metrics.snapshot() if self.__metrics else {}
+
+    def metrics_prometheus(self) -> str:
+        return self.__metrics.prometheus() if self.__metrics else ''
+
+    def __instrument(self, service, prefix: str):
+        if self.__metrics is None:
+            return service
+        return self.__metrics.instrument(service, prefix)
 
     def create_course_service(self) -> CourseService:
-        return course_service(self.__pool)
+        return self.__instrument(
+            course_service(self.__pool, self.__prerequisites,
+                           self.__occupancy, self.__course_tables,
+                           self.__references, self.__passed, self.__grades,
+                           self.__admission),
+            'course')
 
     def create_department_service(self) -> DepartmentService:
-        return department_service(self.__pool)
+        return self.__instrument(
+            department_service(self.__pool, self.__references,
+                               self.__passed, self.__grades,
+                               self.__course_tables), 'department')
 
     def create_instructor_service(self) -> InstructorService:
-        return instructor_service(self.__pool)
+        return self.__instrument(instructor_service(self.__pool), 'instructor')
 
     def create_major_service(self) -> MajorService:
-        return major_service(self.__pool)
+        return self.__instrument(
+            major_service(self.__pool, self.__references, self.__passed,
+                          self.__grades, self.__course_tables), 'major')
 
     def create_semester_service(self) -> SemesterService:
-        return semester_service(self.__pool)
+        return self.__instrument(
+            semester_service(self.__pool, self.__semesters,
+                             self.__references, self.__passed,
+                             self.__grades, self.__course_tables,
+                             self.__admission), 'semester')
 
     def create_student_service(self) -> StudentService:
-        return student_service(self.__pool)
+        return self.__instrument(
+            student_service(self.__pool, self.__prerequisites,
+                            self.__passed, self.__occupancy,
+                            self.__admission, self.__course_tables,
+                            self.__semesters, self.__references,
+                            self.__grades),
+            'student')
 
     def create_user_service(self) -> UserService:
-        return user_service(self.__pool)
+        return self.__instrument(
+            user_service(self.__pool, self.__course_tables,
+                         self.__references, self.__passed, self.__grades,
+                         self.__occupancy),
+            'user')
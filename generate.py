@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import os
+import random
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dto import CourseType, DayOfWeek
+
+# the same joining rule the services store instructor names with
+from api.user_service_api import full_name
+
+# sizes of the shipped data set, multiplied by the scale factor
+STUDENTS = 10000
+INSTRUCTORS = 350
+COURSES = 110
+DEPARTMENTS = 20
+MAJORS = 18
+# queries per workload file, as in data/
+SEARCHES = {'Basic': 100, 'Cid': 100, 'Name': 100, 'Instructor': 100, 'Mixed': 600}
+ENROLLS = 1000
+TABLES = 1000
+
+DAYS = [d.name for d in DayOfWeek]
+COURSE_TYPES = [t.name for t in CourseType]
+# section ids the benchmark passes through unmapped, none of them exists
+MISSING_SECTION = 2000000000
+
+CJK_WORDS = ['计算机', '程序', '设计', '数据', '结构', '原理', '分析', '系统', '网络', '工程', '数学', '物理', '化学',
+             '生物', '经济', '管理', '文学', '历史', '艺术', '英语', '导论', '基础', '实验', '方法', '理论', '应用',
+             '高级', '专题']
+LATIN_WORDS = ['Introduction', 'Data', 'Systems', 'Advanced', 'Topics', 'Linear', 'Algebra', 'Calculus', 'Physics',
+               'Design', 'Analysis', 'Networks', 'Theory', 'Seminar', 'English', 'Modern', 'Applied']
+SUFFIXES = ['', '', '', 'A', 'B', 'I', 'II']
+SECTION_NAMES = ['中文班', '英文班', '中英双语班', '英文1班', '英文2班', '实验1班', '实验2班', '中文1班', '中文2班']
+BUILDINGS = ['一教', '二教', '三教', '一科', '荔园', '慧园', '行政楼', '南科大中心']
+CJK_SURNAMES = ['王', '张', '李', '刘', '陈', '杨', '黄', '赵', '吴', '周', '徐', '孙', '马', '朱', '胡', '郭', '何',
+                '高', '林', '罗']
+CJK_GIVEN = ['伟', '芳', '娜', '敏', '静', '丽', '强', '磊', '军', '洋', '勇', '艳', '杰', '娟', '涛', '明', '超',
+             '秀', '霞', '平', '刚', '英', '华', '琨', '蓉', '婷', '新', '小', '永']
+LATIN_SURNAMES = ['SMITH', 'JOHNSON', 'GARCIA', 'MILLER', 'SU', 'ISHIBUCHI', 'FERGUSON', 'RODRIGUEZ']
+LATIN_GIVEN = ['JOHN', 'MARIA', 'HAIJUN', 'ANNA', 'DAVID', 'ELENA', 'HISAO', 'NATALIE']
+DEPARTMENT_WORDS = ['电子', '化学', '物理', '数学', '生物', '计算机', '材料', '环境', '金融', '海洋', '力学', '地球',
+                    '医学', '语言', '社会', '艺术']
+CODES = ['CS', 'EE', 'MA', 'PHY', 'CH', 'BIO', 'MSE', 'ESE', 'FIN', 'OCE', 'ME', 'ESS', 'MED', 'CLE', 'SS', 'RD']
+
+
+def timestamp(d: date) -> int:
+    # noon UTC, the same calendar day in every time zone within 11 hours
+    return int(datetime(d.year, d.month, d.day, 12, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def local_date(ms: int) -> date:
+    # how benchmark.py turns a timestamp into a date
+    return datetime.fromtimestamp(float(ms) / 1000).date()
+
+
+def passing(grade) -> bool:
+    if grade is None:
+        return False
+    if isinstance(grade, str):
+        return grade == 'PASS'
+    return grade >= 60
+
+
+class dataset:
+    def __init__(self, scale: float, seed: int):
+        self.rng = random.Random(seed)
+        self.scale = scale
+        # the organisation grows slower than the student body
+        self.breadth = max(1, math.ceil(math.sqrt(scale)))
+        self.semesters: List[dict] = []
+        self.departments: List[dict] = []
+        self.majors: List[dict] = []
+        self.courses: List[dict] = []
+        self.prerequisites: Dict[str, Optional[dict]] = {}
+        self.instructors: List[dict] = []
+        self.students: List[dict] = []
+        self.compulsory: Dict[int, List[str]] = {}
+        self.elective: Dict[int, List[str]] = {}
+        self.sections: Dict[int, dict] = {}
+        self.classes: Dict[int, List[dict]] = {}
+        self.gradebooks: Dict[int, Dict[int, object]] = {}
+
+    def count(self, base: int) -> int:
+        return max(1, int(round(base * self.scale)))
+
+    # catalog
+
+    def build(self):
+        self.build_semesters()
+        self.build_departments()
+        self.build_courses()
+        self.build_people()
+        self.build_sections()
+        self.build_gradebooks()
+
+    def build_semesters(self):
+        # fall, spring and summer of every academic year, never overlapping
+        for k in range(self.breadth):
+            y = 2018 + k
+            for n, begin, end in ((1, date(y, 9, 3), date(y + 1, 1, 20)),
+                                  (2, date(y + 1, 2, 18), date(y + 1, 6, 30)),
+                                  (3, date(y + 1, 7, 8), date(y + 1, 8, 25))):
+                self.semesters.append({'@type': 'cn.edu.sustech.cs307.dto.Semester',
+                                       'id': len(self.semesters) + 1,
+                                       'name': f'{y}-{y + 1}-{n}',
+                                       'begin': timestamp(begin),
+                                       'end': timestamp(end)})
+        # enrollments happen in the last spring semester, every earlier one
+        # is graded
+        self.current = self.semesters[-2]
+        self.weeks = {s['id']: 8 if s['name'].endswith('-3') else 16 for s in self.semesters}
+
+    def build_departments(self):
+        names = set()
+        for i in range(DEPARTMENTS * self.breadth):
+            name = ''.join(self.rng.sample(DEPARTMENT_WORDS, 2)) + '系'
+            while name in names:
+                name = ''.join(self.rng.sample(DEPARTMENT_WORDS, 2)) + str(len(names)) + '系'
+            names.add(name)
+            self.departments.append({'@type': 'cn.edu.sustech.cs307.dto.Department', 'id': i + 1, 'name': name})
+        for i in range(MAJORS * self.breadth):
+            d = self.rng.choice(self.departments)
+            self.majors.append({'@type': 'cn.edu.sustech.cs307.dto.Major', 'id': i + 1,
+                                'name': f'{d["name"][:-1]}专业{i + 1}', 'department': {'id': d['id'], 'name': d['name']}})
+
+    def course_name(self) -> str:
+        if self.rng.random() < 0.7:
+            return ''.join(self.rng.sample(CJK_WORDS, self.rng.randint(2, 4))) + self.rng.choice(SUFFIXES)
+        return ' '.join(self.rng.sample(LATIN_WORDS, self.rng.randint(2, 3))) + \
+            (' ' + self.rng.choice(SUFFIXES)).rstrip()
+
+    def prerequisite(self, earlier: List[str], depth: int = 0) -> dict:
+        # only earlier courses are referenced, so the graph has no cycles
+        if depth >= 2 or len(earlier) < 3 or self.rng.random() < 0.5:
+            return {'@type': 'cn.edu.sustech.cs307.dto.prerequisite.CoursePrerequisite',
+                    'courseID': self.rng.choice(earlier)}
+        kind = self.rng.choice(['And', 'Or'])
+        return {'@type': f'cn.edu.sustech.cs307.dto.prerequisite.{kind}Prerequisite',
+                'terms': [self.prerequisite(earlier, depth + 1) for _ in range(self.rng.randint(2, 3))]}
+
+    def build_courses(self):
+        ids = set()
+        earlier = []
+        for _ in range(self.count(COURSES)):
+            cid = f'{self.rng.choice(CODES)}{self.rng.randint(100, 999)}'
+            while cid in ids:
+                cid = f'{self.rng.choice(CODES)}{self.rng.randint(100, 9999)}'
+            ids.add(cid)
+            credit = self.rng.randint(1, 4)
+            self.courses.append({'@type': 'cn.edu.sustech.cs307.dto.Course', 'id': cid, 'name': self.course_name(),
+                                 'credit': credit, 'classHour': 16 * credit,
+                                 'grading': 'PASS_OR_FAIL' if self.rng.random() < 0.1 else 'HUNDRED_MARK_SCORE'})
+            self.prerequisites[cid] = self.prerequisite(earlier) if earlier and self.rng.random() < 0.3 else None
+            earlier.append(cid)
+        self.course = {c['id']: c for c in self.courses}
+        for m in self.majors:
+            picked = self.rng.sample(self.courses, min(len(self.courses), self.rng.randint(0, 12)))
+            half = len(picked) // 2
+            self.compulsory[m['id']] = [c['id'] for c in picked[:half]]
+            self.elective[m['id']] = [c['id'] for c in picked[half:]]
+
+    def person(self) -> Tuple[str, str]:
+        if self.rng.random() < 0.8:
+            return self.rng.choice(CJK_SURNAMES), ''.join(self.rng.sample(CJK_GIVEN, self.rng.randint(1, 2)))
+        return self.rng.choice(LATIN_SURNAMES), self.rng.choice(LATIN_GIVEN)
+
+    def build_people(self):
+        for i in range(self.count(INSTRUCTORS)):
+            first, last = self.person()
+            self.instructors.append({'@type': 'cn.edu.sustech.cs307.dto.Instructor', 'id': 30000001 + i,
+                                     'fullName': f'{first},{last}'})
+        self.instructor = {u['id']: full_name(*u['fullName'].split(',')) for u in self.instructors}
+        for i in range(self.count(STUDENTS)):
+            first, last = self.person()
+            year = 2015 + self.rng.randint(0, self.breadth + 2)
+            self.students.append({'@type': 'cn.edu.sustech.cs307.dto.Student', 'id': 11700001 + i,
+                                  'fullName': f'{first},{last}', 'enrolledDate': timestamp(date(year, 9, 1)),
+                                  'major': {'id': self.rng.choice(self.majors)['id'], 'name': None,
+                                            'department': None}})
+        self.major = {u['id']: u['major']['id'] for u in self.students}
+
+    def weeks_of(self, semester: dict) -> List[int]:
+        n = self.weeks[semester['id']]
+        kind = self.rng.random()
+        if kind < 0.7:
+            return list(range(1, n))
+        if kind < 0.8:
+            return list(range(1, n, 2))
+        if kind < 0.9:
+            return list(range(2, n, 2))
+        return list(range(1, n // 2 + 1))
+
+    def build_sections(self):
+        cls_id = 0
+        for s in self.semesters:
+            offered = 0.2 if s['name'].endswith('-3') else 0.5
+            for c in self.courses:
+                if self.rng.random() >= offered:
+                    continue
+                for name in self.rng.sample(SECTION_NAMES, self.rng.choice([1, 1, 1, 2, 3])):
+                    capacity = self.rng.randint(3, 8) if self.rng.random() < 0.05 else self.rng.randint(30, 120)
+                    sec = {'@type': 'cn.edu.sustech.cs307.dto.CourseSection', 'id': len(self.sections) + 1,
+                           'name': name, 'totalCapacity': capacity, 'leftCapacity': capacity,
+                           'course': c['id'], 'semester': s['id']}
+                    self.sections[sec['id']] = sec
+                    classes = []
+                    for _ in range(self.rng.choice([1, 2, 2, 3])):
+                        cls_id += 1
+                        begin = self.rng.choice([1, 3, 5, 7, 9])
+                        classes.append({'@type': 'cn.edu.sustech.cs307.dto.CourseSectionClass', 'id': cls_id,
+                                        'instructor': {'id': self.rng.choice(self.instructors)['id'],
+                                                       'fullName': None},
+                                        'dayOfWeek': DAYS[self.rng.choice([0, 1, 2, 3, 4, 4, 5])],
+                                        'weekList': self.weeks_of(s), 'classBegin': begin, 'classEnd': begin + 1,
+                                        'location': f'{self.rng.choice(BUILDINGS)}{self.rng.randint(101, 520)}'})
+                    self.classes[sec['id']] = classes
+        self.by_semester: Dict[int, List[int]] = {s['id']: [] for s in self.semesters}
+        for sec in self.sections.values():
+            self.by_semester[sec['semester']].append(sec['id'])
+
+    def build_gradebooks(self):
+        # graded sections of earlier semesters and, for some students,
+        # ungraded ones of the current semester
+        past = [sec for s in self.semesters if s['id'] < self.current['id'] for sec in self.by_semester[s['id']]]
+        current = self.by_semester[self.current['id']]
+        for u in self.students:
+            book = {}
+            courses = set()
+            for sec in self.rng.sample(past, min(len(past), self.rng.randint(4, 12))):
+                course = self.sections[sec]['course']
+                if course in courses:
+                    continue
+                courses.add(course)
+                if self.course[course]['grading'] == 'PASS_OR_FAIL':
+                    book[sec] = 'PASS' if self.rng.random() < 0.8 else 'FAIL'
+                else:
+                    book[sec] = self.rng.randint(60, 100) if self.rng.random() < 0.85 else self.rng.randint(0, 59)
+            if current and self.rng.random() < 0.3:
+                for sec in self.rng.sample(current, min(len(current), self.rng.randint(1, 3))):
+                    if self.sections[sec]['course'] not in courses:
+                        courses.add(self.sections[sec]['course'])
+                        book[sec] = None
+            self.gradebooks[u['id']] = book
+
+    # output
+
+    def write(self, out: str):
+        os.makedirs(out, exist_ok=True)
+        dump(f'{out}/semesters.json', self.semesters)
+        dump(f'{out}/departments.json', self.departments)
+        dump(f'{out}/majors.json', self.majors)
+        dump(f'{out}/courses.json', self.courses)
+        dump(f'{out}/coursePrerequisites.json', self.prerequisites)
+        dump(f'{out}/users.json', self.instructors + self.students)
+        dump(f'{out}/majorCompulsoryCourses.json',
+             {str(m): ['java.util.ArrayList', cs] for m, cs in self.compulsory.items()})
+        dump(f'{out}/majorElectiveCourses.json',
+             {str(m): ['java.util.ArrayList', cs] for m, cs in self.elective.items()})
+        sections = {}
+        for c in self.courses:
+            sections[c['id']] = {'@type': 'java.util.HashMap'}
+            for s in self.semesters:
+                sections[c['id']][str(s['id'])] = ['java.util.ArrayList', []]
+        for sec in self.sections.values():
+            sections[sec['course']][str(sec['semester'])][1].append(
+                {k: sec[k] for k in ('@type', 'id', 'name', 'totalCapacity', 'leftCapacity')})
+        dump(f'{out}/courseSections.json', sections)
+        dump(f'{out}/courseSectionClasses.json',
+             {str(sec): ['java.util.ArrayList', cls] for sec, cls in self.classes.items()})
+        books = {}
+        for stu, book in self.gradebooks.items():
+            books[str(stu)] = {'@type': 'java.util.HashMap'}
+            for sec, grade in book.items():
+                if isinstance(grade, str):
+                    grade = ['cn.edu.sustech.cs307.dto.grade.PassOrFailGrade', grade]
+                elif grade is not None:
+                    grade = {'@type': 'cn.edu.sustech.cs307.dto.grade.HundredMarkGrade', 'mark': grade}
+                books[str(stu)][str(sec)] = grade
+        dump(f'{out}/studentCourses.json', books)
+
+
+def dump(path: str, obj):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+class model:
+    # the services' semantics over the data set, replayed in the order the
+    # benchmark phases run so every answer sees the state they will see
+    def __init__(self, data: dataset):
+        self.data = data
+        self.left = {sec: s['totalCapacity'] for sec, s in data.sections.items()}
+        # student id -> section id -> grade, None while enrolled
+        self.takes: Dict[int, Dict[int, object]] = {u['id']: {} for u in data.students}
+        self.names = {sec: f'{data.course[s["course"]]["name"]}[{s["name"]}]' for sec, s in data.sections.items()}
+        # (day, week mask, period mask) of every class
+        self.slots = {sec: [(c['dayOfWeek'], sum(1 << w for w in c['weekList']),
+                             (1 << (c['classEnd'] + 1)) - (1 << c['classBegin'])) for c in cls]
+                      for sec, cls in data.classes.items()}
+        # the order search_course pages in
+        self.ordered = {s: sorted(secs, key=lambda sec: (data.sections[sec]['course'], self.names[sec]))
+                        for s, secs in data.by_semester.items()}
+        # course id -> majors listing it as compulsory or elective
+        self.majors_of: Dict[str, set] = {}
+        for m in data.compulsory:
+            for c in data.compulsory[m] + data.elective[m]:
+                self.majors_of.setdefault(c, set()).add(m)
+        self.ranges = [(s['id'], local_date(s['begin']), local_date(s['end'])) for s in data.semesters]
+
+    def passed(self, stu: int) -> set:
+        return {self.data.sections[sec]['course'] for sec, g in self.takes[stu].items() if passing(g)}
+
+    def satisfied(self, pre: Optional[dict], passed: set) -> bool:
+        if pre is None:
+            return True
+        if 'courseID' in pre:
+            return pre['courseID'] in passed
+        terms = [self.satisfied(t, passed) for t in pre['terms']]
+        return all(terms) if 'And' in pre['@type'] else any(terms)
+
+    def conflict(self, a: int, b: int) -> bool:
+        if self.data.sections[a]['course'] == self.data.sections[b]['course']:
+            return True
+        return any(d1 == d2 and w1 & w2 and p1 & p2
+                   for d1, w1, p1 in self.slots[a] for d2, w2, p2 in self.slots[b])
+
+    def enrolled_in(self, stu: int, semester: int) -> List[int]:
+        return [sec for sec in self.takes[stu] if self.data.sections[sec]['semester'] == semester]
+
+    def enroll(self, stu: int, sec: int) -> str:
+        s = self.data.sections.get(sec)
+        if s is None:
+            return 'COURSE_NOT_FOUND'
+        if sec in self.takes[stu]:
+            return 'ALREADY_ENROLLED'
+        passed = self.passed(stu)
+        if s['course'] in passed:
+            return 'ALREADY_PASSED'
+        if not self.satisfied(self.data.prerequisites[s['course']], passed):
+            return 'PREREQUISITES_NOT_FULFILLED'
+        if any(self.conflict(sec, e) for e in self.enrolled_in(stu, s['semester'])):
+            return 'COURSE_CONFLICT_FOUND'
+        if self.left[sec] <= 0:
+            return 'COURSE_IS_FULL'
+        self.takes[stu][sec] = None
+        self.left[sec] -= 1
+        return 'SUCCESS'
+
+    def drop(self, stu: int, sec: int):
+        del self.takes[stu][sec]
+        self.left[sec] += 1
+
+    def search(self, q: list) -> List[dict]:
+        (stu, semester, cid, name, instructor, day, time, locations, course_type,
+         ignore_full, ignore_conflict, ignore_passed, ignore_missing, size, index) = q
+        data = self.data
+        day = day and day[1]
+        locations = locations and locations[1]
+        course_type = course_type[1]
+        major = data.major[stu]
+        passed = self.passed(stu)
+        enrolled = self.enrolled_in(stu, semester)
+        res = []
+        for sec in self.ordered[semester]:
+            s = data.sections[sec]
+            course = s['course']
+            cls = data.classes[sec]
+            if cid and cid not in course:
+                continue
+            if name and name not in self.names[sec]:
+                continue
+            if instructor and not any(instructor in data.instructor[c['instructor']['id']] for c in cls):
+                continue
+            if day and not any(c['dayOfWeek'] == day for c in cls):
+                continue
+            if time and not any(c['classBegin'] <= time <= c['classEnd'] for c in cls):
+                continue
+            if locations and not any(loc in c['location'] for c in cls for loc in locations):
+                continue
+            if course_type == 'MAJOR_COMPULSORY' and course not in data.compulsory[major]:
+                continue
+            if course_type == 'MAJOR_ELECTIVE' and course not in data.elective[major]:
+                continue
+            if course_type == 'CROSS_MAJOR' and not self.majors_of.get(course, set()) - {major}:
+                continue
+            if course_type == 'PUBLIC' and course in self.majors_of:
+                continue
+            if ignore_full and self.left[sec] <= 0:
+                continue
+            if ignore_passed and course in passed:
+                continue
+            if ignore_missing and not self.satisfied(data.prerequisites[course], passed):
+                continue
+            if ignore_conflict and any(self.conflict(sec, e) for e in enrolled):
+                continue
+            res.append(sec)
+        ans = []
+        for sec in res[size * index:size * (index + 1)]:
+            s = data.sections[sec]
+            c = data.course[s['course']]
+            conflicts = [] if ignore_conflict else \
+                sorted({self.names[e] for e in enrolled if self.conflict(sec, e)})
+            ans.append({'@type': 'cn.edu.sustech.cs307.dto.CourseSearchEntry',
+                        'course': {k: c[k] for k in ('id', 'name', 'credit', 'classHour', 'grading')},
+                        'section': {'id': sec, 'name': s['name'], 'totalCapacity': s['totalCapacity'],
+                                    'leftCapacity': self.left[sec]},
+                        'sectionClasses': [dict(cl, instructor={'id': cl['instructor']['id'],
+                                                                'fullName': data.instructor[cl['instructor']['id']]})
+                                           for cl in data.classes[sec]],
+                        'conflictCourseNames': conflicts})
+        return ans
+
+    def course_table(self, stu: int, day: int) -> dict:
+        d = local_date(day * 86400 * 1000)
+        table = {name: [] for name in DAYS}
+        for semester, begin, end in self.ranges:
+            if begin <= d <= end:
+                break
+        else:
+            return {'@type': 'cn.edu.sustech.cs307.dto.CourseTable', 'table': table}
+        week = (d - begin).days // 7 + 1
+        for sec in self.enrolled_in(stu, semester):
+            for c in self.data.classes[sec]:
+                if week in c['weekList']:
+                    table[c['dayOfWeek']].append({
+                        'courseFullName': self.names[sec],
+                        'instructor': {'id': c['instructor']['id'],
+                                       'fullName': self.data.instructor[c['instructor']['id']]},
+                        'classBegin': c['classBegin'], 'classEnd': c['classEnd'], 'location': c['location']})
+        return {'@type': 'cn.edu.sustech.cs307.dto.CourseTable', 'table': table}
+
+
+class workload:
+    def __init__(self, data: dataset, state: model, seed: int):
+        self.data = data
+        self.state = state
+        self.rng = random.Random(seed)
+        self.current = data.current['id']
+
+    def student(self) -> int:
+        return self.rng.choice(self.data.students)['id']
+
+    def semester(self) -> int:
+        return self.current if self.rng.random() < 0.7 else self.rng.choice(self.data.semesters)['id']
+
+    def search_query(self, kind: str) -> list:
+        rng = self.rng
+        data = self.data
+        cid = name = instructor = day = time = locations = None
+        course_type = 'ALL'
+        if kind == 'Cid' or kind == 'Mixed' and rng.random() < 0.2:
+            c = rng.choice(data.courses)['id']
+            start = rng.randint(0, len(c) - 1)
+            cid = c[start:start + rng.randint(1, 4)]
+        if kind == 'Name' or kind == 'Mixed' and rng.random() < 0.2:
+            n = self.state.names[rng.choice(list(data.sections))] if data.sections else rng.choice(CJK_WORDS)
+            start = rng.randint(0, len(n) - 1)
+            name = n[start:start + rng.randint(1, 3)]
+        if kind == 'Instructor' or kind == 'Mixed' and rng.random() < 0.2:
+            n = data.instructor[rng.choice(data.instructors)['id']]
+            instructor = n[:rng.randint(1, len(n))]
+        if kind == 'Mixed':
+            if rng.random() < 0.2:
+                day = ['java.time.DayOfWeek', rng.choice(DAYS)]
+            if rng.random() < 0.2:
+                time = rng.randint(1, 11)
+            if rng.random() < 0.2:
+                locations = ['java.util.ArrayList', rng.sample(BUILDINGS, rng.randint(1, 4))]
+            if rng.random() < 0.3:
+                course_type = rng.choice(COURSE_TYPES)
+        size = rng.choice([5, 15, 30]) if kind == 'Mixed' and rng.random() < 0.3 else 10
+        index = rng.choice([0, 0, 0, 1, 2]) if kind in ('Basic', 'Mixed') else 0
+        return [self.student(), self.semester(), cid, name, instructor, day, time, locations,
+                ['cn.edu.sustech.cs307.service.StudentService$CourseType', course_type],
+                rng.random() < 0.5, rng.random() < 0.5, rng.random() < 0.5, rng.random() < 0.5, size, index]
+
+    def searches(self, out: str) -> int:
+        os.makedirs(out, exist_ok=True)
+        total = 0
+        for kind, n in SEARCHES.items():
+            queries = [self.search_query(kind) for _ in range(n)]
+            answers = [['java.util.ArrayList', self.state.search(q)] for q in queries]
+            dump(f'{out}/searchCourse{kind}.json', [['java.util.Arrays$ArrayList', q] for q in queries])
+            dump(f'{out}/searchCourse{kind}Result.json', answers)
+            total += n
+        return total
+
+    def enrolls(self, out: str) -> List[Tuple[int, int, str]]:
+        rng = self.rng
+        current = self.data.by_semester[self.current]
+        hot = [sec for sec in current if self.data.sections[sec]['totalCapacity'] < 10] or current
+        done = []
+        for i in range(ENROLLS):
+            kind = rng.random()
+            if kind < 0.02 or not current:
+                stu, sec = self.student(), MISSING_SECTION + i
+            elif kind < 0.1 and done:
+                stu, sec, _ = rng.choice(done)
+            elif kind < 0.2:
+                stu, sec = self.student(), rng.choice(hot)
+            else:
+                stu, sec = self.student(), rng.choice(current)
+            done.append((stu, sec, self.state.enroll(stu, sec)))
+        os.makedirs(out, exist_ok=True)
+        dump(f'{out}/enrollCourse.json', [['java.util.Arrays$ArrayList', [stu, sec]] for stu, sec, _ in done])
+        dump(f'{out}/enrollCourseResult.json',
+             [['cn.edu.sustech.cs307.service.StudentService$EnrollResult', res] for _, _, res in done])
+        return done
+
+    def drops(self, done: List[Tuple[int, int, str]]) -> int:
+        # the benchmark drops every successful enrollment
+        ok = [(stu, sec) for stu, sec, res in done if res == 'SUCCESS']
+        for stu, sec in ok:
+            self.state.drop(stu, sec)
+        return len(ok)
+
+    def tables(self, out: str) -> int:
+        rng = self.rng
+        epoch = date(1970, 1, 1)
+        queries = []
+        busy = [stu for stu, book in self.data.gradebooks.items() if book]
+        for _ in range(TABLES):
+            stu = rng.choice(busy) if busy and rng.random() < 0.9 else self.student()
+            books = list(self.state.takes[stu])
+            if books and rng.random() < 0.95:
+                s = self.data.semesters[self.data.sections[rng.choice(books)]['semester'] - 1]
+            else:
+                s = rng.choice(self.data.semesters)
+            begin, end = local_date(s['begin']), local_date(s['end'])
+            # a few days just outside the semester
+            d = begin + timedelta(days=rng.randint(-3, (end - begin).days + 3))
+            queries.append([stu, (d - epoch).days])
+        os.makedirs(out, exist_ok=True)
+        dump(f'{out}/courseTable.json', [['java.util.Arrays$ArrayList', q] for q in queries])
+        dump(f'{out}/courseTableResult.json', [self.state.course_table(*q) for q in queries])
+        return len(queries)
+
+
+def generate(out: str, scale: float, seed: int) -> Dict[str, int]:
+    data = dataset(scale, seed)
+    data.build()
+    data.write(out)
+    state = model(data)
+    work = workload(data, state, seed + 1)
+    # the same order as the benchmark phases
+    expected = {'search1': work.searches(f'{out}/searchCourse1')}
+    done = work.enrolls(f'{out}/enrollCourse1')
+    expected['enroll1'] = len(done)
+    expected['drop1'] = work.drops(done)
+    for stu, book in data.gradebooks.items():
+        state.takes[stu].update(book)
+    expected['student_course'] = sum(len(book) for book in data.gradebooks.values())
+    expected['drop_except'] = sum(g is not None for book in data.gradebooks.values() for g in book.values())
+    expected['table2'] = work.tables(f'{out}/courseTable2')
+    expected['search2'] = work.searches(f'{out}/searchCourse2')
+    done = work.enrolls(f'{out}/enrollCourse2')
+    expected['enroll2'] = len(done)
+    expected['drop2'] = work.drops(done)
+    dump(f'{out}/expected.json', expected)
+    return expected
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Generate a benchmark data set with answers.')
+    parser.add_argument('--scale', type=float, default=1.0, help='size relative to the shipped data set')
+    parser.add_argument('--seed', type=int, default=307, help='the same seed and scale give the same files')
+    parser.add_argument('--out', help='output directory, data/x<scale> by default')
+    args = parser.parse_args(argv)
+    if args.scale <= 0:
+        parser.error('--scale must be positive')
+    if args.out is None:
+        args.out = f'data/x{args.scale:g}'
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for phase, count in generate(args.out, args.scale, args.seed).items():
+        print(f'{phase}: {count}')
@@ -1,5 +1,5 @@
 from abc import ABC
-from typing import List, Optional
+from typing import Iterable, List, Optional, Tuple
 
 from dto import (Course, CourseGrading, CourseSection, CourseSectionClass,
                  DayOfWeek, Prerequisite, Student)
@@ -25,6 +25,23 @@ class CourseService(ABC):
                                        location: str) -> int:
         raise NotImplementedError
 
+    async def add_courses(
+            self,
+            courses: Iterable[Tuple[str, str, int, int, CourseGrading,
+                                    Optional[Prerequisite]]]):
+        raise NotImplementedError
+
+    async def add_course_sections(
+            self,
+            sections: Iterable[Tuple[str, int, str, int]]) -> List[int]:
+        raise NotImplementedError
+
+    async def add_course_section_classes(
+            self,
+            classes: Iterable[Tuple[int, int, DayOfWeek, List[int], int, int,
+                                    str]]) -> List[int]:
+        raise NotImplementedError
+
     async def remove_course(self, course_id: str):
         raise NotImplementedError
 
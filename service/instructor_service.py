@@ -1,5 +1,5 @@
 from abc import ABC
-from typing import List
+from typing import AsyncIterable, Iterable, List, Tuple, Union
 
 from dto import CourseSection
 
@@ -9,6 +9,13 @@ class InstructorService(ABC):
                              last_name: str):
         raise NotImplementedError
 
+    async def add_instructors(
+            self,
+            records: Union[Iterable[Tuple[int, str, str]],
+                           AsyncIterable[Tuple[int, str, str]]]
+    ) -> List[bool]:
+        raise NotImplementedError
+
     async def get_instructed_course_sections(self, instructor_id: int,
                                              semester_id: int
                                              ) -> List[CourseSection]:
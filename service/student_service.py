@@ -1,9 +1,10 @@
 from abc import ABC
 import datetime
-from typing import List, Mapping, Optional
+from typing import (AsyncIterable, Iterable, List, Mapping, Optional, Tuple,
+                    Union)
 
-from dto import (Course, CourseSearchEntry, CourseTable, CourseType,
-                 DayOfWeek, EnrollResult, Grade, Major)
+from dto import (Course, CourseSearchEntry, CourseSearchPage, CourseTable,
+                 CourseType, DayOfWeek, EnrollResult, Grade, Major)
 
 
 class StudentService(ABC):
@@ -11,6 +12,15 @@ class StudentService(ABC):
                           last_name: str, enrolled_date: datetime.date):
         raise NotImplementedError
 
+    async def add_students(
+            self,
+            records: Union[Iterable[Tuple[int, int, str, str,
+                                          datetime.date]],
+                           AsyncIterable[Tuple[int, int, str, str,
+                                               datetime.date]]]
+    ) -> List[bool]:
+        raise NotImplementedError
+
     async def search_course(self, *, student_id: int, semester_id: int,
                             search_cid: Optional[str] = None,
                             search_name: Optional[str] = None,
@@ -26,6 +36,22 @@ class StudentService(ABC):
                             ) -> List[CourseSearchEntry]:
         raise NotImplementedError
 
+    async def search_course_page(self, *, student_id: int, semester_id: int,
+                                 search_cid: Optional[str] = None,
+                                 search_name: Optional[str] = None,
+                                 search_instructor: Optional[str] = None,
+                                 search_day_of_week:
+                                 Optional[DayOfWeek] = None,
+                                 search_class_time: Optional[int] = None,
+                                 search_class_locations: List[str] = None,
+                                 search_course_type: CourseType,
+                                 ignore_full: bool, ignore_conflict: bool,
+                                 ignore_passed: bool,
+                                 ignore_missing_prerequisites: bool,
+                                 page_size: int, cursor: Optional[str] = None
+                                 ) -> CourseSearchPage:
+        raise NotImplementedError
+
     async def enroll_course(self, student_id: int, section_id: int) \
             -> EnrollResult:
         raise NotImplementedError
@@ -38,6 +64,13 @@ class StudentService(ABC):
                                              grade: Optional[Grade]):
         raise NotImplementedError
 
+    async def add_enrolled_courses_with_grade(
+            self,
+            records: Union[Iterable[Tuple[int, int, Optional[Grade]]],
+                           AsyncIterable[Tuple[int, int, Optional[Grade]]]]
+    ) -> List[bool]:
+        raise NotImplementedError
+
     async def set_enrolled_course_grade(self, student_id: int,
                                         section_id: int, grade: Grade):
         raise NotImplementedError
@@ -51,6 +84,16 @@ class StudentService(ABC):
             -> CourseTable:
         raise NotImplementedError
 
+    async def get_semester_course_tables(self, student_id: int,
+                                         semester_id: int) \
+            -> Mapping[int, CourseTable]:
+        raise NotImplementedError
+
+    async def get_course_tables(self, student_id: int, begin: datetime.date,
+                                end: datetime.date) \
+            -> Mapping[Tuple[int, int], CourseTable]:
+        raise NotImplementedError
+
     async def passed_prerequisites_for_course(self, student_id: int,
                                               course_id: str) -> bool:
         raise NotImplementedError